@@ -1,102 +1,105 @@
+import os
+import sys
+import time
+
+_IMPORT_STARTED = time.perf_counter()
+
 from flask import Flask
 from .config import get_config
 from .extensions import init_extensions
+from .services.serialization import FastJSONProvider
+
+
+_imports_reported = False
 
 
 def create_app() -> Flask:
+    started = time.perf_counter()
     app = Flask(__name__, static_folder=None, template_folder="../public")
     app.config.from_object(get_config())
+    app.json = FastJSONProvider(app)
+    phases = [("config", time.perf_counter())]
 
     # Initialize extensions (db, migrate, login, socketio)
     init_extensions(app)
+    phases.append(("extensions", time.perf_counter()))
 
     # Register blueprints
     register_blueprints(app)
+    phases.append(("blueprints", time.perf_counter()))
 
     # Socket.IO namespaces
     from .services.socketio import register_socketio_namespaces
+    from .services.avatar_pipeline import avatar_pipeline
+    from .services.mail_outbox import mail_outbox
+    from .services.message_archive import message_archive
+    from .services.message_cache import message_cache
+    from .services.message_writer import message_writer
+    from .services.outbox import room_outbox
+    from .services.password_hasher import password_hasher
+    from .services.presence import presence
+    from .services.replicas import replica_router
+    from .services.room_directory import room_directory
+    from .services.room_numbers import room_numbers
+    from .services.search_index import search_index
+    from .services.typing import typing_aggregator
+    from .services.upload_store import upload_store
+    from .services.user_cache import user_cache
 
     register_socketio_namespaces()
-
-    # Bootstrap DB and seed minimal data for dev if tables missing
-    from .extensions import db
-    from .models.user import User
-    from .models.room import Room
-    from .models.feedback import Feedback  # Import to ensure table is created
-
-    with app.app_context():
-        db.create_all()
-        # Ensure new columns are present if DB pre-existed (simple auto-migration)
-        try:
-            from sqlalchemy import inspect, text
-
-            inspector = inspect(db.engine)
-            user_columns = {c["name"] for c in inspector.get_columns("users")}
-            if "name" not in user_columns:
-                db.session.execute(text("ALTER TABLE users ADD COLUMN name VARCHAR(120) NULL"))
-                db.session.commit()
-            if "image" not in user_columns:
-                db.session.execute(text("ALTER TABLE users ADD COLUMN image VARCHAR(255) NULL"))
-                db.session.commit()
-            # Check rooms table
-            room_columns = {c["name"] for c in inspector.get_columns("rooms")}
-            if "is_active" not in room_columns:
-                db.session.execute(text("ALTER TABLE rooms ADD COLUMN is_active BOOLEAN NOT NULL DEFAULT TRUE"))
-                db.session.commit()
-            if "room_no" not in room_columns:
-                db.session.execute(text("ALTER TABLE rooms ADD COLUMN room_no VARCHAR(50) NULL"))
-                db.session.commit()
-                # Create index for room_no
-                try:
-                    db.session.execute(text("CREATE INDEX ix_rooms_room_no ON rooms(room_no)"))
-                    db.session.commit()
-                except Exception:
-                    pass  # Index might already exist
-            if "room_type" not in room_columns:
-                db.session.execute(text("ALTER TABLE rooms ADD COLUMN room_type VARCHAR(20) NOT NULL DEFAULT 'public'"))
-                db.session.commit()
-            if "password_hash" not in room_columns:
-                db.session.execute(text("ALTER TABLE rooms ADD COLUMN password_hash VARCHAR(255) NULL"))
-                db.session.commit()
-            
-            # Generate room_no for existing rooms that don't have one
-            from .models.room import Room, generate_room_no
-            rooms_without_no = Room.query.filter_by(room_no=None).all()
-            for room in rooms_without_no:
-                room.room_no = generate_room_no(db.session)
-            if rooms_without_no:
-                db.session.commit()
-        except Exception:
-            # Soft-fail; continue startup and allow manual migration if needed
-            pass
-        # Seed admin user and default rooms if not present
-        admin = User.query.filter_by(email="admin@example.com").first()
-        if not admin:
-            admin = User(email="admin@example.com", role="admin", name="admin")
-            admin.set_password("admin123")
-            db.session.add(admin)
-            db.session.commit()
-        else:
-            updated = False
-            if admin.name != "admin":
-                admin.name = "admin"
-                updated = True
-            if not admin.password_hash or not admin.password_hash.startswith("$2"):
-                admin.set_password("admin123")
-                updated = True
-            if updated:
-                db.session.commit()
-        admin = User.query.filter_by(email="admin@example.com").first()
-        if admin:
-            default_rooms = ["測試 1 Room", "測試 2 Room", "測試 3 Room"]
-            for rn in default_rooms:
-                if not Room.query.filter_by(name=rn).first():
-                    db.session.add(Room(name=rn, created_by=admin.id))
-            db.session.commit()
+    message_writer.init_app(app)
+    password_hasher.init_app(app)
+    avatar_pipeline.init_app(app)
+    upload_store.init_app(app)
+    mail_outbox.init_app(app)
+    message_archive.init_app(app)
+    room_numbers.init_app(app)
+    room_outbox.init_app(app)
+    search_index.init_app(app)
+    message_cache.init_app(app, app.extensions.get("chat_broker"))
+    presence.init_app(app, app.extensions.get("chat_broker"))
+    typing_aggregator.init_app(app, app.extensions.get("chat_broker"))
+    user_cache.init_app(app, app.extensions.get("chat_broker"))
+    room_directory.init_app(app, app.extensions.get("chat_broker"))
+    replica_router.init_app(app, app.extensions.get("chat_broker"))
+
+    phases.append(("services", time.perf_counter()))
+
+    # Pool metrics; DB_POOL_WARMUP opens connections now instead of on the first requests
+    from .services.db_pool import db_pool
+
+    db_pool.init_app(app)
+    phases.append(("db_pool", time.perf_counter()))
+
+    # Schema and seed data: "flask init-db" / "flask seed", or AUTO_INIT_DB for development
+    from . import bootstrap
+
+    bootstrap.init_app(app)
+    phases.append(("database", time.perf_counter()))
+    _report_startup(app, started, phases)
 
     return app
 
 
+def _report_startup(app: Flask, started: float, phases: list) -> None:
+    """Record how long create_app took, per phase, and print it if STARTUP_REPORT is on."""
+    global _imports_reported
+    timings = {}
+    if not _imports_reported:
+        # Importing the app package (Flask, SQLAlchemy, ...) only costs the first app of a process
+        timings["imports"] = round((started - _IMPORT_STARTED) * 1000, 1)
+        _imports_reported = True
+    last = started
+    for name, at in phases:
+        timings[name] = round((at - last) * 1000, 1)
+        last = at
+    total = round(sum(timings.values()), 1)
+    app.extensions["startup_timing"] = dict(timings, total=total)
+    if app.config.get("STARTUP_REPORT"):
+        details = ", ".join(f"{name} {ms:g}" for name, ms in timings.items())
+        print(f"[startup] pid {os.getpid()}: app ready in {total:g} ms ({details})", file=sys.stderr, flush=True)
+
+
 def register_blueprints(app: Flask) -> None:
     from .controllers.main import bp as main_bp
     from .controllers.auth import bp as auth_bp
@@ -104,7 +107,7 @@ def register_blueprints(app: Flask) -> None:
     from .controllers.messages import bp as messages_bp
     from .controllers.feedback import bp as feedback_bp
     from .extensions import login_manager
-    from .models.user import User
+    from .services.user_cache import user_cache
 
     app.register_blueprint(main_bp)
     app.register_blueprint(auth_bp)
@@ -114,6 +117,7 @@ def register_blueprints(app: Flask) -> None:
 
     @login_manager.user_loader
     def load_user(user_id: str):
-        return User.query.get(int(user_id))
+        # Served from the profile cache; no query on a warm entry
+        return user_cache.load_user(int(user_id))
 
 
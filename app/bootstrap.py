@@ -0,0 +1,140 @@
+"""Database setup kept out of ``create_app``.
+
+Worker processes never touch the database while starting; the schema and the
+seed data are applied explicitly, once per deployment:
+
+    flask --app wsgi init-db   # create missing tables, patch older schemas, backfill room_no
+    flask --app wsgi seed      # admin user and default rooms
+
+Both are idempotent. ``AUTO_INIT_DB=true`` runs them from ``create_app``
+instead, which is convenient for a throwaway development database.
+"""
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import inspect, text, update
+
+from .extensions import db
+
+
+ADMIN_EMAIL = "admin@example.com"
+ADMIN_PASSWORD = "admin123"
+DEFAULT_ROOMS = ["測試 1 Room", "測試 2 Room", "測試 3 Room"]
+BACKFILL_CHUNK_SIZE = 1000
+
+
+def init_db() -> None:
+    """Create missing tables and bring tables from older versions up to date."""
+    # Every model has to be imported for create_all to know its table
+    from .models.feedback import Feedback  # noqa: F401
+    from .models.mail_job import MailJob  # noqa: F401
+    from .models.membership import RoomMembership  # noqa: F401
+    from .models.message import Message  # noqa: F401
+    from .models.message_term import MessageTerm  # noqa: F401
+    from .models.replica_heartbeat import ReplicaHeartbeat  # noqa: F401
+    from .models.room import Room, generate_room_nos
+    from .models.user import User  # noqa: F401
+
+    # Primary only: replicas get the schema through replication
+    db.create_all(bind_key=None)
+    inspector = inspect(db.engine)
+    user_columns = {c["name"] for c in inspector.get_columns("users")}
+    if "name" not in user_columns:
+        _execute("ALTER TABLE users ADD COLUMN name VARCHAR(120) NULL")
+    if "image" not in user_columns:
+        _execute("ALTER TABLE users ADD COLUMN image VARCHAR(255) NULL")
+    user_indexes = {i["name"] for i in inspector.get_indexes("users")}
+    if "ix_users_role_name_id" not in user_indexes:
+        _execute("CREATE INDEX ix_users_role_name_id ON users(role, name, id)")
+    room_columns = {c["name"] for c in inspector.get_columns("rooms")}
+    if "is_active" not in room_columns:
+        _execute("ALTER TABLE rooms ADD COLUMN is_active BOOLEAN NOT NULL DEFAULT TRUE")
+    if "room_no" not in room_columns:
+        _execute("ALTER TABLE rooms ADD COLUMN room_no VARCHAR(50) NULL")
+        try:
+            _execute("CREATE INDEX ix_rooms_room_no ON rooms(room_no)")
+        except Exception:
+            db.session.rollback()  # Index might already exist
+    if "room_type" not in room_columns:
+        _execute("ALTER TABLE rooms ADD COLUMN room_type VARCHAR(20) NOT NULL DEFAULT 'public'")
+    if "password_hash" not in room_columns:
+        _execute("ALTER TABLE rooms ADD COLUMN password_hash VARCHAR(255) NULL")
+    # Keyset index on messages (room_id, created_at, id)
+    message_indexes = {i["name"] for i in inspector.get_indexes("messages")}
+    if "ix_room_created_id" not in message_indexes:
+        is_mysql = db.engine.dialect.name == "mysql"
+        if is_mysql:
+            _execute("ALTER TABLE messages MODIFY created_at DATETIME(6) NOT NULL")
+        _execute("CREATE INDEX ix_room_created_id ON messages(room_id, created_at, id)")
+        if "ix_room_created" in message_indexes:
+            try:
+                _execute("DROP INDEX ix_room_created ON messages" if is_mysql else "DROP INDEX ix_room_created")
+            except Exception:
+                db.session.rollback()  # Superseded index; harmless if it stays
+
+    # Rooms created before room_no existed
+    ids = [room_id for (room_id,) in db.session.query(Room.id).filter(Room.room_no.is_(None))]
+    for start in range(0, len(ids), BACKFILL_CHUNK_SIZE):
+        chunk = ids[start:start + BACKFILL_CHUNK_SIZE]
+        # One allocation and one executemany per chunk
+        rows = [{"id": room_id, "room_no": room_no} for room_id, room_no in zip(chunk, generate_room_nos(len(chunk)))]
+        db.session.execute(update(Room), rows)
+        db.session.commit()
+
+
+def seed() -> None:
+    """Admin user and default rooms, if missing."""
+    from .models.room import Room, generate_room_no
+    from .models.user import User
+
+    admin = User.query.filter_by(email=ADMIN_EMAIL).first()
+    if not admin:
+        admin = User(email=ADMIN_EMAIL, role="admin", name="admin")
+        admin.set_password(ADMIN_PASSWORD)
+        db.session.add(admin)
+        db.session.commit()
+    else:
+        updated = False
+        if admin.name != "admin":
+            admin.name = "admin"
+            updated = True
+        if not admin.password_hash or not admin.password_hash.startswith("$2"):
+            admin.set_password(ADMIN_PASSWORD)
+            updated = True
+        if updated:
+            db.session.commit()
+    existing = {name for (name,) in db.session.query(Room.name).filter(Room.name.in_(DEFAULT_ROOMS))}
+    for name in DEFAULT_ROOMS:
+        if name not in existing:
+            db.session.add(Room(name=name, room_no=generate_room_no(), created_by=admin.id))
+    db.session.commit()
+
+
+def _execute(sql: str) -> None:
+    db.session.execute(text(sql))
+    db.session.commit()
+
+
+@click.command("init-db")
+@with_appcontext
+def init_db_command():
+    """Create missing tables and upgrade the schema of older databases."""
+    init_db()
+    click.echo("Database schema is up to date")
+
+
+@click.command("seed")
+@with_appcontext
+def seed_command():
+    """Create the admin user and the default rooms if they are missing."""
+    seed()
+    click.echo("Seed data is in place")
+
+
+def init_app(app) -> None:
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(seed_command)
+    if app.config.get("AUTO_INIT_DB"):
+        with app.app_context():
+            init_db()
+            seed()
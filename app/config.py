@@ -7,6 +7,13 @@ load_dotenv()
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except (ValueError, TypeError):
+        return default
+
+
 class Config:
     SECRET_KEY = os.getenv("SECRET_KEY", "dev-secret-key")
     
@@ -25,11 +32,43 @@ class Config:
     
     SQLALCHEMY_DATABASE_URI = os.getenv("DATABASE_URL", db_url)
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Read replicas (comma-separated URLs) for history, member and room-info reads
+    DATABASE_REPLICA_URLS = os.getenv("DATABASE_REPLICA_URLS", "").strip()
+    # Replicas further behind than this get no reads; lag is checked this often
+    REPLICA_MAX_LAG_SECONDS = _env_int("REPLICA_MAX_LAG_SECONDS", 5)
+    REPLICA_HEALTH_INTERVAL_SECONDS = _env_int("REPLICA_HEALTH_INTERVAL_SECONDS", 2)
+    REPLICA_WRITES_CHANNEL = os.getenv("REPLICA_WRITES_CHANNEL", "chat-read-your-writes")
+    # Connection pool per worker process: keep DB_POOL_SIZE at least the uWSGI threads;
+    # overflow connections are opened under bursts and closed when returned
+    DB_POOL_SIZE = _env_int("DB_POOL_SIZE", 10)
+    DB_MAX_OVERFLOW = _env_int("DB_MAX_OVERFLOW", 10)
+    # Seconds a request waits for a free connection before failing
+    DB_POOL_TIMEOUT = _env_int("DB_POOL_TIMEOUT", 10)
+    # Replace connections older than this (keep it below MySQL's wait_timeout)
+    DB_POOL_RECYCLE = _env_int("DB_POOL_RECYCLE", 1800)
+    # Test each connection on checkout so ones closed by the server are replaced, not used
+    DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+    # Connections to open while the worker starts (0 = on demand)
+    DB_POOL_WARMUP = _env_int("DB_POOL_WARMUP", 0)
     SESSION_COOKIE_SECURE = os.getenv("SESSION_COOKIE_SECURE", "false").lower() == "true"
     UPLOAD_FOLDER = os.path.join(BASE_DIR, "assets", "uploads")
+    # Messages older than ARCHIVE_AFTER_DAYS move to compressed per-room, per-month
+    # segments in ARCHIVE_FOLDER when "flask archive-messages" runs (e.g. daily from cron)
+    ARCHIVE_FOLDER = os.getenv("ARCHIVE_FOLDER", os.path.join(BASE_DIR, "archive"))
+    ARCHIVE_AFTER_DAYS = _env_int("ARCHIVE_AFTER_DAYS", 180)
+    ARCHIVE_BLOCK_MESSAGES = _env_int("ARCHIVE_BLOCK_MESSAGES", 256)
+    ARCHIVE_BATCH_SIZE = _env_int("ARCHIVE_BATCH_SIZE", 2000)
+    # Decompressed blocks kept per process for paging through the archive
+    ARCHIVE_BLOCK_CACHE = _env_int("ARCHIVE_BLOCK_CACHE", 256)
     MAX_CONTENT_LENGTH = 2 * 1024 * 1024  # 2MB max file size
     ALLOWED_EXTENSIONS = {"png", "jpg", "jpeg", "gif"}
     
+    # Run "flask init-db" and "flask seed" from create_app (development only: every
+    # worker would patch the schema while booting)
+    AUTO_INIT_DB = os.getenv("AUTO_INIT_DB", "false").lower() == "true"
+    # Print how long create_app took, per phase, to stderr (the uWSGI log)
+    STARTUP_REPORT = os.getenv("STARTUP_REPORT", "true").lower() == "true"
+
     # Email configuration from .env
     MAIL_SERVER = os.getenv("MAIL_SERVER", "localhost")
     # Support both TLS (587) and SSL (465) ports
@@ -60,6 +99,97 @@ class Config:
     
     # Optional: Mail debug mode
     MAIL_DEBUG = os.getenv("MAIL_DEBUG", "false").lower() == "true"
+    # Mails go through the mail_outbox table; each web process runs a sender unless
+    # MAIL_OUTBOX_SENDER=false (then run "flask mail-outbox" from cron)
+    MAIL_OUTBOX_SENDER = os.getenv("MAIL_OUTBOX_SENDER", "true").lower() == "true"
+    MAIL_OUTBOX_BATCH_SIZE = _env_int("MAIL_OUTBOX_BATCH_SIZE", 20)
+    MAIL_OUTBOX_POLL_SECONDS = _env_int("MAIL_OUTBOX_POLL_SECONDS", 15)
+    # Retries back off from BASE doubling up to MAX; after MAX_ATTEMPTS a mail is dead
+    MAIL_MAX_ATTEMPTS = _env_int("MAIL_MAX_ATTEMPTS", 8)
+    MAIL_RETRY_BASE_SECONDS = _env_int("MAIL_RETRY_BASE_SECONDS", 30)
+    MAIL_RETRY_MAX_SECONDS = _env_int("MAIL_RETRY_MAX_SECONDS", 3600)
+
+    # Cross-process Socket.IO fan-out and presence (required for uWSGI processes > 1)
+    # local://name, unix:///tmp/chat-broker.sock, redis://host:6379/0, or any
+    # Flask-SocketIO message_queue URL (amqp://, kafka://, ...). Empty = single process
+    # "threading" (uWSGI threads, default) or "eventlet": one process serves thousands of
+    # idle websocket / long-poll connections on green threads (run: python wsgi.py)
+    SOCKETIO_ASYNC_MODE = os.getenv("SOCKETIO_ASYNC_MODE", "threading").strip().lower()
+    # eventlet mode only: concurrent connections the server accepts, and listen backlog
+    SOCKETIO_MAX_CONNECTIONS = _env_int("SOCKETIO_MAX_CONNECTIONS", 20000)
+    SOCKETIO_LISTEN_BACKLOG = _env_int("SOCKETIO_LISTEN_BACKLOG", 2048)
+    SOCKETIO_MESSAGE_QUEUE = os.getenv("SOCKETIO_MESSAGE_QUEUE", "").strip()
+    SOCKETIO_CHANNEL = os.getenv("SOCKETIO_CHANNEL", "flask-socketio")
+    PRESENCE_CHANNEL = os.getenv("PRESENCE_CHANNEL", "chat-presence")
+    PRESENCE_HEARTBEAT_SECONDS = _env_int("PRESENCE_HEARTBEAT_SECONDS", 10)
+    PRESENCE_NODE_TTL = _env_int("PRESENCE_NODE_TTL", 30)
+    # Presence changes per room are coalesced over this window into one presence_delta
+    PRESENCE_DELTA_WINDOW_MS = _env_int("PRESENCE_DELTA_WINDOW_MS", 250)
+    # Typing indicators: one typing_summary per room per interval; silent typists expire after the TTL
+    TYPING_INTERVAL_MS = _env_int("TYPING_INTERVAL_MS", 500)
+    TYPING_TTL_SECONDS = _env_int("TYPING_TTL_SECONDS", 5)
+
+    # Message persistence
+    # "sync": commit each message before broadcasting it (default)
+    # "write_behind": assign id/timestamp in-process, broadcast immediately and
+    # flush to the messages table in batched multi-row inserts
+    MESSAGE_WRITE_MODE = os.getenv("MESSAGE_WRITE_MODE", "sync").strip().lower()
+    MESSAGE_BATCH_MAX_SIZE = _env_int("MESSAGE_BATCH_MAX_SIZE", 200)
+    MESSAGE_BATCH_MAX_DELAY_MS = _env_int("MESSAGE_BATCH_MAX_DELAY_MS", 50)
+    # Pending messages above this limit are flushed inline by the sender (backpressure)
+    MESSAGE_WRITE_QUEUE_MAX = _env_int("MESSAGE_WRITE_QUEUE_MAX", 10000)
+    # Newest messages per room kept in memory to serve GET /rooms/<id>/messages
+    MESSAGE_CACHE_ENABLED = os.getenv("MESSAGE_CACHE_ENABLED", "true").lower() == "true"
+    MESSAGE_CACHE_PER_ROOM = _env_int("MESSAGE_CACHE_PER_ROOM", 200)
+    MESSAGE_CACHE_MAX_BYTES = _env_int("MESSAGE_CACHE_MAX_BYTES", 32 * 1024 * 1024)
+    # Room events (new_message, user_joined, user_left, typing_summary) queued per room
+    # and sent as one "batch" packet every interval; 0 sends each event on its own
+    EMIT_BATCH_INTERVAL_MS = _env_int("EMIT_BATCH_INTERVAL_MS", 0)
+    EMIT_BATCH_MAX_SIZE = _env_int("EMIT_BATCH_MAX_SIZE", 100)
+    # Maintain the message search index (message_terms) when messages are written;
+    # rebuild it with "flask search-reindex"
+    SEARCH_INDEX_ENABLED = os.getenv("SEARCH_INDEX_ENABLED", "true").lower() == "true"
+    # Reconnect catch-up (sync): rooms per request, and missed messages per room
+    # before the client is told to reload the room instead
+    SYNC_MAX_ROOMS = _env_int("SYNC_MAX_ROOMS", 100)
+    SYNC_MAX_MESSAGES = _env_int("SYNC_MAX_MESSAGES", 100)
+    # User profile cache (login user loader and message author name/image)
+    USER_CACHE_TTL_SECONDS = _env_int("USER_CACHE_TTL_SECONDS", 300)
+    USER_CACHE_MAX_ENTRIES = _env_int("USER_CACHE_MAX_ENTRIES", 50000)
+    # Room list cache for GET /rooms (room changes and joins/leaves invalidate it)
+    ROOM_DIRECTORY_TTL_SECONDS = _env_int("ROOM_DIRECTORY_TTL_SECONDS", 60)
+    ROOM_DIRECTORY_MAX_USERS = _env_int("ROOM_DIRECTORY_MAX_USERS", 50000)
+    # bcrypt cost for new password hashes; older hashes are upgraded on the next login
+    PASSWORD_HASH_ROUNDS = _env_int("PASSWORD_HASH_ROUNDS", 12)
+    # Threads that run bcrypt (0 = one per CPU). Calls past the admission limit are refused
+    # with 503 + Retry-After; under uWSGI the limit is its request threads minus
+    # PASSWORD_HASH_RESERVE_THREADS (left for other requests), otherwise workers + 32.
+    # PASSWORD_HASH_QUEUE_MAX >= 0 sets it to workers + that many waiting calls instead
+    PASSWORD_HASH_WORKERS = _env_int("PASSWORD_HASH_WORKERS", 0)
+    PASSWORD_HASH_QUEUE_MAX = _env_int("PASSWORD_HASH_QUEUE_MAX", -1)
+    PASSWORD_HASH_RESERVE_THREADS = _env_int("PASSWORD_HASH_RESERVE_THREADS", 2)
+    # Avatar uploads are converted in the background into a WebP of at most
+    # AVATAR_MAX_SIZE px plus one square variant per AVATAR_SIZES entry (the smallest
+    # is what chat messages and /members reference)
+    AVATAR_WORKERS = _env_int("AVATAR_WORKERS", 2)
+    AVATAR_QUEUE_MAX = _env_int("AVATAR_QUEUE_MAX", 32)
+    AVATAR_SIZES = os.getenv("AVATAR_SIZES", "96,256").strip()
+    AVATAR_MAX_SIZE = _env_int("AVATAR_MAX_SIZE", 1024)
+    # WebP encoder effort, 0 (fastest) to 6 (smallest files)
+    AVATAR_WEBP_METHOD = _env_int("AVATAR_WEBP_METHOD", 4)
+    # /assets/uploads: names whose file lookup is kept in memory, browser cache lifetime
+    # (files are never rewritten), and an nginx internal location to hand the body to
+    # (e.g. "/_uploads/", aliased to UPLOAD_FOLDER); empty serves files from Python
+    UPLOAD_STAT_CACHE_MAX = _env_int("UPLOAD_STAT_CACHE_MAX", 10000)
+    UPLOAD_MAX_AGE_SECONDS = _env_int("UPLOAD_MAX_AGE_SECONDS", 365 * 24 * 3600)
+    UPLOAD_ACCEL_REDIRECT = os.getenv("UPLOAD_ACCEL_REDIRECT", "").strip()
+    # room_no node id (0-65535), distinct per host; defaults to a hash of the host name
+    ROOM_NO_NODE_ID = os.getenv("ROOM_NO_NODE_ID", "").strip()
+    # With several writer processes, each allocates ids congruent to OFFSET + (uWSGI worker id - 1)
+    # mod STRIDE. STRIDE must cover every worker on every node; OFFSET is the node's first
+    # slot, unique per node (e.g. 0 and 4 for two nodes of 4 workers, STRIDE=8)
+    MESSAGE_ID_STRIDE = _env_int("MESSAGE_ID_STRIDE", 1)
+    MESSAGE_ID_OFFSET = os.getenv("MESSAGE_ID_OFFSET", "").strip()
 
 
 def get_config() -> type[Config]:
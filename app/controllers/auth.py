@@ -1,22 +1,15 @@
-from flask import Blueprint, request, jsonify, render_template, send_from_directory, current_app
+from flask import Blueprint, request, jsonify, render_template, send_from_directory, current_app, session
 from flask_login import login_user, logout_user, login_required, current_user
 from sqlalchemy.exc import IntegrityError
 from werkzeug.utils import secure_filename
-import os
+import io
 from PIL import Image
-try:
-    from uuid7 import uuid7
-except ImportError:
-    # Fallback: simple UUID7-like generator using timestamp + random
-    import time
-    import random
-    def uuid7():
-        """Simple UUID7-like generator (timestamp + random)"""
-        timestamp_ms = int(time.time() * 1000)
-        random_part = random.randint(0, 0xFFFFFFFFFFFF)
-        return f"{timestamp_ms:013x}-{random_part:012x}"
 from ..extensions import db
 from ..models.user import User
+from ..services.avatar_pipeline import avatar_pipeline
+from ..services.etag import make_etag, not_modified, with_etag
+from ..services.password_hasher import PasswordHashBusy, password_hasher
+from ..services.user_cache import user_cache
 
 
 bp = Blueprint("auth", __name__, url_prefix="/auth")
@@ -49,6 +42,13 @@ def login():
     user = User.query.filter_by(email=email).first()
     if not user or not user.check_password(password):
         return jsonify({"error": "帳號或密碼錯誤"}), 401
+    if password_hasher.needs_rehash(user.password_hash):
+        # PASSWORD_HASH_ROUNDS changed: upgrade the hash while we have the password
+        try:
+            user.set_password(password)
+            db.session.commit()
+        except PasswordHashBusy:
+            pass
 
     login_user(user)
     return jsonify({"ok": True, "user": {"id": user.id, "email": user.email, "name": user.name, "image": user.image, "role": user.role}})
@@ -64,9 +64,18 @@ def logout():
 @bp.get("/me")
 def me():
     try:
+        # Version read before current_user loads its profile, so the tag is never newer than the body
+        session_user_id = session.get("_user_id")
+        version = user_cache.version(int(session_user_id)) if session_user_id else None
         if not current_user.is_authenticated:
             return jsonify({"authenticated": False})
-        return jsonify(
+        etag = None
+        if version is not None and str(current_user.id) == session_user_id:
+            etag = make_etag("me", current_user.id, version)
+            cached = not_modified(etag)
+            if cached is not None:
+                return cached
+        resp = jsonify(
             {
                 "authenticated": True,
                 "user": {
@@ -78,6 +87,7 @@ def me():
                 },
             }
         )
+        return with_etag(resp, etag) if etag else resp
     except Exception as e:
         current_app.logger.error(f"Error in /auth/me: {e}", exc_info=True)
         return jsonify({"authenticated": False, "error": "Internal server error"}), 500
@@ -95,11 +105,13 @@ def register():
     if User.query.filter_by(email=email).first():
         return jsonify({"error": "Email 重覆"}), 409
 
+    user = User(email=email, role="member", name=name)
+    user.set_password(password)  # outside the try: a busy hasher answers 503
     try:
-        user = User(email=email, role="member", name=name)
-        user.set_password(password)
         db.session.add(user)
         db.session.commit()
+        # New member: changes the /members list (and its ETag)
+        user_cache.invalidate(user.id)
         persisted = User.query.filter_by(email=email).first()
         if not persisted:
             raise RuntimeError("User not persisted after commit")
@@ -128,6 +140,7 @@ def register():
 @bp.post("/profile/upload")
 @login_required
 def upload_image():
+    """Queue an avatar for processing; poll ``/profile/upload/<job_id>`` for the result"""
     if "file" not in request.files:
         return jsonify({"error": "沒有選擇檔案"}), 400
     
@@ -138,57 +151,41 @@ def upload_image():
     if not allowed_file(file.filename):
         return jsonify({"error": "檔案格式不支援，僅支援 PNG, JPG, JPEG, GIF"}), 400
     
+    data = file.read()
     try:
-        upload_folder = current_app.config["UPLOAD_FOLDER"]
-        os.makedirs(upload_folder, exist_ok=True)
-        
-        # Generate UUID7 for filename
-        uuid7_value = uuid7()
-        filename = f"{uuid7_value}.webp"
-        filepath = os.path.join(upload_folder, filename)
-        
-        # Open and convert image to WebP
-        image = Image.open(file.stream)
-        # Convert RGBA to RGB if necessary (WebP doesn't support RGBA in all cases)
-        if image.mode in ('RGBA', 'LA', 'P'):
-            # Create a white background
-            rgb_image = Image.new('RGB', image.size, (255, 255, 255))
-            if image.mode == 'P':
-                image = image.convert('RGBA')
-            rgb_image.paste(image, mask=image.split()[-1] if image.mode == 'RGBA' else None)
-            image = rgb_image
-        elif image.mode != 'RGB':
-            image = image.convert('RGB')
-        
-        # Save as WebP with quality optimization
-        image.save(filepath, 'WEBP', quality=85, method=6)
-        
-        # Verify file was saved
-        if not os.path.exists(filepath):
-            raise RuntimeError(f"File was not saved: {filepath}")
-        
-        current_app.logger.info(f"Image saved: {filepath}, size: {os.path.getsize(filepath)} bytes")
-        
-        # Update user image
-        old_image = current_user.image
-        current_user.image = filename
-        db.session.commit()
-        
-        # Delete old image if exists
-        if old_image:
-            old_filepath = os.path.join(upload_folder, old_image)
-            if os.path.exists(old_filepath):
-                try:
-                    os.remove(old_filepath)
-                    current_app.logger.info(f"Deleted old image: {old_filepath}")
-                except Exception as e:
-                    current_app.logger.warning(f"Failed to delete old image: {e}")
-        
-        return jsonify({"ok": True, "image": filename})
-    except Exception as e:
-        db.session.rollback()
-        current_app.logger.error(f"Failed to upload image: {str(e)}")
-        return jsonify({"error": "上傳失敗", "detail": str(e)}), 500
+        # Only reads the header; decoding happens in the pipeline
+        Image.open(io.BytesIO(data))
+    except Exception:
+        return jsonify({"error": "檔案格式不支援，僅支援 PNG, JPG, JPEG, GIF"}), 400
+    
+    job = avatar_pipeline.submit(current_user.id, data)
+    if job is None:
+        resp = jsonify({"error": "伺服器忙碌中，請稍後再試"})
+        resp.status_code = 503
+        resp.headers["Retry-After"] = "1"
+        return resp
+    return jsonify({"ok": True, "job_id": job.id, "status": job.status}), 202
+
+
+@bp.get("/profile/upload/<job_id>")
+@login_required
+def upload_status(job_id: str):
+    image = avatar_pipeline.filename(job_id)
+    job = avatar_pipeline.get(current_user.id, job_id)
+    if job is None:
+        # Unknown here (another worker, or pruned): done if it is the current avatar
+        if current_user.image != image:
+            return jsonify({"error": "Job not found"}), 404
+        status, error = "done", None
+    else:
+        status, error = job.status, job.error
+    result = {"ok": status != "failed", "job_id": job_id, "status": status}
+    if status == "done":
+        result["image"] = image
+        result["variants"] = {str(size): avatar_pipeline.variant(image, size) for size in avatar_pipeline.sizes}
+    if error:
+        result["error"] = error
+    return jsonify(result)
 
 
 @bp.put("/profile")
@@ -201,14 +198,13 @@ def update_profile():
     if not name:
         return jsonify({"error": "姓名為必填"}), 400
     
+    user = current_user
+    if password:
+        user.set_password(password)  # outside the try: a busy hasher answers 503
     try:
-        user = current_user
         user.name = name
-        
-        if password:
-            user.set_password(password)
-        
         db.session.commit()
+        user_cache.invalidate(user.id)
         return jsonify({
             "ok": True,
             "user": {
@@ -1,8 +1,8 @@
 from flask import Blueprint, request, jsonify, current_app
 from flask_login import current_user
-from flask_mail import Message
-from ..extensions import db, mail
+from ..extensions import db
 from ..models.feedback import Feedback
+from ..services.mail_outbox import mail_outbox
 
 
 bp = Blueprint("feedback", __name__, url_prefix="/feedback")
@@ -36,15 +36,11 @@ def submit_feedback():
             user_id=current_user.id if current_user.is_authenticated else None
         )
         db.session.add(feedback)
-        db.session.commit()
-
-        # Send email notification
-        try:
-            msg = Message(
-                subject=f"Feedback: {subject}",
-                sender=current_app.config["MAIL_FROM"],
-                recipients=[current_app.config["MAIL_TO"]],
-                body=f"""收到新的意見回饋：
+        # Email notification: queued in the same transaction, sent in the background
+        mail_outbox.enqueue(
+            subject=f"Feedback: {subject}",
+            recipients=[current_app.config["MAIL_TO"]],
+            body=f"""收到新的意見回饋：
 
 姓名: {name}
 Email: {email}
@@ -55,12 +51,10 @@ Email: {email}
 
 ---
 此信件由系統自動發送
-"""
-            )
-            mail.send(msg)
-        except Exception as e:
-            # Log email error but don't fail the request
-            current_app.logger.error(f"Failed to send feedback email: {str(e)}")
+""",
+        )
+        db.session.commit()
+        mail_outbox.wake()
 
         return jsonify({"ok": True, "message": "意見回饋已送出"})
 
@@ -1,10 +1,15 @@
-from flask import Blueprint, render_template, send_from_directory, current_app, jsonify
+from flask import Blueprint, render_template, send_file, current_app, jsonify, request
 from flask_login import login_required
-import os
+import mimetypes
+import re
+from ..services.upload_store import upload_store
 
 
 bp = Blueprint("main", __name__)
 
+_VARIANT_RE = re.compile(r"^(.+)-\d+\.webp$")
+FALLBACK_MAX_AGE = 300
+
 
 @bp.get("/")
 @login_required
@@ -21,20 +26,33 @@ def join_room_page(room_no: str):
 
 @bp.get("/assets/uploads/<filename>")
 def uploaded_file(filename):
-    """Serve uploaded images from assets/uploads"""
-    upload_folder = current_app.config["UPLOAD_FOLDER"]
-    filepath = os.path.join(upload_folder, filename)
-    
-    # Check if file exists
-    if not os.path.exists(filepath):
-        current_app.logger.warning(f"Image not found: {filepath}")
-        return jsonify({"error": "Image not found"}), 404
-    
-    # Security: ensure filename doesn't contain path traversal
-    if os.path.dirname(os.path.abspath(filepath)) != os.path.abspath(upload_folder):
-        current_app.logger.warning(f"Path traversal attempt: {filename}")
-        return jsonify({"error": "Invalid filename"}), 400
+    """Serve uploaded images from assets/uploads (write-once, so cached for good)"""
+    max_age = upload_store.max_age
+    entry = upload_store.lookup(filename)
+    if entry is None:
+        # Size variant of an avatar uploaded before variants existed: the original
+        # will do, but only until `flask avatar-variants` creates the variant
+        match = _VARIANT_RE.match(filename)
+        entry = upload_store.lookup(match.group(1) + ".webp") if match else None
+        if entry is None:
+            return jsonify({"error": "Image not found"}), 404
+        max_age = FALLBACK_MAX_AGE
     
-    return send_from_directory(upload_folder, filename)
-
-
+    if entry.etag in request.if_none_match:
+        resp = current_app.response_class(status=304)
+    elif upload_store.accel_prefix:
+        # nginx sends the body (sendfile, no Python in the loop)
+        resp = current_app.response_class(mimetype=mimetypes.guess_type(entry.name)[0])
+        resp.headers["X-Accel-Redirect"] = upload_store.accel_prefix + entry.name
+    else:
+        try:
+            resp = send_file(entry.path, conditional=True, etag=False, last_modified=entry.mtime, max_age=max_age)
+        except FileNotFoundError:
+            upload_store.forget(entry.name)
+            return jsonify({"error": "Image not found"}), 404
+    resp.set_etag(entry.etag)
+    resp.last_modified = entry.mtime
+    resp.cache_control.public = True
+    resp.cache_control.max_age = max_age
+    resp.cache_control.immutable = max_age == upload_store.max_age
+    return resp
@@ -1,46 +1,294 @@
+import base64
+import binascii
 from datetime import datetime
-from flask import Blueprint, jsonify, request
-from flask_login import login_required
+from flask import Blueprint, current_app, jsonify, request
+from flask_login import current_user, login_required
+from ..extensions import db
+from ..models.membership import RoomMembership
 from ..models.message import Message
+from ..models.room import Room
+from ..services.avatar_pipeline import avatar_pipeline
+from ..services.history_sync import missed_messages, parse_positions
+from ..services.etag import make_etag, not_modified, with_etag
+from ..services.message_archive import message_archive
+from ..services.message_cache import message_cache
+from ..services.message_writer import message_writer
+from ..services.replicas import on_replica, primary_reads, replica_reads
+from ..services.search_index import decode_cursor as decode_search_cursor, encode_cursor as encode_search_cursor, search_index
+from ..services.serialization import dumps
+from ..services.user_cache import user_cache
 
 
 bp = Blueprint("messages", __name__)
 
 
+def _history_query(room_id: int = None):
+    """Exactly the message columns a history page serializes; authors come from the profile cache"""
+    query = db.session.query(
+        Message.id,
+        Message.room_id,
+        Message.user_id,
+        Message.content,
+        Message.created_at,
+    )
+    return query if room_id is None else query.filter(Message.room_id == room_id)
+
+
+def _serialize_messages(rows) -> list:
+    authors = user_cache.get_many(m.user_id for m in rows)
+    return _with_authors([
+        {
+            "id": m.id,
+            "room_id": m.room_id,
+            "user_id": m.user_id,
+            "content": m.content,
+            "created_at": m.created_at.isoformat() if m.created_at else None,
+        }
+        for m in rows
+    ], authors)
+
+
+def _with_authors(payloads: list, authors: dict = None) -> list:
+    """Fill author_name / author_image (small variant) from the profile cache (current, not as of sending)"""
+    if authors is None:
+        authors = user_cache.get_many(p["user_id"] for p in payloads)
+    result = []
+    for payload in payloads:
+        author = authors.get(payload["user_id"]) or {}
+        result.append(dict(payload, author_name=author.get("name"), author_image=avatar_pipeline.variant(author.get("image"))))
+    return result
+
+
+def _encode_cursor(payload: dict) -> str:
+    """Opaque keyset position of a message: its (created_at, id)"""
+    raw = f"{payload['created_at']}|{payload['id']}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        created_at, message_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(message_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+def _older_than(created_at: datetime, message_id: int):
+    # Expanded row comparison so MySQL range-scans ix_room_created_id
+    return db.or_(Message.created_at < created_at, db.and_(Message.created_at == created_at, Message.id < message_id))
+
+
+def _newer_than(created_at: datetime, message_id: int):
+    return db.or_(Message.created_at > created_at, db.and_(Message.created_at == created_at, Message.id > message_id))
+
+
+def _load_recent(room_id: int, limit: int) -> list:
+    # Primes the shared ring buffer, which new messages extend: no gap from a lagging replica
+    with primary_reads():
+        msgs = (
+            _history_query(room_id)
+            .order_by(Message.created_at.desc(), Message.id.desc())
+            .limit(limit)
+            .all()
+        )
+    if len(msgs) < limit:
+        # Quiet room: the rest of the newest page is archived
+        position = (msgs[-1].created_at, msgs[-1].id) if msgs else None
+        msgs += message_archive.older_than(room_id, position, limit - len(msgs))
+    return _serialize_messages(list(reversed(msgs)))
+
+
+def _encode_many(payloads: list) -> list:
+    return [dumps(p) for p in _with_authors(payloads)]
+
+
+def _page_response(payloads: list, has_more: bool, after_cursor: str = None, etag: str = None):
+    first, last = (payloads[0], payloads[-1]) if payloads else (None, None)
+    return _encoded_page_response(dumps(payloads), first, last, has_more, after_cursor, etag)
+
+
+def _encoded_page_response(body: bytes, first, last, has_more: bool, after_cursor: str = None, etag: str = None):
+    resp = current_app.response_class(body, mimetype="application/json")
+    if first is not None:
+        resp.headers["X-Before-Cursor"] = _encode_cursor(first)
+        resp.headers["X-After-Cursor"] = _encode_cursor(last)
+    elif after_cursor:
+        # Nothing new yet: keep polling from the same position
+        resp.headers["X-After-Cursor"] = after_cursor
+    resp.headers["X-Has-More"] = "true" if has_more else "false"
+    return with_etag(resp, etag) if etag else resp
+
+
 @bp.get("/rooms/<int:room_id>/messages")
 @login_required
+@replica_reads
 def get_messages(room_id: int):
+    """Message history, oldest first.
+
+    ``before=<cursor>`` pages backwards, ``after=<cursor>`` catches up forwards.
+    Cursors for both directions come back in ``X-Before-Cursor`` /
+    ``X-After-Cursor``; ``X-Has-More`` tells whether the requested direction has
+    more rows. ``before`` still accepts an ISO timestamp.
+
+    Pages carry an ETag that changes with every new message in the room or
+    author profile change; ``If-None-Match`` gets a 304 without a query.
+    """
     try:
         try:
             limit = max(1, min(int(request.args.get("limit", 50)), 200))
         except ValueError:
             limit = 50
         before_str = request.args.get("before")
-        query = Message.query.filter_by(room_id=room_id)
+        after_str = request.args.get("after")
+        # Both read before any rows, so the tag is never newer than the body
+        generation = user_cache.generation
+        room_version = message_cache.version(room_id)
+        etag = None
+        if room_version is not None:
+            etag = make_etag("messages", room_id, room_version, generation)
+            cached = not_modified(etag)
+            if cached is not None:
+                return cached
+        if not before_str and not after_str:
+            # Newest page: served from the per-room ring buffer, primed on first read,
+            # as an already-encoded body while no message or author changed
+            cached = message_cache.recent_page(room_id, limit, lambda n: _load_recent(room_id, n), _encode_many, generation)
+            if cached is not None:
+                body, first, last, count = cached
+                return _encoded_page_response(body, first, last, count >= limit, etag=etag)
+        if message_writer.write_behind or on_replica():
+            # Rows still queued for the database, or not yet replicated, are already
+            # counted in room_version
+            etag = None
+        query = _history_query(room_id)
+        if after_str:
+            position = _decode_cursor(after_str)
+            if position is None:
+                return jsonify({"error": "Invalid cursor"}), 400
+            # Archived messages are older than the whole table, so they come first
+            rows = message_archive.newer_than(room_id, position, limit + 1)
+            if len(rows) <= limit:
+                rows += (
+                    query.filter(_newer_than(*position))
+                    .order_by(Message.created_at.asc(), Message.id.asc())
+                    .limit(limit + 1 - len(rows))
+                    .all()
+                )
+            msgs = rows[:limit]
+            return _page_response(_serialize_messages(msgs), len(rows) > limit, after_str, etag)
+        position = None
         if before_str:
-            try:
-                before_dt = datetime.fromisoformat(before_str)
-                query = query.filter(Message.created_at < before_dt)
-            except ValueError:
-                pass
-        msgs = query.order_by(Message.created_at.desc()).limit(limit).all()
-        return jsonify([
-            {
-                "id": m.id,
-                "room_id": m.room_id,
-                "user_id": m.user_id,
-                "author_name": getattr(m.author, "name", None) if m.author else None,
-                "author_image": getattr(m.author, "image", None) if m.author else None,
-                "content": m.content,
-                "created_at": m.created_at.isoformat() if m.created_at else None,
-            }
-            for m in reversed(msgs)
-        ])
+            position = _decode_cursor(before_str)
+            if position is not None:
+                query = query.filter(_older_than(*position))
+            else:
+                try:
+                    before_dt = datetime.fromisoformat(before_str)
+                    query = query.filter(Message.created_at < before_dt)
+                    position = (before_dt, 0)
+                except ValueError:
+                    pass
+        rows = query.order_by(Message.created_at.desc(), Message.id.desc()).limit(limit + 1).all()
+        if len(rows) <= limit:
+            # The table ran out: older messages continue in the archive
+            if rows:
+                position = (rows[-1].created_at, rows[-1].id)
+            rows += message_archive.older_than(room_id, position, limit + 1 - len(rows))
+        msgs = rows[:limit]
+        return _page_response(_serialize_messages(list(reversed(msgs))), len(rows) > limit, etag=etag)
     except Exception as e:
-        from flask import current_app
-        from ..extensions import db
         current_app.logger.error(f"Error in /rooms/<room_id>/messages: {e}", exc_info=True)
         db.session.rollback()
         return jsonify({"error": "Internal server error"}), 500
 
 
+@bp.post("/messages/sync")
+@login_required
+def sync_messages():
+    """Reconnect catch-up: ``{"rooms": {room_id: last_seen_message_id}}``.
+
+    Returns the missed messages of every room in one response; rooms with
+    ``reload: true`` missed too many and should be reloaded from the newest page.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        positions = parse_positions(data.get("rooms"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        return jsonify({"rooms": missed_messages(positions)})
+    except Exception as e:
+        current_app.logger.error(f"Error in /messages/sync: {e}", exc_info=True)
+        db.session.rollback()
+        return jsonify({"error": "Internal server error"}), 500
+
+
+def _search_response(room_id):
+    terms = search_index.query_terms(request.args.get("q", ""))
+    if not terms:
+        return jsonify({"error": "Search terms must be at least 2 characters"}), 400
+    try:
+        limit = max(1, min(int(request.args.get("limit", 20)), 100))
+    except ValueError:
+        limit = 20
+    cursor = None
+    if request.args.get("cursor"):
+        cursor = decode_search_cursor(request.args["cursor"])
+        if cursor is None:
+            return jsonify({"error": "Invalid cursor"}), 400
+    hits, has_more = search_index.search(terms, room_id=room_id, limit=limit, cursor=cursor)
+    rows = {m.id: m for m in _history_query().filter(Message.id.in_([mid for mid, _ in hits]))} if hits else {}
+    # Postings of messages that are gone (deleted rooms) are skipped
+    found = [(rows[mid], score) for mid, score in hits if mid in rows]
+    payloads = _serialize_messages([m for m, _ in found])
+    for payload, (_, score) in zip(payloads, found):
+        payload["score"] = score
+    resp = jsonify(payloads)
+    if hits:
+        resp.headers["X-Next-Cursor"] = encode_search_cursor(hits[-1][1], hits[-1][0])
+    resp.headers["X-Has-More"] = "true" if has_more else "false"
+    return resp
+
+
+def _require_room_access(room: Room):
+    """Private rooms are for their creator, members and admins, as in the room list"""
+    if room.room_type != "private" or current_user.role == "admin" or room.created_by == current_user.id:
+        return None
+    if RoomMembership.query.filter_by(user_id=current_user.id, room_id=room.id).first() is None:
+        return jsonify({"error": "Only room members can search this room"}), 403
+    return None
+
+
+@bp.get("/rooms/<int:room_id>/messages/search")
+@login_required
+def search_room_messages(room_id: int):
+    """Messages of a room containing every term of ``q``, best matches first.
+
+    Pages with ``cursor=<X-Next-Cursor>`` while ``X-Has-More`` is true.
+    """
+    room = Room.query.get_or_404(room_id)
+    err = _require_room_access(room)
+    if err:
+        return err
+    try:
+        return _search_response(room_id)
+    except Exception as e:
+        current_app.logger.error(f"Error in /rooms/<room_id>/messages/search: {e}", exc_info=True)
+        db.session.rollback()
+        return jsonify({"error": "Internal server error"}), 500
+
+
+@bp.get("/messages/search")
+@login_required
+def search_all_messages():
+    """Admin search across every room, or one room with ``room_id``."""
+    if current_user.role != "admin":
+        return jsonify({"error": "Admin required"}), 403
+    try:
+        room_id = request.args.get("room_id", type=int)
+        return _search_response(room_id)
+    except Exception as e:
+        current_app.logger.error(f"Error in /messages/search: {e}", exc_info=True)
+        db.session.rollback()
+        return jsonify({"error": "Internal server error"}), 500
@@ -1,4 +1,8 @@
 
+import base64
+import binascii
+import hashlib
+import json
 from datetime import datetime
 from flask import Blueprint, jsonify, request, current_app
 from flask_login import login_required, current_user
@@ -8,6 +12,20 @@ from ..models.membership import RoomMembership
 from ..models.user import User
 from ..extensions import socketio
 from ..services.socketio import _room_key
+from ..services.presence import presence
+from ..services.replicas import on_replica, replica_reads, replica_router
+from ..services.room_directory import room_directory
+from ..services.avatar_pipeline import avatar_pipeline
+from ..services.db_pool import db_pool
+from ..services.etag import make_etag, not_modified, with_etag
+from ..services.message_archive import message_archive
+from ..services.message_cache import message_cache
+from ..services.message_writer import message_writer
+from ..services.password_hasher import PasswordHashBusy, password_hasher
+from ..services.outbox import room_outbox
+from ..services.search_index import search_index
+from ..services.upload_store import upload_store
+from ..services.user_cache import user_cache
 
 
 bp = Blueprint("rooms", __name__)
@@ -41,53 +59,15 @@ def _require_room_member(room: Room):
 @login_required
 def list_rooms():
     try:
-        # Filter rooms based on privacy:
-        # - Public rooms: visible to all authenticated users
-        # - Private rooms: visible to creator, admins, and members who joined via invitation
-        if current_user.role == "admin":
-            # Admins can see all rooms
-            rooms = Room.query.filter_by(is_active=True).order_by(Room.name.asc()).all()
-        else:
-            # Get user's memberships to include private rooms they joined
-            user_memberships = {m.room_id for m in RoomMembership.query.filter_by(user_id=current_user.id).all()}
-            
-            # Regular users: public rooms + private rooms they created + private rooms they joined
-            # Build query conditions
-            conditions = [
-                Room.room_type == 'public',
-                Room.created_by == current_user.id
-            ]
-            
-            # Add condition for private rooms user joined
-            if user_memberships:
-                conditions.append(
-                    db.and_(
-                        Room.room_type == 'private',
-                        Room.id.in_(list(user_memberships))
-                    )
-                )
-            
-            rooms = Room.query.filter(
-                Room.is_active == True,
-                db.or_(*conditions)
-            ).order_by(Room.name.asc()).all()
-        
-        # Get user's memberships (re-fetch for response)
-        user_memberships = {m.room_id for m in RoomMembership.query.filter_by(user_id=current_user.id).all()}
-        return jsonify([
-            {
-                "id": r.id,
-                "name": r.name,
-                "room_no": r.room_no or "",  # Handle None values
-                "room_type": r.room_type or "public",
-                "created_by": r.created_by,
-                "created_at": r.created_at.isoformat() if r.created_at else None,
-                "is_member": r.id in user_memberships,
-                "is_creator": r.created_by == current_user.id,
-                "invitation_link": r.get_invitation_link() if r.room_no else ""
-            }
-            for r in rooms
-        ])
+        is_admin = current_user.role == "admin"
+        # Read before the rooms, so the tag is never newer than the body it's sent with
+        etag = make_etag("rooms", current_user.id, int(is_admin), *room_directory.version(current_user.id))
+        cached = not_modified(etag)
+        if cached is not None:
+            return cached
+        # Public rooms + private rooms the user created or joined (admins see all),
+        # answered from the room directory cache
+        return with_etag(jsonify(room_directory.visible_rooms(current_user.id, is_admin)), etag)
     except Exception as e:
         current_app.logger.error(f"Error in /rooms: {e}", exc_info=True)
         db.session.rollback()
@@ -106,6 +86,7 @@ def join_room_api(room_id: int):
     m = RoomMembership(user_id=current_user.id, room_id=room.id)
     db.session.add(m)
     db.session.commit()
+    room_directory.invalidate_member(current_user.id)
     return jsonify({"ok": True, "joined": True})
 
 
@@ -116,27 +97,129 @@ def leave_room_api(room_id: int):
     if m:
         db.session.delete(m)
         db.session.commit()
+        room_directory.invalidate_member(current_user.id)
     return jsonify({"ok": True, "left": True})
 
 
+MEMBER_FIELDS = ("id", "name", "email", "image", "created_at", "online")
+
+
+def _encode_member_cursor(name, user_id: int) -> str:
+    raw = json.dumps([name, user_id], ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode_member_cursor(cursor: str):
+    try:
+        name, user_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if name is not None and not isinstance(name, str):
+            raise ValueError(name)
+        return name, int(user_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+        return None
+
+
+def _member_sort_key(m: dict) -> tuple:
+    # Same order as the database: NULL names first, then name, then id
+    return (m["name"] is not None, m["name"] or "", m["id"])
+
+
+def _online_members(online_user_ids: set, prefix: str, after, limit: int) -> list:
+    """Online members from the presence registry and the profile cache, no table scan."""
+    profiles = user_cache.get_many(online_user_ids)
+    members = [
+        p for p in profiles.values()
+        if p["role"] == "member" and (
+            not prefix
+            or (p["name"] or "").lower().startswith(prefix)
+            or (p["email"] or "").lower().startswith(prefix)
+        )
+    ]
+    members.sort(key=_member_sort_key)
+    if after is not None:
+        position = (after[0] is not None, after[0] or "", after[1])
+        members = [m for m in members if _member_sort_key(m) > position]
+    return members[:limit + 1]
+
+
+def _all_members(prefix: str, after, limit: int) -> list:
+    query = db.session.query(User.id, User.name, User.email, User.image, User.created_at).filter(User.role == "member")
+    if prefix:
+        pattern = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        query = query.filter(db.or_(User.name.like(pattern, escape="\\"), User.email.like(pattern, escape="\\")))
+    if after is not None:
+        # Keyset on ix_users_role_name_id; NULL names sort first
+        name, user_id = after
+        if name is None:
+            query = query.filter(db.or_(User.name.isnot(None), User.id > user_id))
+        else:
+            query = query.filter(User.name.isnot(None), db.or_(User.name > name, db.and_(User.name == name, User.id > user_id)))
+    rows = query.order_by(User.name.asc(), User.id.asc()).limit(limit + 1).all()
+    return [
+        {"id": r.id, "name": r.name, "email": r.email, "image": r.image, "created_at": r.created_at}
+        for r in rows
+    ]
+
+
 @bp.get("/members")
 @login_required
+@replica_reads
 def list_members():
+    """Members sorted by name, one page at a time.
+
+    ``limit`` (default 100, max 500), ``cursor=<X-Next-Cursor>`` for the next
+    page, ``q`` for a name/email prefix, ``online=true`` for online members only
+    (served from the presence registry) and ``fields=id,name,...`` to return
+    only some of ``id, name, email, image, created_at, online``.
+    """
     try:
-        members = User.query.filter_by(role="member").order_by(User.name.asc()).all()
-        from ..services.socketio import online_users
-        online_user_ids = set(online_users.keys())
-        return jsonify([
-            {
-                "id": m.id,
-                "name": m.name or "",
-                "email": m.email or "",
-                "image": m.image or None,
-                "created_at": m.created_at.isoformat() if m.created_at else None,
-                "online": m.id in online_user_ids,
+        # Same registry that drives presence_snapshot / presence_delta
+        online_user_ids = presence.ids()
+        # Users change only through the profile cache (register, profile updates)
+        online_digest = hashlib.blake2b(repr(sorted(online_user_ids)).encode("ascii"), digest_size=8).hexdigest()
+        etag = make_etag("members", user_cache.generation, online_digest)
+        cached = not_modified(etag)
+        if cached is not None:
+            return cached
+        try:
+            limit = max(1, min(int(request.args.get("limit", 100)), 500))
+        except ValueError:
+            limit = 100
+        after = None
+        if request.args.get("cursor"):
+            after = _decode_member_cursor(request.args["cursor"])
+            if after is None:
+                return jsonify({"error": "Invalid cursor"}), 400
+        fields = MEMBER_FIELDS
+        if request.args.get("fields"):
+            fields = tuple(f for f in MEMBER_FIELDS if f in request.args["fields"].split(","))
+            if "id" not in fields:
+                fields = ("id",) + fields
+        prefix = (request.args.get("q") or "").strip().lower()
+        if request.args.get("online") == "true":
+            members = _online_members(online_user_ids, prefix, after, limit)
+        else:
+            members = _all_members(prefix, after, limit)
+            if on_replica():
+                # The replica may not have every change the tag's version counts
+                etag = None
+        page = members[:limit]
+        result = []
+        for m in page:
+            values = {
+                "id": m["id"],
+                "name": m["name"] or "",
+                "email": m["email"] or "",
+                "image": avatar_pipeline.variant(m["image"]),
+                "created_at": m["created_at"].isoformat() if m["created_at"] else None,
+                "online": m["id"] in online_user_ids,
             }
-            for m in members
-        ])
+            result.append({f: values[f] for f in fields})
+        resp = jsonify(result)
+        if len(members) > limit:
+            resp.headers["X-Next-Cursor"] = _encode_member_cursor(page[-1]["name"], page[-1]["id"])
+        resp.headers["X-Has-More"] = "true" if len(members) > limit else "false"
+        return with_etag(resp, etag) if etag else resp
     except Exception as e:
         current_app.logger.error(f"Error in /members: {e}", exc_info=True)
         db.session.rollback()
@@ -161,7 +244,7 @@ def create_room():
     password = data.get("password", "").strip()
     
     # Generate room_no
-    room_no = generate_room_no(db.session)
+    room_no = generate_room_no()
     
     room = Room(
         name=name,
@@ -176,6 +259,7 @@ def create_room():
     
     db.session.add(room)
     db.session.commit()
+    room_directory.invalidate_rooms()
     
     return jsonify({
         "id": room.id,
@@ -226,6 +310,7 @@ def update_room(room_id: int):
             room.password_hash = None
     
     db.session.commit()
+    room_directory.invalidate_rooms()
     return jsonify({
         "id": room.id,
         "name": room.name,
@@ -244,10 +329,13 @@ def close_room(room_id: int):
         return err
     room.is_active = False
     db.session.commit()
+    room_directory.invalidate_rooms()
     # Emit close event to clients in this room
     rk = _room_key(room_id)
+    room_outbox.flush(room_id)
     socketio.emit("room_closed", {"room_id": room_id}, room=rk, namespace="/chat")
     socketio.close_room(rk, namespace="/chat")
+    presence.drop_room(room_id)
     return jsonify({"ok": True, "room_closed": room_id})
 
 
@@ -260,18 +348,26 @@ def delete_room(room_id: int):
         return err
     # Emit deletion event to clients in this room before closing
     rk = _room_key(room_id)
+    room_outbox.flush(room_id)
     socketio.emit("room_deleted", {"room_id": room_id}, room=rk, namespace="/chat")
-    # Delete from DB
+    # Delete from DB; write-behind rows still queued for the room would fail the FK
+    message_writer.discard_room(room_id)
+    search_index.drop_room(room_id)
     db.session.delete(room)
     db.session.commit()
+    room_directory.invalidate_rooms()
+    message_cache.drop_room(room_id)
+    message_archive.drop_room(room_id)
     # Force clients out of the room on server side
     socketio.close_room(rk, namespace="/chat")
+    presence.drop_room(room_id)
     return jsonify({"ok": True, "room_deleted": room_id})
 
 
 # Room join by room_no endpoints
 @bp.get("/rooms/info/<room_no>")
 @login_required
+@replica_reads
 def get_room_info(room_no: str):
     """Get room information by room_no"""
     room = Room.query.filter_by(room_no=room_no, is_active=True).first_or_404()
@@ -336,11 +432,17 @@ def join_room_by_no(room_no: str):
                 return jsonify({"error": "Password required for private room"}), 400
             if not room.check_password(password):
                 return jsonify({"error": "Invalid password"}), 401
+            if password_hasher.needs_rehash(room.password_hash):
+                try:
+                    room.set_password(password)  # committed with the membership below
+                except PasswordHashBusy:
+                    pass
     
     # Add user to room
     membership = RoomMembership(user_id=current_user.id, room_id=room.id)
     db.session.add(membership)
     db.session.commit()
+    room_directory.invalidate_member(current_user.id)
     
     return jsonify({
         "ok": True,
@@ -353,5 +455,23 @@ def join_room_by_no(room_no: str):
 
 
 # Admin endpoints
+@bp.get("/admin/cache-stats")
+@login_required
+def cache_stats():
+    """Hit/miss counters of the in-process caches, the bcrypt pool and the DB pool (this worker only)"""
+    err = _require_admin()
+    if err:
+        return err
+    return jsonify({
+        "user_profiles": user_cache.stats(),
+        "recent_messages": message_cache.stats(),
+        "message_writer": message_writer.stats(),
+        "room_directory": room_directory.stats(),
+        "password_hasher": password_hasher.stats(),
+        "uploads": upload_store.stats(),
+        "db_pool": db_pool.stats(),
+        "replicas": replica_router.stats(),
+        "archive": message_archive.stats(),
+    })
 
 
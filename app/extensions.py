@@ -3,9 +3,14 @@ from flask_migrate import Migrate
 from flask_login import LoginManager
 from flask_socketio import SocketIO
 from flask_mail import Mail
+from socketio import PubSubManager
+from .services.db_pool import db_pool
+from .services.replicas import RoutingSession, replica_router
+from .services.serialization import SocketJSON
 
 
-db = SQLAlchemy()
+# Read-only views can send their SELECTs to a replica (services/replicas.py)
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 migrate = Migrate()
 login_manager = LoginManager()
 socketio = SocketIO(
@@ -14,18 +19,43 @@ socketio = SocketIO(
     logger=True,
     engineio_logger=False,
     ping_timeout=60,
-    ping_interval=25
+    ping_interval=25,
+    json=SocketJSON,
 )
 mail = Mail()
 
 
 def init_extensions(app):
+    db_pool.configure(app)
+    replica_router.configure(app)
     db.init_app(app)
     migrate.init_app(app, db)
     login_manager.init_app(app)
-    socketio.init_app(app)
+    socketio.init_app(app, async_mode=app.config.get("SOCKETIO_ASYNC_MODE", "threading"), **_socketio_queue_options(app))
+    if isinstance(socketio.server.manager, PubSubManager):
+        # Flask-SocketIO builds its own queue managers with the stdlib json module
+        socketio.server.manager.json = SocketJSON
     mail.init_app(app)
 
     login_manager.login_view = "auth.login_view"  # Redirect to login page if not authenticated
 
 
+
+
+def _socketio_queue_options(app) -> dict:
+    """Build the cross-process message queue options for Socket.IO.
+
+    Without SOCKETIO_MESSAGE_QUEUE everything stays in-process (single worker).
+    """
+    from .services.broker import BrokerManager, create_broker
+
+    url = app.config.get("SOCKETIO_MESSAGE_QUEUE")
+    app.extensions["chat_broker"] = None
+    if not url:
+        return {}
+    broker = create_broker(url)
+    if broker is None:
+        # amqp://, kafka://, zmq... are handled by Flask-SocketIO itself
+        return {"message_queue": url, "channel": app.config["SOCKETIO_CHANNEL"]}
+    app.extensions["chat_broker"] = broker
+    return {"client_manager": BrokerManager(broker, channel=app.config["SOCKETIO_CHANNEL"])}
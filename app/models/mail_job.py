@@ -0,0 +1,25 @@
+from . import db, datetime
+
+
+class MailJob(db.Model):
+    """Outgoing email, written in the same transaction as what triggered it."""
+
+    __tablename__ = "mail_outbox"
+    __table_args__ = (
+        # The sender claims due jobs: status IN (pending, sending) AND next_attempt_at <= now
+        db.Index("ix_mail_outbox_status_next", "status", "next_attempt_at"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    subject = db.Column(db.String(255), nullable=False)
+    sender = db.Column(db.String(255), nullable=False)
+    recipients = db.Column(db.Text, nullable=False)  # comma-separated
+    body = db.Column(db.Text, nullable=False)
+    # pending -> sending -> sent, or back to pending (retry) until dead
+    status = db.Column(db.String(16), nullable=False, default="pending")
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    claimed_by = db.Column(db.String(32), nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime, nullable=True)
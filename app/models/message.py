@@ -1,17 +1,20 @@
+from sqlalchemy.dialects import mysql
 from . import db, datetime
 
 
 class Message(db.Model):
     __tablename__ = "messages"
     __table_args__ = (
-        db.Index("ix_room_created", "room_id", "created_at"),
+        # Keyset pagination walks (created_at, id) inside a room
+        db.Index("ix_room_created_id", "room_id", "created_at", "id"),
     )
 
     id = db.Column(db.Integer, primary_key=True)
     room_id = db.Column(db.Integer, db.ForeignKey("rooms.id"), nullable=False, index=True)
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False, index=True)
     content = db.Column(db.Text, nullable=False)
-    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # Microsecond precision on MySQL so history cursors match the broadcast timestamps
+    created_at = db.Column(db.DateTime().with_variant(mysql.DATETIME(fsp=6), "mysql"), nullable=False, default=datetime.utcnow)
 
     room = db.relationship("Room", back_populates="messages")
     author = db.relationship("User", back_populates="messages")
@@ -0,0 +1,20 @@
+from sqlalchemy.dialects import mysql
+from . import db
+
+
+class MessageTerm(db.Model):
+    """Inverted index for message search: one row per (term, message)."""
+
+    __tablename__ = "message_terms"
+    __table_args__ = (
+        # Postings of a term inside a room are one range of the primary key
+        db.PrimaryKeyConstraint("term", "room_id", "message_id"),
+        db.Index("ix_message_terms_message", "message_id"),
+    )
+
+    # Binary collation: terms are already normalized, and a case/accent-insensitive
+    # collation would make distinct terms collide in the primary key
+    term = db.Column(db.String(32).with_variant(mysql.VARCHAR(32, collation="utf8mb4_bin"), "mysql"), nullable=False)
+    room_id = db.Column(db.Integer, nullable=False)
+    message_id = db.Column(db.Integer, nullable=False)
+    weight = db.Column(db.SmallInteger, nullable=False, default=1)  # occurrences in the message
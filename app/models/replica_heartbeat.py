@@ -0,0 +1,14 @@
+from . import db
+
+
+class ReplicaHeartbeat(db.Model):
+    """One row, rewritten on the primary every few seconds.
+
+    Replicas receive it through replication like any other row, so how old
+    their copy is tells how far behind they are.
+    """
+
+    __tablename__ = "replica_heartbeat"
+
+    id = db.Column(db.Integer, primary_key=True)
+    beat_ms = db.Column(db.BigInteger, nullable=False)  # Unix time in milliseconds
@@ -1,10 +1,14 @@
-import bcrypt
 from flask_login import UserMixin
 from . import db, datetime
+from ..services.password_hasher import password_hasher
 
 
 class User(UserMixin, db.Model):
     __tablename__ = "users"
+    __table_args__ = (
+        # /members pages through (role, name, id) and prefix-searches names
+        db.Index("ix_users_role_name_id", "role", "name", "id"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), nullable=True)
@@ -18,15 +22,9 @@ class User(UserMixin, db.Model):
     messages = db.relationship("Message", back_populates="author", lazy="dynamic")
 
     def set_password(self, password: str) -> None:
-        salt = bcrypt.gensalt(rounds=12)
-        self.password_hash = bcrypt.hashpw(password.encode("utf-8"), salt).decode("utf-8")
+        self.password_hash = password_hasher.hash_password(password)
 
     def check_password(self, password: str) -> bool:
-        if not self.password_hash:
-            return False
-        try:
-            return bcrypt.checkpw(password.encode("utf-8"), self.password_hash.encode("utf-8"))
-        except ValueError:
-            return False
+        return password_hasher.check_password(password, self.password_hash)
 
 
@@ -0,0 +1,284 @@
+"""Avatar processing off the request thread.
+
+``POST /auth/profile/upload`` only checks that the file is an image and queues
+it; a pool of ``AVATAR_WORKERS`` threads (Pillow releases the GIL while
+resizing and encoding; in eventlet mode the work itself goes to a real OS
+thread, see :mod:`.cooperative`) flattens it and writes WebP files next to each other in
+``UPLOAD_FOLDER``:
+
+- ``<stem>.webp``: the avatar, at most ``AVATAR_MAX_SIZE`` px on its long side
+  (what ``User.image`` names, shown on the profile page)
+- ``<stem>-<size>.webp``: a square crop for each of ``AVATAR_SIZES``
+
+The stem is a hash of the upload and the output settings, so a name always
+stands for the same bytes and can be cached forever (see :mod:`.upload_store`);
+identical uploads share files, which are only deleted once no user refers to them.
+
+Chat clients only ever need the smallest variant, so message payloads and
+``/members`` reference it (:meth:`AvatarPipeline.variant`). The client polls
+``GET /auth/profile/upload/<job_id>`` until the job is ``done`` or ``failed``.
+Avatars uploaded before variants existed get them with ``flask avatar-variants``.
+"""
+
+import hashlib
+import io
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from PIL import Image, ImageOps
+
+from .cooperative import run_blocking
+from .upload_store import upload_store
+
+
+logger = logging.getLogger(__name__)
+
+JOB_TTL_SECONDS = 600
+# What the status endpoint reports for a failed job; the cause is only logged
+JOB_ERROR = "上傳失敗"
+
+
+class AvatarJob:
+    __slots__ = ("id", "user_id", "status", "error", "finished_at")
+
+    def __init__(self, job_id: str, user_id: int):
+        self.id = job_id
+        self.user_id = user_id
+        self.status = "pending"  # pending -> processing -> done | failed
+        self.error = None
+        self.finished_at = None
+
+
+class AvatarPipeline:
+    def __init__(self):
+        self.workers = 2
+        self.queue_max = 32
+        self.sizes = (96, 256)
+        self.max_size = 1024
+        self.quality = 85
+        self.method = 4
+        self._executor = None
+        self._pid = None
+        self._jobs = {}  # (user_id, job id) -> AvatarJob
+        self._latest = {}  # user_id -> id of their newest job
+        self._lock = threading.Lock()
+        self._stem_locks = {}  # stem -> [lock, holders and waiters]
+
+    def init_app(self, app) -> None:
+        os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
+        self.workers = max(1, app.config.get("AVATAR_WORKERS", self.workers))
+        self.queue_max = max(1, app.config.get("AVATAR_QUEUE_MAX", self.queue_max))
+        sizes = app.config.get("AVATAR_SIZES", "")
+        if sizes:
+            self.sizes = tuple(sorted({int(s) for s in sizes.split(",") if s.strip().isdigit() and int(s) > 0}))
+        self.max_size = max(max(self.sizes), app.config.get("AVATAR_MAX_SIZE", self.max_size))
+        self.method = min(6, max(0, app.config.get("AVATAR_WEBP_METHOD", self.method)))
+        app.cli.add_command(variants_command)
+
+    @staticmethod
+    def filename(stem: str, size: int = None) -> str:
+        return f"{stem}.webp" if size is None else f"{stem}-{size}.webp"
+
+    def variant(self, image: str, size: int = None):
+        """File name of an avatar's square variant (the smallest by default)."""
+        if not image:
+            return None
+        return self.filename(os.path.splitext(image)[0], size or self.sizes[0])
+
+    def submit(self, user_id: int, data: bytes):
+        """Queue an upload; the job, or None when the queue is full."""
+        app = current_app._get_current_object()
+        job = AvatarJob(self._stem(data), user_id)
+        with self._lock:
+            self._prune()
+            executor = self._get_executor()
+            if sum(1 for j in self._jobs.values() if j.finished_at is None) >= self.workers + self.queue_max:
+                return None
+            self._jobs[(user_id, job.id)] = job
+            self._latest[user_id] = job.id
+        executor.submit(self._process, app, job, data)
+        return job
+
+    def get(self, user_id: int, job_id: str):
+        with self._lock:
+            return self._jobs.get((user_id, job_id))
+
+    def render(self, data: bytes, stem: str, folder: str, sizes=None, main: bool = True) -> None:
+        """Write the avatar and its variants (``sizes``, default all); each file appears atomically."""
+        # Also here: the folder may have been removed since the app started
+        os.makedirs(folder, exist_ok=True)
+        image = Image.open(io.BytesIO(data))
+        image = ImageOps.exif_transpose(image)
+        image = _flatten(image)
+        written = []
+        try:
+            for size in self.sizes if sizes is None else sizes:
+                written.append(self._save(ImageOps.fit(image, (size, size), Image.LANCZOS), folder, self.filename(stem, size)))
+            if main:
+                image.thumbnail((self.max_size, self.max_size), Image.LANCZOS)
+                # The main file last: its presence means every variant is there
+                written.append(self._save(image, folder, self.filename(stem)))
+        except Exception:
+            for path in written:
+                _remove(path)
+            raise
+
+    def release(self, image: str, folder: str) -> None:
+        """Delete an avatar with its variants unless a user still has it (app context)."""
+        from ..models.user import User
+
+        stem = os.path.splitext(image)[0]
+        # A job for an identical upload reuses these files: it holds the stem's lock
+        # until its user row is committed, so the check below sees that user
+        with self._stem_lock(stem):
+            if User.query.filter_by(image=image).first() is not None:
+                return
+            for name in [self.filename(stem)] + [self.filename(stem, size) for size in self.sizes]:
+                _remove(os.path.join(folder, name))
+                upload_store.forget(name)
+
+    @contextmanager
+    def _stem_lock(self, stem: str):
+        with self._lock:
+            entry = self._stem_locks.setdefault(stem, [threading.RLock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._stem_locks[stem]
+
+    def _stem(self, data: bytes) -> str:
+        digest = hashlib.blake2b(data, digest_size=10)
+        # Other settings give other bytes, so they must give another name too
+        digest.update(repr((self.sizes, self.max_size, self.quality, self.method)).encode("ascii"))
+        return digest.hexdigest()
+
+    def _save(self, image, folder: str, name: str) -> str:
+        path = os.path.join(folder, name)
+        if os.path.exists(path):
+            # Same name, same content (an identical upload)
+            return path
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        image.save(tmp, "WEBP", quality=self.quality, method=self.method)
+        os.replace(tmp, path)
+        upload_store.forget(name)
+        return path
+
+    def _process(self, app, job: AvatarJob, data: bytes) -> None:
+        from ..extensions import db
+        from ..models.user import User
+        from .user_cache import user_cache
+
+        job.status = "processing"
+        folder = app.config["UPLOAD_FOLDER"]
+        filename = self.filename(job.id)
+        try:
+            started = time.perf_counter()
+            with app.app_context():
+                # From finding the files of an identical upload in place until the user
+                # refers to them, release() of the same name must wait
+                with self._stem_lock(job.id):
+                    run_blocking(self.render, data, job.id, folder)
+                    try:
+                        with self._lock:
+                            # A newer upload by the same user wins even if it finished first
+                            if self._latest.get(job.user_id) != job.id:
+                                raise RuntimeError("Superseded by a newer upload")
+                        user = db.session.get(User, job.user_id)
+                        if user is None:
+                            raise RuntimeError("User no longer exists")
+                        old_image = user.image
+                        user.image = filename
+                        db.session.commit()
+                    except Exception:
+                        db.session.rollback()
+                        self.release(filename, folder)
+                        raise
+                user_cache.invalidate(job.user_id)
+                if old_image and old_image != filename:
+                    # Never two stems' locks at once: users swapping identical avatars would deadlock
+                    self.release(old_image, folder)
+            logger.info(f"Avatar {filename} rendered in {(time.perf_counter() - started) * 1000:.0f} ms")
+            job.status = "done"
+        except Exception:
+            # The exception may name server paths: log it, tell the client only that it failed
+            logger.warning(f"Avatar job {job.id} of user {job.user_id} failed", exc_info=True)
+            job.error = JOB_ERROR
+            job.status = "failed"
+        finally:
+            job.finished_at = time.monotonic()
+
+    def _prune(self) -> None:
+        cutoff = time.monotonic() - JOB_TTL_SECONDS
+        for key in [k for k, j in self._jobs.items() if j.finished_at is not None and j.finished_at < cutoff]:
+            job = self._jobs.pop(key)
+            if self._latest.get(job.user_id) == job.id:
+                del self._latest[job.user_id]
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # Created lazily in the serving process: threads don't survive uWSGI's fork
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._jobs.clear()
+            self._latest.clear()
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="avatar")
+        return self._executor
+
+
+def _flatten(image):
+    # WebP files are written without alpha: transparency becomes white
+    if image.mode in ("RGBA", "LA", "P"):
+        if image.mode != "RGBA":
+            image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.split()[-1])
+        return background
+    if image.mode != "RGB":
+        return image.convert("RGB")
+    image.load()
+    return image
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"Failed to delete {path}: {e}")
+
+
+@click.command("avatar-variants")
+@with_appcontext
+def variants_command():
+    """Create missing size variants of uploaded avatars."""
+    from ..models.user import User
+
+    folder = current_app.config["UPLOAD_FOLDER"]
+    created = 0
+    for (image,) in User.query.with_entities(User.image).filter(User.image.isnot(None)):
+        stem = os.path.splitext(image)[0]
+        path = os.path.join(folder, image)
+        missing = [s for s in avatar_pipeline.sizes if not os.path.exists(os.path.join(folder, avatar_pipeline.filename(stem, s)))]
+        if not missing or not os.path.exists(path):
+            continue
+        with open(path, "rb") as f:
+            data = f.read()
+        # Only the variants: the existing file keeps its name and bytes
+        avatar_pipeline.render(data, stem, folder, sizes=missing, main=False)
+        created += 1
+    click.echo(f"Created variants for {created} avatars")
+
+
+avatar_pipeline = AvatarPipeline()
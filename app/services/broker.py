@@ -0,0 +1,270 @@
+"""Inter-process pub/sub broker used to fan out Socket.IO events and presence.
+
+Brokers are selected by URL (``SOCKETIO_MESSAGE_QUEUE``):
+
+- ``local://<name>``: in-process queues, for tests and single-process runs
+- ``unix:///path/to/broker.sock``: a small hub process on a Unix socket, for
+  several uWSGI workers on one host (start it with
+  ``python -m app.services.broker unix:///path/to/broker.sock``)
+- ``redis://host:6379/0``: Redis pub/sub for multiple nodes (needs ``redis``)
+
+Any other URL (``amqp://``, ``kafka://``, ``zmq+tcp://``...) is handed to
+Flask-SocketIO's own managers; those carry Socket.IO events but not presence.
+"""
+
+import abc
+import logging
+import os
+import queue
+import socket
+import struct
+import sys
+import threading
+import time
+
+from socketio import PubSubManager
+
+from .serialization import dumps, loads
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+logger = logging.getLogger(__name__)
+
+_FRAME_HEADER = struct.Struct("!I")
+RECONNECT_DELAY = 1.0
+
+
+class Broker(abc.ABC):
+    """Publish JSON-serializable dicts to named channels."""
+
+    @abc.abstractmethod
+    def publish(self, channel: str, message: dict) -> None:
+        """Send ``message`` to every listener of ``channel``."""
+
+    @abc.abstractmethod
+    def listen(self, channel: str):
+        """Yield messages published on ``channel``, blocking between them."""
+
+
+class LocalBroker(Broker):
+    """In-process broker; brokers created with the same name share channels."""
+
+    _registry = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, name: str = "default"):
+        self.name = name
+
+    def _subscribers(self, channel: str) -> list:
+        with self._registry_lock:
+            return self._registry.setdefault((self.name, channel), [])
+
+    def publish(self, channel: str, message: dict) -> None:
+        # Round-trip through JSON so local tests see what a real transport delivers
+        data = dumps(message)
+        for q in list(self._subscribers(channel)):
+            q.put(loads(data))
+
+    def listen(self, channel: str):
+        q = queue.Queue()
+        subscribers = self._subscribers(channel)
+        with self._registry_lock:
+            subscribers.append(q)
+        try:
+            while True:
+                yield q.get()
+        finally:
+            with self._registry_lock:
+                subscribers.remove(q)
+
+
+def _send_frame(sock: socket.socket, payload: dict) -> None:
+    data = dumps(payload)
+    sock.sendall(_FRAME_HEADER.pack(len(data)) + data)
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    buf = b""
+    while len(buf) < size:
+        chunk = sock.recv(size - len(buf))
+        if not chunk:
+            raise ConnectionError("broker connection closed")
+        buf += chunk
+    return buf
+
+
+def _recv_frame(sock: socket.socket) -> dict:
+    (size,) = _FRAME_HEADER.unpack(_recv_exact(sock, _FRAME_HEADER.size))
+    return loads(_recv_exact(sock, size))
+
+
+class UnixSocketBroker(Broker):
+    """Client for :class:`UnixSocketHub`."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._pub_sock = None
+        self._pub_lock = threading.Lock()
+
+    def _connect(self) -> socket.socket:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.path)
+        return sock
+
+    def publish(self, channel: str, message: dict) -> None:
+        frame = {"op": "pub", "channel": channel, "data": message}
+        with self._pub_lock:
+            for attempt in range(2):
+                try:
+                    if self._pub_sock is None:
+                        self._pub_sock = self._connect()
+                    _send_frame(self._pub_sock, frame)
+                    return
+                except OSError as e:
+                    if self._pub_sock is not None:
+                        self._pub_sock.close()
+                        self._pub_sock = None
+                    if attempt:
+                        logger.error(f"Broker publish to {self.path} failed: {e}")
+
+    def listen(self, channel: str):
+        while True:
+            try:
+                sock = self._connect()
+            except OSError as e:
+                logger.warning(f"Broker {self.path} unavailable: {e}")
+                time.sleep(RECONNECT_DELAY)
+                continue
+            try:
+                _send_frame(sock, {"op": "sub", "channel": channel})
+                while True:
+                    yield _recv_frame(sock)
+            except (OSError, ConnectionError, ValueError) as e:
+                logger.warning(f"Broker subscription to {channel} lost: {e}")
+            finally:
+                sock.close()
+            time.sleep(RECONNECT_DELAY)
+
+
+class UnixSocketHub:
+    """Relays published frames to every subscriber of the same channel."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._server = None
+
+    def serve_forever(self) -> None:
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(self.path)
+        self._server.listen(128)
+        logger.info(f"Broker hub listening on {self.path}")
+        try:
+            while True:
+                conn, _ = self._server.accept()
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+        except OSError:
+            pass  # closed by shutdown()
+        finally:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def shutdown(self) -> None:
+        if self._server is not None:
+            self._server.close()
+
+    def _handle(self, conn: socket.socket) -> None:
+        send_lock = threading.Lock()
+        channel = None
+        try:
+            while True:
+                frame = _recv_frame(conn)
+                if frame.get("op") == "sub":
+                    channel = frame["channel"]
+                    with self._lock:
+                        self._subscribers.setdefault(channel, []).append((conn, send_lock))
+                elif frame.get("op") == "pub":
+                    self._relay(frame["channel"], frame["data"])
+        except (OSError, ConnectionError, ValueError):
+            pass
+        finally:
+            if channel is not None:
+                with self._lock:
+                    subs = self._subscribers.get(channel, [])
+                    if (conn, send_lock) in subs:
+                        subs.remove((conn, send_lock))
+            conn.close()
+
+    def _relay(self, channel: str, data: dict) -> None:
+        with self._lock:
+            subs = list(self._subscribers.get(channel, []))
+        for conn, send_lock in subs:
+            try:
+                with send_lock:
+                    _send_frame(conn, data)
+            except OSError:
+                pass  # the subscriber's reader thread cleans up
+
+
+class RedisBroker(Broker):
+    def __init__(self, url: str):
+        if redis is None:
+            raise RuntimeError("Redis broker requires the redis package: pip install redis")
+        self._redis = redis.Redis.from_url(url)
+
+    def publish(self, channel: str, message: dict) -> None:
+        self._redis.publish(channel, dumps(message))
+
+    def listen(self, channel: str):
+        while True:
+            try:
+                pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(channel)
+                for item in pubsub.listen():
+                    if item.get("type") == "message":
+                        yield loads(item["data"])
+            except redis.exceptions.ConnectionError as e:
+                logger.warning(f"Redis subscription to {channel} lost: {e}")
+                time.sleep(RECONNECT_DELAY)
+
+
+def create_broker(url: str):
+    """Return a broker for ``url``, or None if it isn't one of ours."""
+    if not url:
+        return None
+    if url.startswith("local://"):
+        return LocalBroker(url[len("local://"):] or "default")
+    if url.startswith("unix://"):
+        return UnixSocketBroker(url[len("unix://"):])
+    if url.startswith(("redis://", "rediss://")):
+        return RedisBroker(url)
+    return None
+
+
+class BrokerManager(PubSubManager):
+    """python-socketio client manager that fans events out through a :class:`Broker`."""
+
+    name = "broker"
+
+    def __init__(self, broker: Broker, channel: str = "flask-socketio", write_only: bool = False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.broker = broker
+
+    def _publish(self, data):
+        self.broker.publish(self.channel, data)
+
+    def _listen(self):
+        yield from self.broker.listen(self.channel)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    target = sys.argv[1] if len(sys.argv) > 1 else "unix:///tmp/chat-broker.sock"
+    UnixSocketHub(target[len("unix://"):] if target.startswith("unix://") else target).serve_forever()
@@ -0,0 +1,36 @@
+"""CPU-bound work under the cooperative (eventlet) server mode.
+
+With ``SOCKETIO_ASYNC_MODE=eventlet`` the standard library is monkey-patched
+(see ``wsgi.py``): sockets, locks, queues and threads become green, so
+database and broker I/O yield to other connections by themselves. Work that
+holds the CPU without doing I/O (bcrypt, Pillow) would still stall every
+connection of the process; :func:`run_blocking` hands it to eventlet's pool of
+real OS threads (``EVENTLET_THREADPOOL_SIZE``, default 20) instead. In
+threading mode it just calls the function.
+"""
+
+import sys
+
+
+_tpool = None  # eventlet.tpool once the process is known to be monkey-patched
+_checked = False
+
+
+def is_cooperative() -> bool:
+    """Whether this process runs on green threads (eventlet monkey-patched)."""
+    global _tpool, _checked
+    if not _checked:
+        patcher = sys.modules.get("eventlet.patcher")
+        if patcher is not None and patcher.is_monkey_patched("thread"):
+            from eventlet import tpool
+
+            _tpool = tpool
+        _checked = True
+    return _tpool is not None
+
+
+def run_blocking(fn, *args):
+    """Call ``fn(*args)`` without blocking other green threads."""
+    if not is_cooperative():
+        return fn(*args)
+    return _tpool.execute(fn, *args)
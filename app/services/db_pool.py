@@ -0,0 +1,201 @@
+"""Database connection pool settings and per-worker pool metrics.
+
+Pool sizing comes from the environment (``DB_POOL_SIZE``, ``DB_MAX_OVERFLOW``,
+``DB_POOL_TIMEOUT``, ``DB_POOL_RECYCLE``, ``DB_POOL_PRE_PING``) instead of
+SQLAlchemy's defaults (5 + 10 overflow), which are smaller than one uWSGI
+worker's request threads plus its background threads. Pre-ping replaces a
+connection the server has closed (MySQL ``wait_timeout``, a restarted server
+or proxy) before it is handed out, rather than failing the request with it.
+
+Every engine's pool reports checkouts, time spent waiting for a connection,
+overflow connections opened, checkout timeouts and invalidations; the numbers
+are per worker process and appear under ``db_pool`` in ``/admin/cache-stats``.
+``DB_POOL_WARMUP`` opens that many connections while the worker starts so the
+first requests don't pay for the connects (needs ``lazy-apps``, otherwise
+the connections would be opened before uWSGI forks).
+"""
+
+import logging
+import os
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.pool import QueuePool
+
+
+logger = logging.getLogger(__name__)
+
+SLOW_WAIT_SECONDS = 0.001  # checkouts that waited at least this long count as "waited"
+
+
+class PoolMetrics:
+    def __init__(self):
+        self.checkouts = 0
+        self.waited = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.overflow_opened = 0
+        self.timeouts = 0
+        self.connects = 0
+        self.closes = 0
+        self.invalidations = 0
+        self.soft_invalidations = 0
+        self.warmed = 0
+
+    def record_wait(self, seconds: float) -> None:
+        if seconds >= SLOW_WAIT_SECONDS:
+            self.waited += 1
+            self.wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that times how long a checkout waits for a connection."""
+
+    metrics = None
+
+    def _do_get(self):
+        metrics = self.metrics
+        if metrics is None:
+            return super()._do_get()
+        started = time.perf_counter()
+        overflow = self._overflow
+        try:
+            conn = super()._do_get()
+        except PoolTimeout:
+            metrics.timeouts += 1
+            raise
+        finally:
+            metrics.record_wait(time.perf_counter() - started)
+        if self._overflow > max(overflow, 0):
+            metrics.overflow_opened += 1
+        return conn
+
+    def recreate(self):
+        # engine.dispose() swaps in a fresh pool; keep counting into the same metrics
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+
+def pool_options(app, url) -> dict:
+    """Engine options for the pool of one database URL, from the DB_POOL_* settings."""
+    url = make_url(url)
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return {}  # Flask-SQLAlchemy shares one in-memory connection (StaticPool)
+    return {
+        "poolclass": InstrumentedQueuePool,
+        "pool_size": app.config["DB_POOL_SIZE"],
+        "max_overflow": app.config["DB_MAX_OVERFLOW"],
+        "pool_timeout": app.config["DB_POOL_TIMEOUT"],
+        "pool_recycle": app.config["DB_POOL_RECYCLE"],
+        "pool_pre_ping": app.config["DB_POOL_PRE_PING"],
+    }
+
+
+class DbPoolMonitor:
+    def __init__(self):
+        self._metrics = {}  # bind key ("default" for the main database) -> PoolMetrics
+        self._engines = {}
+
+    def configure(self, app) -> None:
+        """Fill SQLALCHEMY_ENGINE_OPTIONS before db.init_app creates the engines.
+
+        Options set explicitly in SQLALCHEMY_ENGINE_OPTIONS take precedence.
+        """
+        options = app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {})
+        for key, value in pool_options(app, app.config["SQLALCHEMY_DATABASE_URI"]).items():
+            options.setdefault(key, value)
+
+    def init_app(self, app) -> None:
+        from ..extensions import db
+
+        with app.app_context():
+            engines = dict(db.engines)
+        self._metrics, self._engines = {}, {}
+        for key, engine in engines.items():
+            name = key or "default"
+            self._engines[name] = engine
+            self._metrics[name] = self._instrument(engine.pool)
+        warmup = app.config.get("DB_POOL_WARMUP", 0)
+        if warmup > 0:
+            for name, engine in self._engines.items():
+                self.warm_up(name, engine, warmup)
+
+    def _instrument(self, pool) -> PoolMetrics:
+        metrics = PoolMetrics()
+        if isinstance(pool, InstrumentedQueuePool):
+            pool.metrics = metrics
+
+        @event.listens_for(pool, "checkout")
+        def on_checkout(dbapi_connection, record, proxy):
+            metrics.checkouts += 1
+
+        @event.listens_for(pool, "connect")
+        def on_connect(dbapi_connection, record):
+            metrics.connects += 1
+
+        @event.listens_for(pool, "close")
+        def on_close(dbapi_connection, record):
+            metrics.closes += 1
+
+        @event.listens_for(pool, "invalidate")
+        def on_invalidate(dbapi_connection, record, exception):
+            # Includes connections found dead by pre-ping
+            metrics.invalidations += 1
+
+        @event.listens_for(pool, "soft_invalidate")
+        def on_soft_invalidate(dbapi_connection, record, exception):
+            metrics.soft_invalidations += 1
+
+        return metrics
+
+    def warm_up(self, name: str, engine, count: int) -> int:
+        """Open up to ``count`` connections (at most pool_size) and return them to the pool."""
+        size = engine.pool.size() if isinstance(engine.pool, QueuePool) else 1
+        connections = []
+        try:
+            for _ in range(min(count, size)):
+                connections.append(engine.pool.connect())
+        except Exception as e:
+            # A database that is down at boot must not keep the worker from starting
+            logger.warning("DB pool warm-up (%s) stopped after %d connections: %s", name, len(connections), e)
+        finally:
+            for connection in connections:
+                connection.close()
+        self._metrics[name].warmed += len(connections)
+        return len(connections)
+
+    def stats(self) -> dict:
+        result = {"pid": os.getpid()}
+        for name, engine in self._engines.items():
+            pool, metrics = engine.pool, self._metrics[name]
+            entry = {"pool": type(pool).__name__}
+            if isinstance(pool, QueuePool):
+                entry.update({
+                    "size": pool.size(),
+                    "max_overflow": pool._max_overflow,
+                    "checked_out": pool.checkedout(),
+                    "idle": pool.checkedin(),
+                    "overflow": max(pool.overflow(), 0),
+                })
+            entry.update({
+                "checkouts": metrics.checkouts,
+                "waited": metrics.waited,
+                "wait_ms_total": round(metrics.wait_seconds * 1000, 1),
+                "wait_ms_max": round(metrics.max_wait_seconds * 1000, 1),
+                "overflow_opened": metrics.overflow_opened,
+                "timeouts": metrics.timeouts,
+                "connects": metrics.connects,
+                "closes": metrics.closes,
+                "invalidations": metrics.invalidations,
+                "soft_invalidations": metrics.soft_invalidations,
+                "warmed": metrics.warmed,
+            })
+            result[name] = entry
+        return result
+
+
+db_pool = DbPoolMonitor()
@@ -0,0 +1,45 @@
+"""Strong ETags built from in-memory version counters.
+
+Polled endpoints derive their ETag from the counters of the caches behind them
+(room directory, profile cache, message buffers), so ``If-None-Match`` can be
+answered with a 304 before any database work. The counters live in one
+process; every tag carries a per-process id, so a tag issued by another worker
+(or before a restart) never matches. Across processes the counters stay
+current only through the broker (``SOCKETIO_MESSAGE_QUEUE``).
+"""
+
+import os
+import time
+
+from flask import current_app, request
+
+
+_node = (None, None)  # (pid, id)
+
+
+def _node_id() -> str:
+    global _node
+    pid = os.getpid()
+    if _node[0] != pid:
+        # Recomputed after uWSGI forks the worker
+        _node = (pid, f"{pid:x}.{time.time_ns():x}")
+    return _node[1]
+
+
+def make_etag(*parts) -> str:
+    """ETag value (unquoted) for the given version parts."""
+    return "-".join([_node_id(), *(str(p) for p in parts)])
+
+
+def not_modified(etag: str):
+    """A 304 response if the request already has ``etag``, otherwise None."""
+    if etag not in request.if_none_match:
+        return None
+    return with_etag(current_app.response_class(status=304), etag)
+
+
+def with_etag(response, etag: str):
+    response.set_etag(etag)
+    # Per-user data: browsers may keep it, but must revalidate every time
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
@@ -0,0 +1,109 @@
+"""Reconnect catch-up: the messages a client missed in several rooms at once.
+
+Clients send ``{room_id: last_seen_message_id}`` after reconnecting (``sync``
+event or ``POST /messages/sync``). Rooms whose buffer in
+:mod:`.message_cache` still holds the last seen message are answered from
+memory; all others share one query, a ``UNION ALL`` of per-room range scans
+on ``ix_room_created_id``. A room that missed more than ``SYNC_MAX_MESSAGES``
+comes back with ``reload: true`` and no messages: the client refetches its
+newest page instead. So does a room whose last seen message isn't in the table
+(archived, still queued by the write-behind writer, or an unknown id), since
+there is no position to continue from.
+"""
+
+from flask import current_app
+
+from ..extensions import db
+from ..models.message import Message
+from .avatar_pipeline import avatar_pipeline
+from .message_cache import message_cache
+from .user_cache import user_cache
+
+
+def parse_positions(raw) -> dict:
+    """``{room_id: last_seen_id}`` with int keys and values; raises ValueError if malformed."""
+    if not isinstance(raw, dict):
+        raise ValueError("rooms must be an object of room_id: last_seen_message_id")
+    if len(raw) > current_app.config.get("SYNC_MAX_ROOMS", 100):
+        raise ValueError("Too many rooms")
+    try:
+        return {int(room_id): int(last_id or 0) for room_id, last_id in raw.items()}
+    except (TypeError, ValueError):
+        raise ValueError("rooms must be an object of room_id: last_seen_message_id")
+
+
+def missed_messages(positions: dict) -> dict:
+    """Map each room id to ``{"messages": [...], "reload": bool}``; messages oldest first."""
+    limit = max(1, current_app.config.get("SYNC_MAX_MESSAGES", 100))
+    found, pending = {}, {}
+    for room_id, last_id in positions.items():
+        if last_id <= 0:
+            found[room_id] = None  # nothing seen yet: the client loads the room normally
+            continue
+        cached = message_cache.since(room_id, last_id, limit)
+        if cached is None:
+            pending[room_id] = last_id
+        else:
+            found[room_id] = cached
+    if pending:
+        found.update(_load_missed(pending, limit))
+
+    result = {}
+    shown = [p for payloads in found.values() if payloads and len(payloads) <= limit for p in payloads]
+    authors = user_cache.get_many(p["user_id"] for p in shown)
+    for room_id, payloads in found.items():
+        if payloads is None or len(payloads) > limit:
+            result[room_id] = {"messages": [], "reload": True}
+            continue
+        messages = []
+        for payload in payloads:
+            author = authors.get(payload["user_id"]) or {}
+            messages.append(dict(payload, author_name=author.get("name"), author_image=avatar_pipeline.variant(author.get("image"))))
+        result[room_id] = {"messages": messages, "reload": False}
+    return result
+
+
+def _load_missed(positions: dict, limit: int) -> dict:
+    """Up to ``limit + 1`` messages after each position, in a single statement.
+
+    A room maps to None when its last seen message isn't in the table.
+    """
+    branches = []
+    for room_id, last_id in positions.items():
+        # Position by the last seen row's (created_at, id), like the history cursors.
+        # The row itself is selected too, to tell a missing anchor (NULL seen_at,
+        # nothing matches) apart from a room with nothing new
+        seen_at = (
+            db.select(Message.created_at)
+            .where(Message.id == last_id, Message.room_id == room_id)
+            .scalar_subquery()
+        )
+        page = (
+            db.select(Message.id, Message.room_id, Message.user_id, Message.content, Message.created_at)
+            .where(
+                Message.room_id == room_id,
+                db.or_(Message.created_at > seen_at, db.and_(Message.created_at == seen_at, Message.id >= last_id)),
+            )
+            .order_by(Message.created_at.asc(), Message.id.asc())
+            .limit(limit + 2)
+            .subquery()
+        )
+        branches.append(db.select(page))
+    statement = branches[0] if len(branches) == 1 else db.union_all(*branches)
+    found = {room_id: [] for room_id in positions}
+    for row in db.session.execute(statement):
+        found[row.room_id].append({
+            "id": row.id,
+            "room_id": row.room_id,
+            "user_id": row.user_id,
+            "content": row.content,
+            "created_at": row.created_at.isoformat() if row.created_at else None,
+        })
+    for room_id, payloads in found.items():
+        # UNION ALL doesn't keep each branch's order
+        payloads.sort(key=lambda p: (p["created_at"] or "", p["id"]))
+        if payloads and payloads[0]["id"] == positions[room_id]:
+            del payloads[0]
+        else:
+            found[room_id] = None
+    return found
@@ -0,0 +1,222 @@
+"""Transactional outbox for outgoing email.
+
+Requests never talk to the SMTP server: :meth:`MailOutbox.enqueue` adds a row
+to ``mail_outbox`` in the caller's transaction, so a mail exists exactly when
+what triggered it was committed. A background sender claims due rows in
+batches of ``MAIL_OUTBOX_BATCH_SIZE`` and sends each batch over one SMTP
+connection. A failed mail is retried with exponential backoff
+(``MAIL_RETRY_BASE_SECONDS`` doubling up to ``MAIL_RETRY_MAX_SECONDS``) and
+becomes ``dead`` after ``MAIL_MAX_ATTEMPTS`` attempts, or at once on a
+permanent (5xx) rejection.
+
+Claims are leases: a row stays ``sending`` for ``CLAIM_LEASE_SECONDS``, after
+which another sender may take it over, so several processes can share one
+outbox and a crashed sender's rows are not lost (at worst sent twice).
+
+``flask mail-outbox`` drains the outbox from the command line;
+``--retry-dead`` gives dead mails another round first.
+"""
+
+import logging
+import random
+import smtplib
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+import click
+from flask_mail import Message
+from flask.cli import with_appcontext
+
+from ..extensions import db, mail
+from ..models.mail_job import MailJob
+
+
+logger = logging.getLogger(__name__)
+
+CLAIM_LEASE_SECONDS = 300
+ERROR_MAX_LENGTH = 1000
+SUBJECT_MAX_LENGTH = MailJob.subject.type.length
+
+
+class MailOutbox:
+    def __init__(self):
+        self.app = None
+        self.sender_enabled = True
+        self.batch_size = 20
+        self.poll_interval = 15.0
+        self.max_attempts = 8
+        self.retry_base = 30.0
+        self.retry_max = 3600.0
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def init_app(self, app) -> None:
+        self.app = app
+        self.sender_enabled = app.config.get("MAIL_OUTBOX_SENDER", True)
+        self.batch_size = max(1, app.config.get("MAIL_OUTBOX_BATCH_SIZE", self.batch_size))
+        self.poll_interval = max(1, app.config.get("MAIL_OUTBOX_POLL_SECONDS", self.poll_interval))
+        self.max_attempts = max(1, app.config.get("MAIL_MAX_ATTEMPTS", self.max_attempts))
+        self.retry_base = max(1, app.config.get("MAIL_RETRY_BASE_SECONDS", self.retry_base))
+        self.retry_max = max(self.retry_base, app.config.get("MAIL_RETRY_MAX_SECONDS", self.retry_max))
+        if self.sender_enabled:
+            # Picks up mails left over from before a restart with the first request
+            app.before_request(self._ensure_worker)
+        app.cli.add_command(mail_command)
+
+    def enqueue(self, subject: str, recipients: list, body: str, sender: str = None) -> MailJob:
+        """Add a mail to the outbox; the caller commits, then calls :meth:`wake`.
+
+        ``subject`` is cut to the column size: a subject built from user input
+        (``"Feedback: " + subject``) must not fail the caller's transaction.
+        """
+        job = MailJob(
+            subject=subject[:SUBJECT_MAX_LENGTH],
+            sender=sender or self.app.config["MAIL_FROM"],
+            recipients=",".join(recipients),
+            body=body,
+        )
+        db.session.add(job)
+        return job
+
+    def wake(self) -> None:
+        """Send what is due now instead of at the next poll."""
+        if not self.sender_enabled:
+            return
+        self._ensure_worker()
+        self._wake.set()
+
+    def send_due(self) -> tuple:
+        """Claim and send one batch of due mails (app context); ``(sent, failed)``."""
+        now = datetime.utcnow()
+        due = (MailJob.status.in_(("pending", "sending")), MailJob.next_attempt_at <= now)
+        ids = [
+            job_id for (job_id,) in db.session.query(MailJob.id).filter(*due)
+            .order_by(MailJob.next_attempt_at, MailJob.id).limit(self.batch_size)
+        ]
+        if not ids:
+            return 0, 0
+        token = uuid.uuid4().hex
+        # Conditional update: of several senders racing for a row, one wins
+        db.session.query(MailJob).filter(MailJob.id.in_(ids), *due).update(
+            {"status": "sending", "claimed_by": token, "next_attempt_at": now + timedelta(seconds=CLAIM_LEASE_SECONDS)},
+            synchronize_session=False,
+        )
+        db.session.commit()
+        jobs = MailJob.query.filter_by(claimed_by=token, status="sending").order_by(MailJob.id).all()
+        if not jobs:
+            return 0, 0
+        sent = failed = 0
+        try:
+            with mail.connect() as connection:
+                for job in jobs:
+                    try:
+                        connection.send(_message(job))
+                    except Exception as e:
+                        if _connection_lost(e):
+                            raise
+                        self._failed(job, e)
+                        failed += 1
+                    else:
+                        job.status = "sent"
+                        job.sent_at = datetime.utcnow()
+                        job.attempts += 1
+                        job.claimed_by = None
+                        job.last_error = None
+                        sent += 1
+                    # One commit per mail: a crash mid-batch doesn't send the sent ones again
+                    db.session.commit()
+        except Exception as e:
+            # Connection refused or dropped: everything not sent yet goes back in line
+            logger.warning(f"SMTP connection failed: {e}")
+            for job in jobs:
+                if job.status == "sending":
+                    self._failed(job, e)
+                    failed += 1
+            db.session.commit()
+        return sent, failed
+
+    def send_all(self) -> tuple:
+        """Send batches until nothing is due (app context); ``(sent, failed)``."""
+        sent = failed = 0
+        while True:
+            batch_sent, batch_failed = self.send_due()
+            sent += batch_sent
+            failed += batch_failed
+            if batch_sent + batch_failed < self.batch_size:
+                return sent, failed
+
+    def retry_dead(self) -> int:
+        """Queue dead mails for a fresh round of attempts (app context)."""
+        count = db.session.query(MailJob).filter(MailJob.status == "dead").update(
+            {"status": "pending", "attempts": 0, "next_attempt_at": datetime.utcnow()},
+            synchronize_session=False,
+        )
+        db.session.commit()
+        return count
+
+    def _failed(self, job: MailJob, error: Exception) -> None:
+        job.attempts += 1
+        job.claimed_by = None
+        job.last_error = str(error)[:ERROR_MAX_LENGTH]
+        if job.attempts >= self.max_attempts or _permanent(error):
+            job.status = "dead"
+            logger.error(f"Mail {job.id} to {job.recipients} is dead after {job.attempts} attempts: {error}")
+            return
+        delay = min(self.retry_max, self.retry_base * 2 ** (job.attempts - 1))
+        job.status = "pending"
+        # Jitter, so mails that failed together don't retry in lockstep
+        job.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+    def _ensure_worker(self) -> None:
+        # Threads don't survive uWSGI's fork; a dead handle means start a new one
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="mail-outbox", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            try:
+                with self.app.app_context():
+                    self.send_all()
+            except Exception as e:
+                logger.error(f"Mail outbox run failed: {e}", exc_info=True)
+
+
+def _message(job: MailJob) -> Message:
+    return Message(subject=job.subject, sender=job.sender, recipients=job.recipients.split(","), body=job.body)
+
+
+def _connection_lost(error: Exception) -> bool:
+    # smtplib errors are OSErrors too; only socket-level ones end the connection
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+    return isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException)
+
+
+def _permanent(error: Exception) -> bool:
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code >= 500
+    return False
+
+
+@click.command("mail-outbox")
+@click.option("--retry-dead", is_flag=True, help="Give dead mails another round of attempts first.")
+@with_appcontext
+def mail_command(retry_dead):
+    """Send every due mail in the outbox now."""
+    if retry_dead:
+        click.echo(f"Requeued {mail_outbox.retry_dead()} dead mails")
+    sent, failed = mail_outbox.send_all()
+    click.echo(f"Sent {sent} mails, {failed} failed")
+
+
+mail_outbox = MailOutbox()
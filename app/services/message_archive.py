@@ -0,0 +1,495 @@
+"""Cold storage for old messages: compressed per-room, per-month segment files.
+
+``flask archive-messages`` (run it daily from cron) moves messages older than
+``ARCHIVE_AFTER_DAYS`` out of the ``messages`` table into
+``ARCHIVE_FOLDER/<room_id>/<YYYYMM>.seg``, then deletes them and their search
+postings from the database. Archived messages stay readable through history
+paging but are no longer found by search.
+
+A segment holds one room's messages of one month, in ``(created_at, id)``
+order, in zlib-compressed blocks of ``ARCHIVE_BLOCK_MESSAGES``:
+
+    b"CHATSEG1" | block | block | ... | index | footer
+
+The index (also compressed) is sparse: one entry per block, with its first and
+last key, offset, length and row count. A reader loads the index and then
+decompresses only the blocks it needs. Later runs only ever add newer rows to a
+month, so a segment grows by copying its compressed blocks verbatim into a new
+file, appending blocks and writing a new index. The new file replaces the old
+one atomically. Block offsets don't change, so readers holding the old index
+still read correct blocks. The rare exception is a message written after its
+month was archived: the segment is rewritten in order, and readers with the old
+index notice and reload it.
+
+Messages are archived strictly by age, so every archived message of a room is
+older than every message still in the table. ``get_messages`` pages through
+the table first and continues into the segments when it runs out. A crash
+between writing a segment and deleting the rows leaves them in both places. The
+next run skips the rows that are already archived, and paging never returns
+them twice because it continues strictly below the last key it returned.
+
+``ARCHIVE_FOLDER`` must be shared (or there must be one host) when several
+hosts serve the same database.
+"""
+
+import bisect
+import heapq
+import logging
+import os
+import shutil
+import struct
+import threading
+import zlib
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timedelta
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import func
+
+from ..extensions import db
+from ..models.message import Message
+from ..models.message_term import MessageTerm
+from .serialization import dumps, loads
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows: msvcrt.locking, see _try_lock
+
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"CHATSEG1"
+FOOTER = struct.Struct("<QI8s")  # index offset, index length, magic
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+DELETE_CHUNK_SIZE = 1000
+COMPRESSION_LEVEL = 6
+
+# Same attributes as the history query rows, so pages serialize either the same way
+ArchivedMessage = namedtuple("ArchivedMessage", "id room_id user_id content created_at")
+
+
+def _micros(created_at: datetime) -> int:
+    return (created_at - EPOCH) // MICROSECOND
+
+
+def _key(created_at: datetime, message_id: int) -> tuple:
+    return _micros(created_at), message_id
+
+
+def _month_start(moment: datetime) -> datetime:
+    return datetime(moment.year, moment.month, 1)
+
+
+def _next_month(month: datetime) -> datetime:
+    return datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def _try_lock(lock_file) -> bool:
+    """Lock an open file exclusively without waiting; False if another process holds it.
+
+    Released when the file is closed.
+    """
+    if fcntl is not None:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        return True
+    import msvcrt
+
+    try:
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        return False
+    return True
+
+
+class StaleSegment(Exception):
+    """The segment file was rewritten since its index was loaded."""
+
+
+class Segment:
+    """Index of one segment file; blocks are read on demand."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            f.seek(-FOOTER.size, os.SEEK_END)
+            index_offset, index_length, magic = FOOTER.unpack(f.read(FOOTER.size))
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a message segment")
+            f.seek(index_offset)
+            # [first_us, first_id, last_us, last_id, offset, length, count] per block
+            self.blocks = [tuple(entry) for entry in loads(zlib.decompress(f.read(index_length)))]
+        self.identity = (stat.st_ino, stat.st_mtime_ns)
+        self.index_offset = index_offset
+        self.first_keys = [(b[0], b[1]) for b in self.blocks]
+        self.last_keys = [(b[2], b[3]) for b in self.blocks]
+        self.count = sum(b[6] for b in self.blocks)
+
+    @property
+    def last_key(self):
+        return self.last_keys[-1] if self.blocks else None
+
+    def read_block(self, i: int) -> list:
+        _, _, _, _, offset, length, _ = self.blocks[i]
+        with open(self.path, "rb") as f:
+            if os.fstat(f.fileno()).st_ino != self.identity[0] and Segment(self.path).blocks[:i + 1] != self.blocks[:i + 1]:
+                raise StaleSegment(self.path)
+            f.seek(offset)
+            return loads(zlib.decompress(f.read(length)))
+
+
+class SegmentWriter:
+    """Writes a segment: the blocks of ``existing`` (copied as is), then new rows."""
+
+    def __init__(self, path: str, block_messages: int, existing: Segment = None):
+        self.path = path
+        self.block_messages = block_messages
+        self.tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        self._file = open(self.tmp_path, "wb")
+        self._file.write(MAGIC)
+        self.blocks = []
+        self.last_key = None
+        self.added = 0
+        self.late = []
+        self._pending = []
+        if existing is not None and existing.blocks:
+            with open(existing.path, "rb") as f:
+                f.seek(len(MAGIC))
+                remaining = existing.index_offset - len(MAGIC)
+                while remaining > 0:
+                    chunk = f.read(min(remaining, 1 << 20))
+                    if not chunk:
+                        raise ValueError(f"{existing.path} is truncated")
+                    self._file.write(chunk)
+                    remaining -= len(chunk)
+            self.blocks = list(existing.blocks)
+            self.last_key = existing.last_key
+
+    def add(self, message_id: int, user_id: int, content: str, created_at: datetime) -> None:
+        """Append one message; rows must come in ``(created_at, id)`` order."""
+        self.add_row([message_id, user_id, _micros(created_at), content])
+
+    def add_row(self, row: list) -> None:
+        key = (row[2], row[0])
+        if self.last_key is not None and key <= self.last_key:
+            # Not newer than what the segment has: a duplicate or a late write, see _merge_late
+            self.late.append(row)
+            return
+        self._pending.append(row)
+        self.last_key = key
+        self.added += 1
+        if len(self._pending) >= self.block_messages:
+            self._flush_block()
+
+    def _flush_block(self) -> None:
+        if not self._pending:
+            return
+        data = zlib.compress(dumps(self._pending), COMPRESSION_LEVEL)
+        first, last = self._pending[0], self._pending[-1]
+        self.blocks.append([first[2], first[0], last[2], last[0], self._file.tell(), len(data), len(self._pending)])
+        self._file.write(data)
+        self._pending = []
+
+    def commit(self) -> None:
+        """Write the index and put the file in place, durably."""
+        self._flush_block()
+        index = zlib.compress(dumps(self.blocks), COMPRESSION_LEVEL)
+        index_offset = self._file.tell()
+        self._file.write(index)
+        self._file.write(FOOTER.pack(index_offset, len(index), MAGIC))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self.tmp_path, self.path)
+        if os.name == "nt":
+            return  # Windows can't open a directory to fsync it
+        directory = os.open(os.path.dirname(self.path), os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+    def abort(self) -> None:
+        self._file.close()
+        try:
+            os.remove(self.tmp_path)
+        except FileNotFoundError:
+            pass
+
+
+class MessageArchive:
+    def __init__(self):
+        self.folder = None
+        self.after_days = 180
+        self.block_messages = 256
+        self.batch_size = 2000
+        self.block_cache_size = 256
+        self._lock = threading.Lock()
+        self._rooms = {}  # room_id -> (directory mtime_ns, [Segment] oldest first)
+        self._blocks = OrderedDict()  # (path, identity, block) -> rows, least recently used first
+        self.block_hits = 0
+        self.block_misses = 0
+
+    def init_app(self, app) -> None:
+        self.folder = app.config.get("ARCHIVE_FOLDER")
+        self.after_days = max(1, app.config.get("ARCHIVE_AFTER_DAYS", self.after_days))
+        self.block_messages = max(1, app.config.get("ARCHIVE_BLOCK_MESSAGES", self.block_messages))
+        self.batch_size = max(1, app.config.get("ARCHIVE_BATCH_SIZE", self.batch_size))
+        self.block_cache_size = max(0, app.config.get("ARCHIVE_BLOCK_CACHE", self.block_cache_size))
+        app.cli.add_command(archive_command)
+
+    # Reading
+
+    def _room_dir(self, room_id: int) -> str:
+        return os.path.join(self.folder, str(int(room_id)))
+
+    def segments(self, room_id: int) -> list:
+        """The room's segments, oldest first (empty if nothing is archived)."""
+        if not self.folder:
+            return []
+        directory = self._room_dir(room_id)
+        try:
+            # Every segment write replaces a file in the directory, which bumps its mtime
+            mtime = os.stat(directory).st_mtime_ns
+        except FileNotFoundError:
+            self._rooms.pop(room_id, None)
+            return []
+        cached = self._rooms.get(room_id)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        segments = []
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(".seg"):
+                try:
+                    segments.append(Segment(os.path.join(directory, name)))
+                except (OSError, ValueError, zlib.error) as e:
+                    logger.error(f"Skipping unreadable archive segment {name} of room {room_id}: {e}")
+        self._rooms[room_id] = (mtime, segments)
+        return segments
+
+    def _block(self, segment: Segment, i: int) -> list:
+        cache_key = (segment.path, segment.identity, i)
+        with self._lock:
+            rows = self._blocks.get(cache_key)
+            if rows is not None:
+                self._blocks.move_to_end(cache_key)
+                self.block_hits += 1
+                return rows
+            self.block_misses += 1
+        rows = segment.read_block(i)
+        if self.block_cache_size:
+            with self._lock:
+                self._blocks[cache_key] = rows
+                while len(self._blocks) > self.block_cache_size:
+                    self._blocks.popitem(last=False)
+        return rows
+
+    @staticmethod
+    def _message(room_id: int, row) -> ArchivedMessage:
+        message_id, user_id, micros, content = row
+        return ArchivedMessage(message_id, room_id, user_id, content, EPOCH + micros * MICROSECOND)
+
+    def older_than(self, room_id: int, position=None, limit: int = 50) -> list:
+        """Up to ``limit`` archived messages before ``(created_at, id)``, newest first.
+
+        Without a position, the newest archived messages.
+        """
+        try:
+            return self._older_than(room_id, position, limit)
+        except StaleSegment:
+            self._rooms.pop(room_id, None)
+            return self._older_than(room_id, position, limit)
+
+    def newer_than(self, room_id: int, position, limit: int = 50) -> list:
+        """Up to ``limit`` archived messages after ``(created_at, id)``, oldest first."""
+        try:
+            return self._newer_than(room_id, position, limit)
+        except StaleSegment:
+            self._rooms.pop(room_id, None)
+            return self._newer_than(room_id, position, limit)
+
+    def _older_than(self, room_id: int, position, limit: int) -> list:
+        key = None if position is None else _key(*position)
+        result = []
+        try:
+            for segment in reversed(self.segments(room_id)):
+                end = len(segment.blocks) if key is None else bisect.bisect_left(segment.first_keys, key)
+                for i in range(end - 1, -1, -1):
+                    for row in reversed(self._block(segment, i)):
+                        if key is None or (row[2], row[0]) < key:
+                            result.append(self._message(room_id, row))
+                            if len(result) >= limit:
+                                return result
+        except FileNotFoundError:
+            pass  # Room deleted meanwhile
+        return result
+
+    def _newer_than(self, room_id: int, position, limit: int) -> list:
+        key = _key(*position)
+        result = []
+        try:
+            for segment in self.segments(room_id):
+                if segment.last_key is None or segment.last_key <= key:
+                    continue
+                for i in range(bisect.bisect_right(segment.last_keys, key), len(segment.blocks)):
+                    for row in self._block(segment, i):
+                        if (row[2], row[0]) > key:
+                            result.append(self._message(room_id, row))
+                            if len(result) >= limit:
+                                return result
+        except FileNotFoundError:
+            pass
+        return result
+
+    def drop_room(self, room_id: int) -> None:
+        if self.folder:
+            shutil.rmtree(self._room_dir(room_id), ignore_errors=True)
+        self._rooms.pop(room_id, None)
+
+    def stats(self) -> dict:
+        return {
+            "rooms_loaded": len(self._rooms),
+            "segments_loaded": sum(len(segments) for _, segments in self._rooms.values()),
+            "cached_blocks": len(self._blocks),
+            "block_hits": self.block_hits,
+            "block_misses": self.block_misses,
+        }
+
+    # Archiving
+
+    def archive(self, older_than: datetime = None, room_id: int = None):
+        """Move messages created before ``older_than`` into segments.
+
+        Returns ``{room_id: messages archived}``, or None if another process
+        is archiving right now. The rows' search postings are deleted with
+        them, so archived messages are no longer found by search.
+        """
+        from ..models.room import Room
+
+        if not self.folder:
+            raise RuntimeError("ARCHIVE_FOLDER is not set")
+        if older_than is None:
+            older_than = datetime.utcnow() - timedelta(days=self.after_days)
+        os.makedirs(self.folder, exist_ok=True)
+        with open(os.path.join(self.folder, ".lock"), "w") as lock:
+            if not _try_lock(lock):
+                return None
+            # The newest row stays: ids are assigned from MAX(id) + 1 (write-behind mode,
+            # MySQL before 8.0 after a restart), so removing it could hand its id out again
+            max_id = db.session.query(func.max(Message.id)).scalar()
+            if max_id is None:
+                return {}
+            room_ids = [room_id] if room_id is not None else [rid for (rid,) in db.session.query(Room.id).order_by(Room.id)]
+            result = {}
+            for rid in room_ids:
+                archived = self._archive_room(rid, older_than, max_id)
+                if archived:
+                    result[rid] = archived
+            return result
+
+    def _archive_room(self, room_id: int, older_than: datetime, max_id: int) -> int:
+        archived = 0
+        start = None
+        while True:
+            query = db.session.query(func.min(Message.created_at)).filter(
+                Message.room_id == room_id, Message.created_at < older_than, Message.id < max_id
+            )
+            if start is not None:
+                query = query.filter(Message.created_at >= start)
+            oldest = query.scalar()
+            if oldest is None:
+                return archived
+            month = _month_start(oldest)
+            end = min(_next_month(month), older_than)
+            archived += self._archive_month(room_id, month, end, max_id)
+            start = end
+
+    def _archive_month(self, room_id: int, month: datetime, end: datetime, max_id: int) -> int:
+        directory = self._room_dir(room_id)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{month:%Y%m}.seg")
+        existing = Segment(path) if os.path.exists(path) else None
+        writer = SegmentWriter(path, self.block_messages, existing)
+        ids = []
+        try:
+            after = None
+            while True:
+                query = db.session.query(Message.id, Message.user_id, Message.content, Message.created_at).filter(
+                    Message.room_id == room_id, Message.created_at >= month, Message.created_at < end, Message.id < max_id
+                )
+                if after is not None:
+                    query = query.filter(db.or_(
+                        Message.created_at > after[0], db.and_(Message.created_at == after[0], Message.id > after[1])
+                    ))
+                rows = query.order_by(Message.created_at.asc(), Message.id.asc()).limit(self.batch_size).all()
+                if not rows:
+                    break
+                for row in rows:
+                    writer.add(row.id, row.user_id, row.content, row.created_at)
+                    ids.append(row.id)
+                after = (rows[-1].created_at, rows[-1].id)
+            if writer.added:
+                writer.commit()
+            else:
+                writer.abort()
+        except BaseException:
+            writer.abort()
+            raise
+        if writer.late:
+            self._merge_late(path, writer.late)
+        # Everything is on disk: now the rows and their search postings leave the database
+        for i in range(0, len(ids), DELETE_CHUNK_SIZE):
+            chunk = ids[i:i + DELETE_CHUNK_SIZE]
+            db.session.query(MessageTerm).filter(MessageTerm.message_id.in_(chunk)).delete(synchronize_session=False)
+            db.session.query(Message).filter(Message.id.in_(chunk)).delete(synchronize_session=False)
+        db.session.commit()
+        return len(ids)
+
+    def _merge_late(self, path: str, late: list) -> None:
+        """Rewrite a segment with rows older than its newest row (left over or written late)."""
+        segment = Segment(path)
+        known = set()
+        for i in range(len(segment.blocks)):
+            known.update(row[0] for row in segment.read_block(i))
+        late = sorted((row for row in late if row[0] not in known), key=lambda row: (row[2], row[0]))
+        if not late:
+            return  # Already archived by a run that stopped before deleting them
+        logger.warning(f"Merging {len(late)} late messages into {path}")
+
+        def archived_rows():
+            for i in range(len(segment.blocks)):
+                yield from segment.read_block(i)
+
+        writer = SegmentWriter(path, self.block_messages)
+        try:
+            for row in heapq.merge(archived_rows(), late, key=lambda row: (row[2], row[0])):
+                writer.add_row(row)
+            writer.commit()
+        except BaseException:
+            writer.abort()
+            raise
+
+
+@click.command("archive-messages")
+@click.option("--older-than-days", type=int, default=None, help="Defaults to ARCHIVE_AFTER_DAYS.")
+@click.option("--room", "room_id", type=int, default=None, help="Only this room.")
+@with_appcontext
+def archive_command(older_than_days, room_id):
+    """Move old messages from the messages table into archive segments."""
+    older_than = None
+    if older_than_days is not None:
+        older_than = datetime.utcnow() - timedelta(days=max(0, older_than_days))
+    result = message_archive.archive(older_than, room_id)
+    if result is None:
+        click.echo("Another archive run is in progress")
+        return
+    click.echo(f"Archived {sum(result.values())} messages from {len(result)} rooms")
+
+
+message_archive = MessageArchive()
@@ -0,0 +1,318 @@
+"""In-memory ring buffer of the newest messages per room.
+
+``GET /rooms/<id>/messages`` without ``before`` is served from here. A room's
+buffer is primed from the database on first read and then kept current by
+``on_send_message`` (and, with a broker, by messages sent on other processes).
+Rooms are LRU-evicted once the approximate payload size of all buffers goes
+over ``MESSAGE_CACHE_MAX_BYTES``; deeper pages always go to the database.
+
+Each entry also keeps its encoded JSON, and the last newest page served for a
+room is kept as a ready response body until the room or an author changes.
+"""
+
+import bisect
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from .serialization import Encoded, dumps_array
+
+
+logger = logging.getLogger(__name__)
+
+# Rough per-message overhead of the payload dict and its encoded copy on top of its content
+_ENTRY_OVERHEAD = 384
+
+
+def _entry_size(payload: dict) -> int:
+    return _ENTRY_OVERHEAD + len(payload.get("content") or "") * 4
+
+
+def _sort_key(payload: dict) -> tuple:
+    # Same (created_at, id) order as the history query and its cursors; created_at
+    # is stored with microseconds (DATETIME(6)). ISO strings compare like the
+    # datetimes, including isoformat() leaving out ".000000"
+    return (payload.get("created_at") or "", payload["id"])
+
+
+class _RoomBuffer:
+    __slots__ = ("keys", "items", "ids", "encoded", "primed", "complete", "size", "version", "page")
+
+    def __init__(self):
+        self.keys = []  # sorted (created_at, id)
+        self.ids = set()
+        self.items = []  # payloads, same order as keys
+        self.encoded = {}  # message id -> (author generation, JSON bytes)
+        self.primed = False  # holds the newest messages from the database
+        self.complete = False  # holds every message of the room
+        self.size = 0
+        self.version = 0  # bumped whenever items change
+        self.page = None  # (limit, version, generation, body, first, last, count)
+
+    def drop_page(self) -> int:
+        if self.page is None:
+            return 0
+        size = len(self.page[3])
+        self.page = None
+        self.size -= size
+        return size
+
+
+class RecentMessageCache:
+    def __init__(self):
+        self.enabled = True
+        self.per_room = 200
+        self.max_bytes = 32 * 1024 * 1024
+        self.broker = None
+        self.channel = "chat-messages"
+        self._node_id = None
+        self._rooms = OrderedDict()  # room_id -> _RoomBuffer, least recently used first
+        self._total = 0
+        self._versions = {}  # room_id -> bumped on every change, survives buffer eviction
+        self._lock = threading.Lock()
+        self._started_pid = None
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app, broker=None) -> None:
+        self.enabled = app.config.get("MESSAGE_CACHE_ENABLED", True)
+        self.per_room = max(1, app.config.get("MESSAGE_CACHE_PER_ROOM", 200))
+        self.max_bytes = max(0, app.config.get("MESSAGE_CACHE_MAX_BYTES", self.max_bytes))
+        self.broker = broker
+        self.channel = app.config.get("MESSAGE_CACHE_CHANNEL", self.channel)
+
+    def _ensure_started(self) -> None:
+        # Started lazily in the serving process: threads don't survive uWSGI's fork
+        if self.broker is None or self._started_pid == os.getpid():
+            return
+        with self._lock:
+            if self._started_pid == os.getpid():
+                return
+            self._started_pid = os.getpid()
+            self._node_id = f"{os.getpid()}-{id(self)}"
+            self._rooms.clear()
+            self._versions.clear()
+            self._total = 0
+        from ..extensions import socketio
+
+        socketio.start_background_task(self._listen)
+
+    def add(self, payload, generation: int = None) -> None:
+        """Record a message that was just sent.
+
+        ``payload`` may be an :class:`Encoded`; its bytes are reused for history
+        pages while the author profiles are still at ``generation``.
+        """
+        if not self.enabled:
+            return
+        self._ensure_started()
+        encoded = None
+        if isinstance(payload, Encoded):
+            if generation is not None:
+                encoded = (generation, payload.data)
+            message, payload = payload, payload.value
+        else:
+            message = payload
+        self._add_local(payload, encoded)
+        if self.broker is not None:
+            try:
+                self.broker.publish(self.channel, {"node": self._node_id, "message": message})
+            except Exception as e:
+                logger.error(f"Message cache publish failed: {e}")
+
+    def recent(self, room_id: int, limit: int, loader):
+        """Return the newest ``limit`` payloads (oldest first), or None to use the database.
+
+        ``loader(n)`` must return the newest ``n`` payloads of the room, oldest
+        first; it is called once to prime a room that isn't buffered yet.
+        """
+        if not self.enabled or limit > self.per_room:
+            return None
+        self._ensure_started()
+        with self._lock:
+            buf = self._rooms.get(room_id)
+            if buf is not None and buf.primed:
+                self._rooms.move_to_end(room_id)
+                if len(buf.items) >= limit or buf.complete:
+                    self.hits += 1
+                    return list(buf.items[-limit:])
+        return self._prime(room_id, limit, loader)
+
+    def recent_page(self, room_id: int, limit: int, loader, encode_many, generation: int):
+        """Like :meth:`recent`, but as a JSON array body ready to send.
+
+        Returns ``(body, first, last, count)`` or None to use the database.
+        ``encode_many(payloads)`` returns the encoded JSON of each payload with
+        current authors; ``generation`` is the author profile generation read
+        before encoding, so entries encoded with stale authors are redone.
+        """
+        if not self.enabled or limit > self.per_room:
+            return None
+        self._ensure_started()
+        with self._lock:
+            buf = self._rooms.get(room_id)
+            if buf is not None and buf.primed:
+                page = buf.page
+                if page is not None and page[:3] == (limit, buf.version, generation):
+                    self._rooms.move_to_end(room_id)
+                    self.hits += 1
+                    return page[3:]
+        items = self.recent(room_id, limit, loader)
+        if items is None:
+            return None
+        # Encode outside the lock; only entries without current bytes need work
+        with self._lock:
+            buf = self._rooms.get(room_id)
+            version = buf.version if buf is not None else None
+            known = buf.encoded if buf is not None else {}
+            fragments = [known.get(p["id"]) for p in items]
+        fragments = [f[1] if f is not None and f[0] == generation else None for f in fragments]
+        stale = [p for p, f in zip(items, fragments) if f is None]
+        if stale:
+            fresh = iter(encode_many(stale))
+            fragments = [f if f is not None else next(fresh) for f in fragments]
+        body = dumps_array(fragments)
+        result = (body, items[0] if items else None, items[-1] if items else None, len(items))
+        with self._lock:
+            buf = self._rooms.get(room_id)
+            if buf is not None and buf.version == version:
+                for payload, data in zip(items, fragments):
+                    if payload["id"] in buf.ids:
+                        buf.encoded[payload["id"]] = (generation, data)
+                self._total -= buf.drop_page()
+                buf.page = (limit, version, generation) + result
+                buf.size += len(body)
+                self._total += len(body)
+                self._evict()
+        return result
+
+    def since(self, room_id: int, message_id: int, limit: int):
+        """Payloads newer than ``message_id`` (oldest first), or None if the buffer can't tell.
+
+        At most ``limit + 1`` are returned, so callers can tell an overflow apart.
+        """
+        if not self.enabled:
+            return None
+        self._ensure_started()
+        with self._lock:
+            buf = self._rooms.get(room_id)
+            # Only a primed buffer is known to hold everything after its oldest entry
+            if buf is None or not buf.primed or message_id not in buf.ids:
+                return None
+            index = len(buf.items) - 1
+            while buf.items[index]["id"] != message_id:
+                index -= 1
+            self._rooms.move_to_end(room_id)
+            self.hits += 1
+            return buf.items[index + 1:index + 2 + limit]
+
+    def _prime(self, room_id: int, limit: int, loader):
+        self.misses += 1
+        # Messages sent while the query runs are appended to the (unprimed) buffer
+        # and merged by id below, so nothing falls in between
+        with self._lock:
+            if room_id not in self._rooms:
+                self._rooms[room_id] = _RoomBuffer()
+        rows = loader(self.per_room)
+        with self._lock:
+            buf = self._rooms.get(room_id)
+            if buf is None:
+                return rows[-limit:]
+            for payload in rows:
+                self._insert(buf, payload)
+            self._trim(buf)
+            buf.version += 1
+            buf.primed = True
+            buf.complete = len(rows) < self.per_room and len(buf.items) < self.per_room
+            self._evict()
+            return list(buf.items[-limit:])
+
+    def version(self, room_id: int):
+        """Changes whenever a message is added to the room (for ETags); None if disabled."""
+        if not self.enabled:
+            return None
+        self._ensure_started()
+        with self._lock:
+            return self._versions.get(room_id, 0)
+
+    def drop_room(self, room_id: int) -> None:
+        with self._lock:
+            self._versions[room_id] = self._versions.get(room_id, 0) + 1
+            buf = self._rooms.pop(room_id, None)
+            if buf is not None:
+                self._total -= buf.size
+
+    def clear(self) -> None:
+        with self._lock:
+            for room_id in self._versions:
+                self._versions[room_id] += 1
+            self._rooms.clear()
+            self._total = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"rooms": len(self._rooms), "bytes": self._total, "hits": self.hits, "misses": self.misses}
+
+    def _add_local(self, payload: dict, encoded: tuple = None) -> None:
+        with self._lock:
+            self._versions[payload["room_id"]] = self._versions.get(payload["room_id"], 0) + 1
+            buf = self._rooms.get(payload["room_id"])
+            if buf is None:
+                # Unprimed until the first read merges in the database rows; holding
+                # sends from now on also covers rows still queued by the write-behind writer
+                buf = self._rooms[payload["room_id"]] = _RoomBuffer()
+            self._insert(buf, payload)
+            if encoded is not None and payload["id"] in buf.ids:
+                buf.encoded[payload["id"]] = encoded
+            if self._trim(buf):
+                buf.complete = False
+            buf.version += 1
+            self._total -= buf.drop_page()
+            self._evict()
+
+    def _insert(self, buf: _RoomBuffer, payload: dict) -> None:
+        # Caller holds self._lock. Almost always an append; duplicates by id are skipped
+        if payload["id"] in buf.ids:
+            return
+        key = _sort_key(payload)
+        index = bisect.bisect_right(buf.keys, key)
+        buf.ids.add(payload["id"])
+        buf.keys.insert(index, key)
+        buf.items.insert(index, payload)
+        size = _entry_size(payload)
+        buf.size += size
+        self._total += size
+
+    def _trim(self, buf: _RoomBuffer) -> bool:
+        # Caller holds self._lock
+        excess = len(buf.items) - self.per_room
+        if excess <= 0:
+            return False
+        for payload in buf.items[:excess]:
+            buf.ids.discard(payload["id"])
+            buf.encoded.pop(payload["id"], None)
+            size = _entry_size(payload)
+            buf.size -= size
+            self._total -= size
+        del buf.keys[:excess]
+        del buf.items[:excess]
+        return True
+
+    def _evict(self) -> None:
+        # Caller holds self._lock; keep the most recently used room
+        while self._total > self.max_bytes and len(self._rooms) > 1:
+            _, buf = self._rooms.popitem(last=False)
+            self._total -= buf.size
+
+    def _listen(self) -> None:
+        for message in self.broker.listen(self.channel):
+            if message.get("node") == self._node_id or "message" not in message:
+                continue
+            try:
+                self._add_local(message["message"])
+            except (KeyError, TypeError):
+                continue
+
+
+message_cache = RecentMessageCache()
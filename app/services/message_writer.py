@@ -0,0 +1,344 @@
+"""Message persistence for the chat namespace.
+
+``sync`` mode commits every message before it is broadcast. ``write_behind``
+mode assigns the id and timestamp in-process, returns immediately so the
+message can be broadcast, and a background worker flushes pending rows to the
+``messages`` table in batched multi-row inserts.
+
+A batch that fails with a transient error (``OperationalError``: the database
+is down, a lost connection, a deadlock) goes back to the head of the queue and
+is retried. A batch the database rejects (an integrity or data error, e.g. a
+message for a room deleted meanwhile) is bisected until the offending rows are
+isolated; those are logged and dead-lettered and the rest are written. A row
+whose id another writer already took (two processes with the same
+``MESSAGE_ID_OFFSET``) is not dropped: the sequence is reseeded from the table
+and the row written under a new id.
+
+Search index terms (:mod:`.search_index`) are written in the same transaction
+as their messages.
+"""
+
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from ..extensions import db
+from ..models.message import Message
+from ..models.message_term import MessageTerm
+from .message_cache import message_cache
+from .search_index import search_index
+
+
+logger = logging.getLogger(__name__)
+
+WRITE_MODE_SYNC = "sync"
+WRITE_MODE_WRITE_BEHIND = "write_behind"
+# Seconds to wait before retrying a batch after a failed flush
+FLUSH_RETRY_DELAY = 1.0
+# Rows the database rejected, kept for /admin/cache-stats
+DEAD_LETTER_MAX = 100
+
+
+class MessageWriter:
+    def __init__(self):
+        self.app = None
+        self.mode = WRITE_MODE_SYNC
+        self.max_batch_size = 200
+        self.max_delay = 0.05
+        self.queue_max = 10000
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._id_lock = threading.Lock()
+        self._next_id = None
+        self.id_stride = 1
+        self._id_offset_setting = None
+        self._thread = None
+        self._stopped = False
+        self._atexit_registered = False
+        self.dead_letters = deque(maxlen=DEAD_LETTER_MAX)
+        self.dead_lettered = 0
+
+    def init_app(self, app) -> None:
+        self.app = app
+        mode = app.config.get("MESSAGE_WRITE_MODE", WRITE_MODE_SYNC)
+        if mode not in (WRITE_MODE_SYNC, WRITE_MODE_WRITE_BEHIND):
+            logger.warning(f"Unknown MESSAGE_WRITE_MODE {mode!r}, falling back to sync")
+            mode = WRITE_MODE_SYNC
+        self.mode = mode
+        self.max_batch_size = max(1, app.config.get("MESSAGE_BATCH_MAX_SIZE", 200))
+        self.max_delay = max(0, app.config.get("MESSAGE_BATCH_MAX_DELAY_MS", 50)) / 1000.0
+        self.queue_max = max(self.max_batch_size, app.config.get("MESSAGE_WRITE_QUEUE_MAX", 10000))
+        self.id_stride = max(1, app.config.get("MESSAGE_ID_STRIDE", 1))
+        self._id_offset_setting = app.config.get("MESSAGE_ID_OFFSET")
+        if self.write_behind:
+            _check_id_ranges(self.id_stride, self._id_offset_setting)
+        if self.write_behind and not self._atexit_registered:
+            # Flush whatever is still pending when the worker process exits
+            atexit.register(self.close)
+            self._atexit_registered = True
+
+    @property
+    def write_behind(self) -> bool:
+        return self.mode == WRITE_MODE_WRITE_BEHIND
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    def submit(self, room_id: int, user_id: int, content: str) -> dict:
+        """Persist (or enqueue) a chat message and return its row values."""
+        if not self.write_behind:
+            msg = Message(room_id=room_id, user_id=user_id, content=content)
+            db.session.add(msg)
+            db.session.flush()
+            terms = search_index.term_rows([msg])
+            if terms:
+                db.session.execute(MessageTerm.__table__.insert(), terms)
+            db.session.commit()
+            return {
+                "id": msg.id,
+                "room_id": msg.room_id,
+                "user_id": msg.user_id,
+                "content": msg.content,
+                "created_at": msg.created_at,
+            }
+
+        row = {
+            "id": self._allocate_id(),
+            "room_id": room_id,
+            "user_id": user_id,
+            "content": content,
+            "created_at": datetime.utcnow(),
+        }
+        with self._cond:
+            self._pending.append(row)
+            backlog = len(self._pending)
+            self._ensure_worker()
+            self._cond.notify()
+        if backlog > self.queue_max:
+            # The worker can't keep up (or the DB is down); make the sender pay
+            self.flush()
+        return row
+
+    def flush(self) -> bool:
+        """Write all pending rows. Returns False if a batch failed and was requeued."""
+        with self._flush_lock:
+            while True:
+                with self._cond:
+                    batch = []
+                    while self._pending and len(batch) < self.max_batch_size:
+                        batch.append(self._pending.popleft())
+                if not batch:
+                    return True
+                unwritten = self._write_isolating(batch)
+                if unwritten:
+                    with self._cond:
+                        self._pending.extendleft(reversed(unwritten))
+                    return False
+
+    def discard_room(self, room_id: int) -> int:
+        """Drop the room's pending rows (the room is being deleted). Returns how many."""
+        # Under the flush lock, so a batch being written has committed by the time we return
+        with self._flush_lock, self._cond:
+            kept = [row for row in self._pending if row["room_id"] != room_id]
+            dropped = len(self._pending) - len(kept)
+            if dropped:
+                self._pending = deque(kept)
+        return dropped
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "pending": len(self._pending),
+            "dead_lettered": self.dead_lettered,
+            "recent_dead_letters": [
+                {"id": row["id"], "room_id": row["room_id"], "user_id": row["user_id"], "error": error}
+                for row, error in self.dead_letters
+            ],
+        }
+
+    def _write_isolating(self, batch: list) -> list:
+        """Write ``batch``, bisecting it to dead-letter rows the database rejects.
+
+        Returns the rows left unwritten because of a transient error, in order.
+        """
+        chunks = [batch]
+        reassigned = set()
+        while chunks:
+            rows = chunks.pop()
+            try:
+                self._write(rows)
+            except OperationalError as e:
+                logger.error(f"Failed to flush {len(rows)} messages, will retry: {e}")
+                return rows + [row for chunk in reversed(chunks) for row in chunk]
+            except Exception as e:
+                if len(rows) == 1:
+                    row = rows[0]
+                    if isinstance(e, IntegrityError) and id(row) not in reassigned:
+                        existing = self._stored(row["id"])
+                        if existing == (row["room_id"], row["user_id"], row["content"], row["created_at"]):
+                            # Committed by an earlier attempt whose commit reported a failure
+                            continue
+                        if existing is not None:
+                            # Already broadcast, so don't drop it: write it under a fresh id
+                            reassigned.add(id(row))
+                            self._reassign_id(row)
+                            chunks.append(rows)
+                            continue
+                    self._dead_letter(row, e)
+                    continue
+                if rows is batch:
+                    logger.warning(f"Batch of {len(rows)} messages rejected, isolating bad rows: {e}")
+                middle = len(rows) // 2
+                chunks.append(rows[middle:])
+                chunks.append(rows[:middle])
+        return []
+
+    def _write(self, rows: list) -> None:
+        # A fresh app context gets its own scoped session, so flushing from
+        # inside a request or socket handler never touches the caller's session
+        with self.app.app_context():
+            try:
+                db.session.execute(Message.__table__.insert(), rows)
+                terms = search_index.term_rows(rows)
+                if terms:
+                    db.session.execute(MessageTerm.__table__.insert(), terms)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+
+    def _stored(self, message_id: int):
+        with self.app.app_context():
+            row = (
+                db.session.query(Message.room_id, Message.user_id, Message.content, Message.created_at)
+                .filter(Message.id == message_id)
+                .first()
+            )
+            return tuple(row) if row is not None else None
+
+    def _reassign_id(self, row: dict) -> None:
+        with self._id_lock:
+            # Another writer hands out ids in our residue class: skip past everything it wrote
+            self._next_id = None
+        old_id = row["id"]
+        row["id"] = self._allocate_id()
+        # Its buffered copy still carries the old id; the next read reloads the room
+        message_cache.drop_room(row["room_id"])
+        logger.error(
+            f"Message id {old_id} was already taken (is MESSAGE_ID_OFFSET unique per node?); "
+            f"writing room {row['room_id']}'s message as {row['id']}"
+        )
+
+    def _dead_letter(self, row: dict, error: Exception) -> None:
+        self.dead_lettered += 1
+        self.dead_letters.append((row, str(getattr(error, "orig", error))[:200]))
+        logger.error(
+            f"Dropping message {row['id']} (room {row['room_id']}, user {row['user_id']}): "
+            f"rejected by the database: {error}"
+        )
+
+    def close(self) -> None:
+        """Stop the background worker and flush everything still pending."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=10)
+        if self._pending and self.app is not None:
+            self.flush()
+
+    def _allocate_id(self) -> int:
+        with self._id_lock:
+            if self._next_id is None:
+                # Seed the in-process sequence once from the table, then only hand out
+                # ids in this process's residue class so concurrent writers never collide.
+                # Resolved here rather than in init_app because uWSGI may fork workers
+                # after the app was created in the master
+                offset = _id_offset(self._id_offset_setting) % self.id_stride
+                with self.app.app_context():
+                    start = (db.session.query(func.max(Message.id)).scalar() or 0) + 1
+                self._next_id = start + (offset - start) % self.id_stride
+            value = self._next_id
+            self._next_id += self.id_stride
+            return value
+
+    def _ensure_worker(self) -> None:
+        # Caller holds self._cond
+        if self._thread is None or not self._thread.is_alive():
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, name="message-writer", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                # Give the batch up to max_delay to fill before writing it
+                deadline = time.monotonic() + self.max_delay
+                while len(self._pending) < self.max_batch_size and not self._stopped:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            if not self.flush():
+                time.sleep(FLUSH_RETRY_DELAY)
+
+
+def _id_offset(value) -> int:
+    """This process's residue: the node's MESSAGE_ID_OFFSET plus its uWSGI worker id - 1"""
+    return _node_offset(value) + _uwsgi_worker_index()
+
+
+def _node_offset(value) -> int:
+    if value not in (None, ""):
+        try:
+            return int(value)
+        except ValueError:
+            logger.warning(f"Invalid MESSAGE_ID_OFFSET {value!r}, using 0")
+    return 0
+
+
+def _uwsgi_worker_index() -> int:
+    try:
+        import uwsgi
+
+        return uwsgi.worker_id() - 1
+    except (ImportError, AttributeError):
+        return 0
+
+
+def _check_id_ranges(stride: int, offset_setting) -> None:
+    """Log an error for settings under which two writer processes share ids"""
+    try:
+        import uwsgi
+
+        processes = uwsgi.numproc
+    except (ImportError, AttributeError):
+        processes = None
+    offset = _node_offset(offset_setting)
+    if offset < 0 or offset + (processes or 1) > stride:
+        logger.error(
+            f"MESSAGE_ID_OFFSET={offset} with {processes or 1} writer process(es) doesn't fit "
+            f"MESSAGE_ID_STRIDE={stride}: processes will share message ids. STRIDE must cover "
+            f"every worker on every node, and each node's OFFSET start its own range"
+        )
+    elif processes is None and stride > 1 and offset_setting in (None, ""):
+        logger.error(
+            f"MESSAGE_ID_STRIDE={stride} outside uWSGI needs a MESSAGE_ID_OFFSET (0-{stride - 1}) "
+            f"unique to each writer process; all of them would use 0"
+        )
+
+
+message_writer = MessageWriter()
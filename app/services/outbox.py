@@ -0,0 +1,104 @@
+"""Per-room outbound event batching for busy rooms.
+
+With ``EMIT_BATCH_INTERVAL_MS`` set, room events (``new_message``,
+``user_joined``, ``user_left``, ``typing_summary``) are queued per room and
+sent every interval as one ``batch`` packet::
+
+    batch { room_id, events: [[event, data], ...] }
+
+in the order they were queued. A room whose queue reaches
+``EMIT_BATCH_MAX_SIZE`` is flushed right away, so latency stays bounded by
+the interval. With the interval at 0 (the default) events are emitted one by
+one as before.
+"""
+
+import logging
+import os
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+class RoomOutbox:
+    def __init__(self):
+        self.interval = 0.0
+        self.max_size = 100
+        self._pending = {}  # room_id -> [[event, data], ...]
+        self._lock = threading.Lock()
+        self._started_pid = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    def init_app(self, app) -> None:
+        self.interval = max(0, app.config.get("EMIT_BATCH_INTERVAL_MS", 0)) / 1000.0
+        self.max_size = max(1, app.config.get("EMIT_BATCH_MAX_SIZE", self.max_size))
+
+    def _ensure_started(self) -> None:
+        # Started lazily in the serving process: threads don't survive uWSGI's fork
+        if self._started_pid == os.getpid():
+            return
+        with self._lock:
+            if self._started_pid == os.getpid():
+                return
+            self._started_pid = os.getpid()
+            self._pending.clear()
+        from ..extensions import socketio
+
+        socketio.start_background_task(self._run)
+
+    def emit(self, room_id: int, event: str, data) -> None:
+        """Send ``event`` to everyone in the room, batched when enabled."""
+        if not self.enabled:
+            self._send(room_id, event, data)
+            return
+        self._ensure_started()
+        with self._lock:
+            events = self._pending.setdefault(room_id, [])
+            events.append([event, data])
+            if len(events) < self.max_size:
+                return
+            del self._pending[room_id]
+        self._send_batch(room_id, events)
+
+    def flush(self, room_id: int = None) -> None:
+        """Send what is queued now, for one room or all of them.
+
+        Call before emitting a room event that bypasses the outbox (room_closed,
+        room_deleted) so it doesn't overtake queued messages.
+        """
+        with self._lock:
+            if room_id is None:
+                pending, self._pending = self._pending, {}
+            else:
+                events = self._pending.pop(room_id, None)
+                pending = {room_id: events} if events else {}
+        for rid, events in pending.items():
+            self._send_batch(rid, events)
+
+    def _send(self, room_id: int, event: str, data) -> None:
+        from ..extensions import socketio
+        from .socketio import _room_key
+
+        socketio.emit(event, data, room=_room_key(room_id), namespace="/chat")
+
+    def _send_batch(self, room_id: int, events: list) -> None:
+        if len(events) == 1:
+            self._send(room_id, *events[0])
+        else:
+            self._send(room_id, "batch", {"room_id": room_id, "events": events})
+
+    def _run(self) -> None:
+        from ..extensions import socketio
+
+        while True:
+            socketio.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Outbox flush failed: {e}", exc_info=True)
+
+
+room_outbox = RoomOutbox()
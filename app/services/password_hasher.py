@@ -0,0 +1,165 @@
+"""bcrypt hashing on a bounded worker pool.
+
+Hashing and checking a password costs ~250ms of CPU at cost 12, so doing it
+on request threads lets a burst of logins occupy every worker. All bcrypt calls
+(``User``/``Room`` ``set_password`` and ``check_password``) run instead on
+``PASSWORD_HASH_WORKERS`` threads (bcrypt releases the GIL, so they hash in
+parallel). The caller's request thread still waits for the result, so the
+number of calls in flight (running plus waiting) is capped below the request
+threads: under uWSGI, ``threads`` minus ``PASSWORD_HASH_RESERVE_THREADS``, which
+stay free for other requests during a burst of logins. A call over the cap
+raises :class:`PasswordHashBusy` right away, answered with a 503 and a
+``Retry-After`` estimated from the queue. ``PASSWORD_HASH_QUEUE_MAX`` (calls
+waiting beyond the workers) overrides the derived cap.
+
+New hashes use ``PASSWORD_HASH_ROUNDS``; a hash with another cost is replaced
+the next time its password is presented (see :meth:`PasswordHasher.needs_rehash`).
+"""
+
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+from flask import jsonify
+
+from .cooperative import run_blocking
+
+
+MIN_ROUNDS = 4
+MAX_ROUNDS = 31
+# Calls allowed to wait for a worker when request threads aren't a limit (eventlet
+# green threads, the development server)
+DEFAULT_QUEUE_MAX = 32
+
+
+class PasswordHashBusy(Exception):
+    """Too many bcrypt calls are already queued."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Password hashing saturated, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class PasswordHasher:
+    def __init__(self):
+        self.rounds = 12
+        self.workers = os.cpu_count() or 2
+        self.queue_max = DEFAULT_QUEUE_MAX
+        self.max_pending = self.workers + self.queue_max
+        self._executor = None
+        self._pid = None
+        self._pending = 0  # queued and running calls
+        self._avg_seconds = 0.25  # moving average of one call
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def init_app(self, app) -> None:
+        self.rounds = min(MAX_ROUNDS, max(MIN_ROUNDS, app.config.get("PASSWORD_HASH_ROUNDS", self.rounds)))
+        self.workers = max(1, app.config.get("PASSWORD_HASH_WORKERS", 0) or self.workers)
+        queue_max = app.config.get("PASSWORD_HASH_QUEUE_MAX", -1)
+        threads = _request_threads()
+        if queue_max >= 0:
+            self.queue_max = queue_max
+            self.max_pending = self.workers + queue_max
+        elif threads is not None:
+            # Every call in flight holds a request thread; keep the reserve free
+            self.max_pending = max(1, threads - max(0, app.config.get("PASSWORD_HASH_RESERVE_THREADS", 2)))
+            self.queue_max = max(0, self.max_pending - self.workers)
+        else:
+            self.queue_max = DEFAULT_QUEUE_MAX
+            self.max_pending = self.workers + self.queue_max
+        app.register_error_handler(PasswordHashBusy, _busy_response)
+
+    def hash_password(self, password: str) -> str:
+        salt = bcrypt.gensalt(rounds=self.rounds)
+        return self._run(bcrypt.hashpw, password.encode("utf-8"), salt).decode("utf-8")
+
+    def check_password(self, password: str, hashed: str) -> bool:
+        if not hashed:
+            return False
+        try:
+            return self._run(bcrypt.checkpw, password.encode("utf-8"), hashed.encode("utf-8"))
+        except ValueError:
+            return False
+
+    def needs_rehash(self, hashed: str) -> bool:
+        """Whether ``hashed`` was made with another cost than ``PASSWORD_HASH_ROUNDS``."""
+        try:
+            return int(hashed.split("$")[2]) != self.rounds
+        except (AttributeError, IndexError, ValueError):
+            return False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "rounds": self.rounds,
+                "workers": self.workers,
+                "pending": self._pending,
+                "queue_max": self.queue_max,
+                "max_pending": self.max_pending,
+                "avg_ms": round(self._avg_seconds * 1000, 1),
+                "rejected": self.rejected,
+            }
+
+    def _run(self, fn, *args):
+        with self._lock:
+            executor = self._get_executor()
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                # Time for the pool to work through what is ahead of a new call
+                retry_after = max(1, math.ceil(self._pending / self.workers * self._avg_seconds))
+                raise PasswordHashBusy(retry_after)
+            self._pending += 1
+        try:
+            return executor.submit(self._timed, fn, *args).result()
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def _timed(self, fn, *args):
+        started = time.perf_counter()
+        try:
+            # Pool workers are green threads in eventlet mode; bcrypt itself runs on a real one
+            return run_blocking(fn, *args)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self._avg_seconds += (elapsed - self._avg_seconds) * 0.2
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # Created lazily in the serving process: threads don't survive uWSGI's fork
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._pending = 0
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        return self._executor
+
+
+def _request_threads():
+    """Request threads of this uWSGI worker, or None when waiting doesn't hold one."""
+    try:
+        import uwsgi
+    except ImportError:
+        return None
+    value = uwsgi.opt.get("threads")
+    if isinstance(value, list):
+        value = value[-1]
+    if isinstance(value, bytes):
+        value = value.decode("ascii", "replace")
+    try:
+        return max(1, int(value))
+    except (TypeError, ValueError):
+        return 1  # no "threads" option: one request at a time
+
+
+def _busy_response(error: PasswordHashBusy):
+    resp = jsonify({"error": "伺服器忙碌中，請稍後再試"})
+    resp.status_code = 503
+    resp.headers["Retry-After"] = str(error.retry_after)
+    return resp
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,334 @@
+"""Online-user registry shared by every worker process.
+
+Presence is tracked per Socket.IO connection, so a user with several tabs stays
+online until the last one disconnects, and per chat room, so clients only hear
+about users in the rooms they joined:
+
+- on ``join_room`` the client receives a ``presence_snapshot`` for that room
+- changes are coalesced for ``PRESENCE_DELTA_WINDOW_MS`` and sent to the room
+  as one ``presence_delta``; a disconnect followed by a reconnect inside the
+  window produces no event at all
+- snapshots and deltas carry a ``version`` (microsecond clock); clients drop
+  deltas that are not newer than the snapshot they hold
+
+Each process owns the connections made to it. When a broker is configured,
+changes are published on the presence channel and every process keeps a
+replica of the other processes' users and rooms. Full-state heartbeats heal
+lost updates, and a process that stops heartbeating is dropped after
+``PRESENCE_NODE_TTL``.
+"""
+
+import atexit
+import logging
+import os
+import threading
+import time
+import uuid
+
+
+logger = logging.getLogger(__name__)
+
+
+class PresenceRegistry:
+    def __init__(self):
+        self.node_id = uuid.uuid4().hex
+        self.broker = None
+        self.channel = "chat-presence"
+        self.heartbeat_interval = 10.0
+        self.node_ttl = 30.0
+        self.delta_window = 0.25
+        self._conns = {}  # sid -> {"user_id": id, "rooms": set(room_id)}
+        self._users = {}  # user_id -> {"info": info, "sids": set(sid)}
+        self._rooms = {}  # room_id -> {user_id: set(sid)} for connections on this process
+        self._remote = {}  # node_id -> {"users": {user_id: info}, "rooms": {room_id: set(user_id)}, "seen": monotonic}
+        self._dirty = {}  # room_id -> user_ids changed here since the last delta
+        self._published = {}  # room_id -> user_ids last announced as present
+        self._last_version = 0
+        self._lock = threading.Lock()
+        self._started_pid = None
+
+    def init_app(self, app, broker=None) -> None:
+        self.broker = broker
+        self.channel = app.config.get("PRESENCE_CHANNEL", self.channel)
+        self.heartbeat_interval = float(app.config.get("PRESENCE_HEARTBEAT_SECONDS", self.heartbeat_interval))
+        self.node_ttl = max(self.heartbeat_interval * 2, float(app.config.get("PRESENCE_NODE_TTL", self.node_ttl)))
+        self.delta_window = max(0.01, app.config.get("PRESENCE_DELTA_WINDOW_MS", 250) / 1000.0)
+
+    def _ensure_started(self) -> None:
+        # Started lazily in the serving process: threads don't survive uWSGI's fork
+        if self._started_pid == os.getpid():
+            return
+        with self._lock:
+            if self._started_pid == os.getpid():
+                return
+            self._started_pid = os.getpid()
+            self.node_id = uuid.uuid4().hex
+            for state in (self._conns, self._users, self._rooms, self._remote, self._dirty, self._published):
+                state.clear()
+        from ..extensions import socketio
+
+        socketio.start_background_task(self._flush_deltas)
+        if self.broker is not None:
+            atexit.register(self.close)
+            socketio.start_background_task(self._listen)
+            socketio.start_background_task(self._heartbeat)
+            self._publish({"op": "hello"})
+
+    # Connections
+
+    def connect(self, sid: str, user_id: int, info: dict) -> bool:
+        """Register a connection. Returns True if the user just came online."""
+        self._ensure_started()
+        with self._lock:
+            self._conns[sid] = {"user_id": user_id, "rooms": set()}
+            user = self._users.setdefault(user_id, {"info": info, "sids": set()})
+            user["info"] = info
+            first = not user["sids"]
+            user["sids"].add(sid)
+        if first:
+            self._publish({"op": "add", "user": info})
+        return first
+
+    def disconnect(self, sid: str):
+        """Drop a connection and its rooms. Returns the user id if the user went offline."""
+        self._ensure_started()
+        with self._lock:
+            conn = self._conns.get(sid)
+            rooms = list(conn["rooms"]) if conn else []
+        for room_id in rooms:
+            self.leave(sid, room_id)
+        with self._lock:
+            conn = self._conns.pop(sid, None)
+            if conn is None:
+                return None
+            user_id = conn["user_id"]
+            user = self._users.get(user_id)
+            if user is None:
+                return None
+            user["sids"].discard(sid)
+            if user["sids"]:
+                return None
+            del self._users[user_id]
+        self._publish({"op": "remove", "user_id": user_id})
+        return user_id
+
+    def join(self, sid: str, room_id: int) -> None:
+        self._ensure_started()
+        with self._lock:
+            conn = self._conns.get(sid)
+            if conn is None:
+                return
+            conn["rooms"].add(room_id)
+            user_id = conn["user_id"]
+            sids = self._rooms.setdefault(room_id, {}).setdefault(user_id, set())
+            first = not sids
+            sids.add(sid)
+            if first:
+                self._dirty.setdefault(room_id, set()).add(user_id)
+        if first:
+            self._publish({"op": "join", "room_id": room_id, "user_id": user_id})
+
+    def leave(self, sid: str, room_id: int) -> None:
+        with self._lock:
+            conn = self._conns.get(sid)
+            if conn is None or room_id not in conn["rooms"]:
+                return
+            conn["rooms"].discard(room_id)
+            user_id = conn["user_id"]
+            room = self._rooms.get(room_id, {})
+            sids = room.get(user_id, set())
+            sids.discard(sid)
+            last = not sids
+            if last:
+                room.pop(user_id, None)
+                if not room:
+                    self._rooms.pop(room_id, None)
+                self._dirty.setdefault(room_id, set()).add(user_id)
+        if last:
+            self._publish({"op": "leave", "room_id": room_id, "user_id": user_id})
+
+    def drop_room(self, room_id: int) -> None:
+        """Forget a closed or deleted room everywhere."""
+        self._drop_room_local(room_id)
+        self._publish({"op": "drop_room", "room_id": room_id})
+
+    def _drop_room_local(self, room_id: int) -> None:
+        with self._lock:
+            for user_sids in self._rooms.pop(room_id, {}).values():
+                for sid in user_sids:
+                    conn = self._conns.get(sid)
+                    if conn:
+                        conn["rooms"].discard(room_id)
+            for node in self._remote.values():
+                node["rooms"].pop(room_id, None)
+            self._dirty.pop(room_id, None)
+            self._published.pop(room_id, None)
+
+    # Queries
+
+    def ids(self) -> set:
+        self._ensure_started()
+        with self._lock:
+            self._expire_nodes()
+            result = set(self._users)
+            for node in self._remote.values():
+                result.update(node["users"])
+            return result
+
+    def is_online(self, user_id: int) -> bool:
+        return user_id in self.ids()
+
+    def room_snapshot(self, room_id: int) -> dict:
+        self._ensure_started()
+        with self._lock:
+            self._expire_nodes()
+            user_ids = self._room_user_ids(room_id)
+            return {
+                "room_id": room_id,
+                "version": self._next_version(),
+                "users": [info for info in (self._user_info(uid) for uid in user_ids) if info],
+            }
+
+    def _room_user_ids(self, room_id: int) -> set:
+        # Caller holds self._lock
+        result = set(self._rooms.get(room_id, ()))
+        for node in self._remote.values():
+            result.update(node["rooms"].get(room_id, ()))
+        return result
+
+    def _user_info(self, user_id: int):
+        # Caller holds self._lock
+        user = self._users.get(user_id)
+        if user is not None:
+            return user["info"]
+        for node in self._remote.values():
+            if user_id in node["users"]:
+                return node["users"][user_id]
+        return None
+
+    def _next_version(self) -> int:
+        # Caller holds self._lock. Wall-clock based so versions from different
+        # processes are comparable, but never repeats within one process
+        self._last_version = max(self._last_version + 1, time.time_ns() // 1000)
+        return self._last_version
+
+    # Delta emission
+
+    def _flush_deltas(self) -> None:
+        from ..extensions import socketio
+
+        while True:
+            socketio.sleep(self.delta_window)
+            try:
+                for delta in self._collect_deltas():
+                    socketio.emit("presence_delta", delta, room=_room_key(delta["room_id"]), namespace="/chat")
+            except Exception as e:
+                logger.error(f"Presence delta flush failed: {e}", exc_info=True)
+
+    def _collect_deltas(self) -> list:
+        with self._lock:
+            if not self._dirty:
+                return []
+            dirty, self._dirty = self._dirty, {}
+            self._expire_nodes()
+            deltas = []
+            for room_id, user_ids in dirty.items():
+                present = self._room_user_ids(room_id)
+                published = self._published.setdefault(room_id, set())
+                online, offline = [], []
+                for user_id in user_ids:
+                    if user_id in present and user_id not in published:
+                        info = self._user_info(user_id)
+                        if info:
+                            online.append(info)
+                            published.add(user_id)
+                    elif user_id not in present and user_id in published:
+                        offline.append(user_id)
+                        published.discard(user_id)
+                if not published:
+                    self._published.pop(room_id, None)
+                if online or offline:
+                    deltas.append({
+                        "room_id": room_id,
+                        "version": self._next_version(),
+                        "online": online,
+                        "offline": offline,
+                    })
+            return deltas
+
+    # Replication between processes
+
+    def _publish(self, message: dict) -> None:
+        if self.broker is None:
+            return
+        message["node"] = self.node_id
+        try:
+            self.broker.publish(self.channel, message)
+        except Exception as e:
+            logger.error(f"Presence publish failed: {e}")
+
+    def _expire_nodes(self) -> None:
+        # Caller holds self._lock
+        cutoff = time.monotonic() - self.node_ttl
+        for node_id in [n for n, node in self._remote.items() if node["seen"] < cutoff]:
+            del self._remote[node_id]
+
+    def _listen(self) -> None:
+        for message in self.broker.listen(self.channel):
+            node_id = message.get("node")
+            if not node_id or node_id == self.node_id:
+                continue
+            op = message.get("op")
+            if op == "hello":
+                # A new process wants everyone's state
+                self._send_state()
+                continue
+            if op == "drop_room":
+                self._drop_room_local(message.get("room_id"))
+                continue
+            with self._lock:
+                if op == "bye":
+                    self._remote.pop(node_id, None)
+                    continue
+                node = self._remote.setdefault(node_id, {"users": {}, "rooms": {}, "seen": 0})
+                node["seen"] = time.monotonic()
+                if op == "state":
+                    node["users"] = {u["id"]: u for u in message.get("users", [])}
+                    # JSON object keys arrive as strings
+                    node["rooms"] = {int(r): set(uids) for r, uids in message.get("rooms", {}).items()}
+                elif op == "add":
+                    node["users"][message["user"]["id"]] = message["user"]
+                elif op == "remove":
+                    node["users"].pop(message.get("user_id"), None)
+                elif op == "join":
+                    node["rooms"].setdefault(message["room_id"], set()).add(message["user_id"])
+                elif op == "leave":
+                    room = node["rooms"].get(message["room_id"], set())
+                    room.discard(message["user_id"])
+                    if not room:
+                        node["rooms"].pop(message["room_id"], None)
+
+    def _send_state(self) -> None:
+        with self._lock:
+            users = [user["info"] for user in self._users.values()]
+            rooms = {room_id: list(room) for room_id, room in self._rooms.items()}
+        self._publish({"op": "state", "users": users, "rooms": rooms})
+
+    def _heartbeat(self) -> None:
+        from ..extensions import socketio
+
+        while True:
+            self._send_state()
+            socketio.sleep(self.heartbeat_interval)
+
+    def close(self) -> None:
+        self._publish({"op": "bye"})
+
+
+def _room_key(room_id: int) -> str:
+    from .socketio import _room_key as room_key
+
+    return room_key(room_id)
+
+
+presence = PresenceRegistry()
@@ -0,0 +1,303 @@
+"""Read-replica routing for read-only endpoints.
+
+``DATABASE_REPLICA_URLS`` lists replica databases (comma-separated). Views
+decorated with :func:`replica_reads` send their plain SELECTs to one healthy
+replica, round-robin. Writes, ``SELECT ... FOR UPDATE``, reads after the
+session has written and everything outside those views use the primary.
+
+Health and lag: a background task in each process reads the heartbeat row
+(:class:`~app.models.replica_heartbeat.ReplicaHeartbeat`) from every replica
+every ``REPLICA_HEALTH_INTERVAL_SECONDS``, then rewrites it on the primary.
+How old a replica's copy is bounds how far behind it is. A replica that is
+more than ``REPLICA_MAX_LAG_SECONDS`` behind, or that fails the check, gets no
+reads until a later check passes. With no replica left, reads use the primary.
+
+Read-your-writes: a user whose request committed something (sending a
+message, joining or creating a room, ...) reads from the primary for
+``REPLICA_MAX_LAG_SECONDS + REPLICA_HEALTH_INTERVAL_SECONDS``, the longest a
+write can take to show up on a replica that passed its last check. With a
+broker the mark reaches every process.
+
+Process-level caches (the newest-messages ring buffer, the room directory,
+user profiles) are filled inside :func:`primary_reads`. A fill from a lagging
+replica would be served to everyone after the replica caught up. For the same
+reason, responses read from a replica carry no ETag.
+"""
+
+import functools
+import itertools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import has_request_context
+from flask_login import current_user
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, insert, select, update
+from sqlalchemy.sql import Select
+
+from .db_pool import pool_options
+
+
+logger = logging.getLogger(__name__)
+
+BIND_PREFIX = "replica"
+HEARTBEAT_ID = 1
+
+
+class RoutingSession(Session):
+    """Session that sends plain SELECTs to the replica chosen for the request."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        replica = self.info.get("replica")
+        if replica is not None and bind is None and not self.info.get("wrote") and _is_plain_select(clause):
+            return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _is_plain_select(clause) -> bool:
+    return isinstance(clause, Select) and clause._for_update_arg is None
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def _after_flush(session, flush_context):
+    # Later reads of this session must see what it wrote: primary from here on
+    session.info["wrote"] = True
+    session.info["commit_marks_user"] = True
+
+
+@event.listens_for(RoutingSession, "do_orm_execute")
+def _on_execute(state):
+    if not state.is_select:
+        state.session.info["wrote"] = True
+        state.session.info["commit_marks_user"] = True
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def _after_commit(session):
+    if not session.info.pop("commit_marks_user", False) or not has_request_context():
+        return
+    user_id = _current_user_id()
+    if user_id is not None:
+        replica_router.note_write(user_id)
+
+
+def _current_user_id():
+    try:
+        return current_user.id if current_user.is_authenticated else None
+    except Exception:
+        return None
+
+
+class Replica:
+    def __init__(self, name: str, engine):
+        self.name = name
+        self.engine = engine
+        self.healthy = False  # until the first check passes
+        self.lag = None
+        self.error = None
+        self.reads = 0
+
+
+class ReplicaRouter:
+    def __init__(self):
+        self.primary = None
+        self.replicas = []
+        self.max_lag = 5.0
+        self.interval = 2.0
+        self.broker = None
+        self.channel = "chat-read-your-writes"
+        self._cycle = itertools.count()
+        self._lock = threading.Lock()
+        self._writes = {}  # user_id -> read from the primary until (Unix time)
+        self._published = {}  # user_id -> mark last sent to other processes
+        self._started_pid = None
+        self.read_your_writes = 0
+        self.no_replica = 0
+
+    def configure(self, app) -> None:
+        """Add one SQLALCHEMY_BINDS entry per replica URL before db.init_app."""
+        urls = [url.strip() for url in app.config.get("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+        binds = app.config.setdefault("SQLALCHEMY_BINDS", {})
+        for index, url in enumerate(urls, 1):
+            binds.setdefault(f"{BIND_PREFIX}{index}", dict(pool_options(app, url), url=url))
+
+    def init_app(self, app, broker=None) -> None:
+        from ..extensions import db
+
+        self.max_lag = float(app.config.get("REPLICA_MAX_LAG_SECONDS", self.max_lag))
+        self.interval = max(0.1, float(app.config.get("REPLICA_HEALTH_INTERVAL_SECONDS", self.interval)))
+        self.broker = broker
+        self.channel = app.config.get("REPLICA_WRITES_CHANNEL", self.channel)
+        with app.app_context():
+            engines = dict(db.engines)
+        self.primary = engines[None]
+        self.replicas = [
+            Replica(key, engine) for key, engine in sorted(engines.items(), key=lambda item: item[0] or "")
+            if key and key.startswith(BIND_PREFIX)
+        ]
+        self._started_pid = None
+
+    @property
+    def window(self) -> float:
+        """How long a user reads from the primary after a write."""
+        return self.max_lag + self.interval
+
+    def _ensure_started(self) -> None:
+        # Started lazily in the serving process: threads don't survive uWSGI's fork
+        if self._started_pid == os.getpid():
+            return
+        with self._lock:
+            if self._started_pid == os.getpid():
+                return
+            self._started_pid = os.getpid()
+            self._writes.clear()
+            self._published.clear()
+            for replica in self.replicas:
+                replica.healthy = False
+        from ..extensions import socketio
+
+        socketio.start_background_task(self._monitor)
+        if self.broker is not None:
+            socketio.start_background_task(self._listen)
+
+    def choose(self, user_id=None):
+        """The replica for a read-only request, or None to use the primary."""
+        if not self.replicas:
+            return None
+        self._ensure_started()
+        if user_id is not None and self._writes.get(user_id, 0) > time.time():
+            self.read_your_writes += 1
+            return None
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            self.no_replica += 1
+            return None
+        replica = healthy[next(self._cycle) % len(healthy)]
+        replica.reads += 1
+        return replica
+
+    def note_write(self, user_id: int) -> None:
+        """Send this user's reads to the primary until replicas have caught up."""
+        if not self.replicas:
+            return
+        until = time.time() + self.window
+        self._writes[user_id] = max(self._writes.get(user_id, 0), until)
+        if self.broker is not None and until > self._published.get(user_id, 0):
+            # Sent ahead by one interval, so a burst of writes costs one publish per interval
+            self._published[user_id] = until + self.interval
+            try:
+                self.broker.publish(self.channel, {"user_id": user_id, "until": until + self.interval, "pid": os.getpid()})
+            except Exception as e:
+                logger.error(f"Read-your-writes publish failed: {e}")
+
+    def check(self) -> None:
+        """Measure every replica's lag, then write a new heartbeat on the primary."""
+        from ..models.replica_heartbeat import ReplicaHeartbeat
+
+        table = ReplicaHeartbeat.__table__
+        now = time.time()
+        for replica in self.replicas:
+            try:
+                with replica.engine.connect() as conn:
+                    beat_ms = conn.execute(select(table.c.beat_ms).where(table.c.id == HEARTBEAT_ID)).scalar()
+                if beat_ms is None:
+                    raise LookupError("no heartbeat replicated yet")
+                replica.lag, replica.error = max(0.0, now - beat_ms / 1000.0), None
+            except Exception as e:
+                replica.lag, replica.error = None, str(e)[:200]
+            healthy = replica.lag is not None and replica.lag <= self.max_lag
+            if healthy != replica.healthy:
+                logger.warning(f"Replica {replica.name} {'back in rotation' if healthy else 'out of rotation'}: lag={replica.lag} error={replica.error}")
+            replica.healthy = healthy
+        try:
+            with self.primary.begin() as conn:
+                beat_ms = int(time.time() * 1000)
+                if not conn.execute(update(table).where(table.c.id == HEARTBEAT_ID).values(beat_ms=beat_ms)).rowcount:
+                    conn.execute(insert(table).values(id=HEARTBEAT_ID, beat_ms=beat_ms))
+        except Exception as e:
+            # Another process may have inserted the row first; the next round updates it
+            logger.warning(f"Replica heartbeat write failed: {e}")
+        for marks in (self._writes, self._published):
+            for user_id in [user_id for user_id, until in list(marks.items()) if until <= now]:
+                marks.pop(user_id, None)
+
+    def stats(self) -> dict:
+        return {
+            "replicas": [
+                {
+                    "name": replica.name,
+                    "healthy": replica.healthy,
+                    "lag_ms": None if replica.lag is None else round(replica.lag * 1000),
+                    "error": replica.error,
+                    "reads": replica.reads,
+                }
+                for replica in self.replicas
+            ],
+            "primary_reads": {"read_your_writes": self.read_your_writes, "no_healthy_replica": self.no_replica},
+            "users_on_primary": len(self._writes),
+        }
+
+    def _monitor(self) -> None:
+        from ..extensions import socketio
+
+        while True:
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"Replica health check failed: {e}", exc_info=True)
+            socketio.sleep(self.interval)
+
+    def _listen(self) -> None:
+        for message in self.broker.listen(self.channel):
+            try:
+                user_id, until = message["user_id"], float(message["until"])
+            except (KeyError, TypeError, ValueError):
+                continue
+            self._writes[user_id] = max(self._writes.get(user_id, 0), until)
+
+
+def replica_reads(view):
+    """Serve this view's SELECTs from a replica, unless the user has just written."""
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        from ..extensions import db
+
+        replica = replica_router.choose(_current_user_id())
+        if replica is None:
+            return view(*args, **kwargs)
+        db.session.info["replica"] = replica.engine
+        try:
+            return view(*args, **kwargs)
+        finally:
+            db.session.info.pop("replica", None)
+
+    return wrapper
+
+
+def on_replica() -> bool:
+    """Whether the current request's reads go to a replica."""
+    from ..extensions import db
+
+    info = db.session.info
+    return info.get("replica") is not None and not info.get("wrote")
+
+
+@contextmanager
+def primary_reads():
+    """Read from the primary inside this block (cache fills)."""
+    from ..extensions import db
+
+    info = db.session.info
+    replica = info.pop("replica", None)
+    try:
+        yield
+    finally:
+        if replica is not None:
+            info["replica"] = replica
+
+
+replica_router = ReplicaRouter()
@@ -0,0 +1,221 @@
+"""Process-level cache of the room list behind ``GET /rooms``.
+
+Holds every active room once, in name order, split into the public list that
+every user sees and the private rooms, plus each user's membership set.
+A user's list is the public list merged with their own private rooms, so a
+request does work proportional to the rooms it returns and no queries once
+warm. Room changes drop the whole directory, membership changes only that
+user's set; with a broker the invalidation reaches every process. Entries
+also expire after ``ROOM_DIRECTORY_TTL_SECONDS``; a reload that finds a
+different list (a change made outside the app, or on a process without a
+broker) changes the ETag version like an invalidation does.
+"""
+
+import heapq
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from ..extensions import db
+from ..models.membership import RoomMembership
+from ..models.room import Room
+from .replicas import primary_reads
+
+
+logger = logging.getLogger(__name__)
+
+
+class _Directory:
+    __slots__ = ("expires", "all", "public", "private", "rank", "created_by")
+
+    def __init__(self, rooms: list, expires: float):
+        self.expires = expires
+        self.all = rooms  # active rooms, name order
+        self.public = [r for r in rooms if r["room_type"] == "public"]
+        self.private = {r["id"]: r for r in rooms if r["room_type"] != "public"}
+        self.rank = {r["id"]: i for i, r in enumerate(rooms)}
+        self.created_by = {}  # user_id -> ids of private rooms they created
+        for room in self.private.values():
+            self.created_by.setdefault(room["created_by"], []).append(room["id"])
+
+
+class RoomDirectory:
+    def __init__(self):
+        self.ttl = 60.0
+        self.max_users = 50000
+        self.broker = None
+        self.channel = "chat-room-directory"
+        self._directory = None
+        self._members = OrderedDict()  # user_id -> (expires, frozenset of room ids), oldest first
+        self._lock = threading.Lock()
+        self._generation = 0  # bumped by every invalidation
+        self._rooms_version = 0  # bumped when rooms change
+        self._member_versions = {}  # user_id -> bumped when their memberships change
+        self._started_pid = None
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app, broker=None) -> None:
+        self.ttl = float(app.config.get("ROOM_DIRECTORY_TTL_SECONDS", self.ttl))
+        self.max_users = max(1, app.config.get("ROOM_DIRECTORY_MAX_USERS", self.max_users))
+        self.broker = broker
+        self.channel = app.config.get("ROOM_DIRECTORY_CHANNEL", self.channel)
+
+    def _ensure_started(self) -> None:
+        # Started lazily in the serving process: threads don't survive uWSGI's fork
+        if self.broker is None or self._started_pid == os.getpid():
+            return
+        with self._lock:
+            if self._started_pid == os.getpid():
+                return
+            self._started_pid = os.getpid()
+            self._directory = None
+            self._members.clear()
+            self._member_versions.clear()
+        from ..extensions import socketio
+
+        socketio.start_background_task(self._listen)
+
+    def visible_rooms(self, user_id: int, is_admin: bool) -> list:
+        """``GET /rooms`` entries for a user, in name order."""
+        self._ensure_started()
+        directory = self._rooms()
+        members = self._memberships(user_id)
+        if is_admin:
+            rooms = directory.all
+        else:
+            own = members.union(directory.created_by.get(user_id, ()))
+            private = sorted(
+                (directory.private[room_id] for room_id in own if room_id in directory.private),
+                key=lambda r: directory.rank[r["id"]],
+            )
+            rooms = heapq.merge(directory.public, private, key=lambda r: directory.rank[r["id"]])
+        return [
+            dict(r, is_member=r["id"] in members, is_creator=r["created_by"] == user_id)
+            for r in rooms
+        ]
+
+    def version(self, user_id: int) -> tuple:
+        """Changes whenever the user's room list may have changed (for ETags)."""
+        self._ensure_started()
+        # Load what is missing or expired first, so a reload that finds another
+        # list has bumped its version before the tag is built
+        self._rooms()
+        self._memberships(user_id, count_hit=False)
+        with self._lock:
+            return self._rooms_version, self._member_versions.get(user_id, 0)
+
+    def invalidate_rooms(self) -> None:
+        """A room was created, changed, closed or deleted."""
+        self._invalidate_local(None)
+        self._publish(None)
+
+    def invalidate_member(self, user_id: int) -> None:
+        """A user joined or left a room."""
+        self._invalidate_local(user_id)
+        self._publish(user_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            directory = self._directory
+            return {
+                "rooms": len(directory.all) if directory is not None else 0,
+                "users": len(self._members),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def _rooms(self) -> _Directory:
+        now = time.monotonic()
+        with self._lock:
+            directory = self._directory
+            generation = self._generation
+        if directory is not None and directory.expires > now:
+            return directory
+        with primary_reads():
+            rows = (
+                db.session.query(Room.id, Room.name, Room.room_no, Room.room_type, Room.created_by, Room.created_at)
+                .filter(Room.is_active == True)
+                .order_by(Room.name.asc())
+                .all()
+            )
+        directory = _Directory([
+            {
+                "id": r.id,
+                "name": r.name,
+                "room_no": r.room_no or "",
+                "room_type": r.room_type or "public",
+                "created_by": r.created_by,
+                "created_at": r.created_at.isoformat() if r.created_at else None,
+                "invitation_link": Room.invitation_link_for(r.room_no),
+            }
+            for r in rows
+        ], now + self.ttl)
+        with self._lock:
+            # Don't cache a list read before an invalidation that raced with the query
+            if generation == self._generation:
+                if self._directory is not None and self._directory.all != directory.all:
+                    self._rooms_version += 1
+                self._directory = directory
+        return directory
+
+    def _memberships(self, user_id: int, count_hit: bool = True) -> frozenset:
+        now = time.monotonic()
+        with self._lock:
+            generation = self._generation
+            entry = self._members.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._members.move_to_end(user_id)
+                if count_hit:
+                    self.hits += 1
+                return entry[1]
+            self.misses += 1
+        with primary_reads():
+            room_ids = frozenset(
+                room_id for (room_id,) in db.session.query(RoomMembership.room_id).filter_by(user_id=user_id)
+            )
+        with self._lock:
+            if generation == self._generation:
+                previous = self._members.get(user_id)
+                if previous is not None and previous[1] != room_ids:
+                    self._bump_member(user_id)
+                self._members[user_id] = (now + self.ttl, room_ids)
+                self._members.move_to_end(user_id)
+                while len(self._members) > self.max_users:
+                    # Nothing left to compare its next load with: assume it changed
+                    self._bump_member(self._members.popitem(last=False)[0])
+        return room_ids
+
+    def _bump_member(self, user_id: int) -> None:
+        # Caller holds self._lock
+        self._member_versions[user_id] = self._member_versions.get(user_id, 0) + 1
+
+    def _invalidate_local(self, user_id) -> None:
+        with self._lock:
+            self._generation += 1
+            if user_id is None:
+                self._directory = None
+                self._rooms_version += 1
+            else:
+                self._members.pop(user_id, None)
+                self._bump_member(user_id)
+
+    def _publish(self, user_id) -> None:
+        if self.broker is None:
+            return
+        try:
+            self.broker.publish(self.channel, {"user_id": user_id, "pid": os.getpid()})
+        except Exception as e:
+            logger.error(f"Room directory invalidation publish failed: {e}")
+
+    def _listen(self) -> None:
+        for message in self.broker.listen(self.channel):
+            try:
+                self._invalidate_local(message["user_id"])
+            except (KeyError, TypeError):
+                continue
+
+
+room_directory = RoomDirectory()
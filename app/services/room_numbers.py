@@ -0,0 +1,104 @@
+"""``room_no`` allocation that is unique by construction.
+
+A room_no is 24 base62 characters (URL-safe, and in ASCII order, so they
+sort by creation time) encoding 140 bits:
+
+    42 bits  milliseconds since 2024-01-01, never decreasing within a process
+    16 bits  node id (ROOM_NO_NODE_ID, or a hash of the host name)
+    22 bits  process id
+    12 bits  sequence within the millisecond
+    48 bits  random, so room_nos of one node and moment can't be guessed
+
+Two allocations differ in the first 92 bits unless they come from the same
+node, process and millisecond, where the sequence tells them apart (after
+4096 in one millisecond the clock is borrowed from ahead). So there is no
+database lookup per allocation; the unique index on ``rooms.room_no`` stays as
+the backstop. Node ids must differ between hosts for the guarantee to hold
+across hosts: set ``ROOM_NO_NODE_ID`` when running on more than one.
+"""
+
+import hashlib
+import logging
+import os
+import secrets
+import socket
+import threading
+import time
+
+
+EPOCH_MS = 1704067200000  # 2024-01-01T00:00:00Z
+TIME_BITS, NODE_BITS, PID_BITS, SEQUENCE_BITS, RANDOM_BITS = 42, 16, 22, 12, 48
+LENGTH = 24  # base62 digits for 140 bits
+_ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+
+logger = logging.getLogger(__name__)
+
+
+def _encode(value: int) -> str:
+    digits = []
+    for _ in range(LENGTH):
+        value, digit = divmod(value, 62)
+        digits.append(_ALPHABET[digit])
+    return "".join(reversed(digits))
+
+
+class RoomNumberAllocator:
+    def __init__(self):
+        self.node_id = _host_node_id()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._last_ms = 0
+        self._sequence = 0
+
+    def init_app(self, app) -> None:
+        node_id = app.config.get("ROOM_NO_NODE_ID")
+        self.node_id = _host_node_id()
+        if node_id in (None, ""):
+            return
+        try:
+            value = int(node_id)
+        except ValueError:
+            value = -1
+        if 0 <= value < 1 << NODE_BITS:
+            self.node_id = value
+        else:
+            # Not wrapped: 65536 would silently become another host's node 0
+            logger.warning(
+                f"Invalid ROOM_NO_NODE_ID {node_id!r} (must be 0-{(1 << NODE_BITS) - 1}), "
+                f"using the host name hash {self.node_id}"
+            )
+
+    def allocate(self, count: int = 1) -> list:
+        """``count`` new room_nos, in increasing order."""
+        with self._lock:
+            pid = os.getpid()
+            if pid != self._pid:
+                # Forked: the child is a different process id, so it may start over
+                self._pid, self._last_ms, self._sequence = pid, 0, 0
+            prefix = (self.node_id << PID_BITS | pid % (1 << PID_BITS)) << SEQUENCE_BITS
+            result = []
+            for _ in range(count):
+                now = max(int(time.time() * 1000) - EPOCH_MS, self._last_ms)
+                if now == self._last_ms:
+                    self._sequence += 1
+                    if self._sequence >> SEQUENCE_BITS:
+                        # Sequence exhausted: move on to the next millisecond early
+                        now += 1
+                        self._sequence = 0
+                else:
+                    self._sequence = 0
+                self._last_ms = now
+                ordered = now << (NODE_BITS + PID_BITS + SEQUENCE_BITS) | prefix | self._sequence
+                result.append(ordered << RANDOM_BITS | secrets.randbits(RANDOM_BITS))
+        return [_encode(value) for value in result]
+
+    def next(self) -> str:
+        return self.allocate(1)[0]
+
+
+def _host_node_id() -> int:
+    digest = hashlib.blake2b(socket.gethostname().encode("utf-8"), digest_size=2).digest()
+    return int.from_bytes(digest, "big")
+
+
+room_numbers = RoomNumberAllocator()
@@ -0,0 +1,158 @@
+"""Full-text message search over an inverted index in ``message_terms``.
+
+Every message is tokenized when it is written (in the same transaction as the
+message, see :mod:`.message_writer`). Text is NFKC-normalized and case-folded;
+runs of CJK characters are indexed as overlapping bigrams (``你好嗎`` ->
+``你好``, ``好嗎``) since they have no spaces between words, plus each single
+character so one-character queries match too; everything else as whole words.
+A query matches messages containing all of its terms; hits are ranked by how
+often the terms occur, newest first on ties.
+
+``flask search-reindex`` rebuilds the index from the ``messages`` table.
+"""
+
+import base64
+import binascii
+import re
+import unicodedata
+from collections import Counter
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import func
+
+from ..extensions import db
+from ..models.message import Message
+from ..models.message_term import MessageTerm
+
+
+# Hiragana/katakana, CJK ideographs (incl. extension A and compatibility) and hangul
+_CJK = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af"
+_TOKEN_RE = re.compile(f"[{_CJK}]+|[^\\W{_CJK}_]+")
+_CJK_RE = re.compile(f"[{_CJK}]")
+MIN_WORD_LENGTH = 2
+MAX_TERM_LENGTH = 32
+MAX_QUERY_TERMS = 16
+MAX_WEIGHT = 32767
+REINDEX_CHUNK_SIZE = 5000
+
+
+def tokenize(text: str, query: bool = False) -> Counter:
+    """Index terms of ``text`` with their number of occurrences.
+
+    For a query, CJK runs longer than one character give only their bigrams,
+    which already imply the single characters.
+    """
+    terms = Counter()
+    text = unicodedata.normalize("NFKC", text or "").casefold()
+    for match in _TOKEN_RE.finditer(text):
+        run = match.group()
+        if _CJK_RE.match(run):
+            for i in range(len(run) - 1):
+                terms[run[i:i + 2]] += 1
+            if not query or len(run) == 1:
+                for char in run:
+                    terms[char] += 1
+        elif len(run) >= MIN_WORD_LENGTH:
+            terms[run[:MAX_TERM_LENGTH]] += 1
+    return terms
+
+
+class SearchIndex:
+    def __init__(self):
+        self.enabled = True
+
+    def init_app(self, app) -> None:
+        self.enabled = app.config.get("SEARCH_INDEX_ENABLED", True)
+        app.cli.add_command(reindex_command)
+
+    def term_rows(self, rows) -> list:
+        """``message_terms`` rows for message rows (dicts or row objects with id/room_id/content)."""
+        if not self.enabled:
+            return []
+        result = []
+        for row in rows:
+            get = row.get if isinstance(row, dict) else lambda key: getattr(row, key)
+            for term, count in tokenize(get("content")).items():
+                result.append({
+                    "term": term,
+                    "room_id": get("room_id"),
+                    "message_id": get("id"),
+                    "weight": min(count, MAX_WEIGHT),
+                })
+        return result
+
+    def query_terms(self, query: str) -> list:
+        return sorted(tokenize(query, query=True))[:MAX_QUERY_TERMS]
+
+    def search(self, terms: list, room_id: int = None, limit: int = 20, cursor=None):
+        """Ranked ``(message_id, score)`` hits and whether there are more.
+
+        ``cursor`` is the ``(score, message_id)`` of the last hit of the previous page.
+        """
+        score = func.sum(MessageTerm.weight)
+        query = db.session.query(MessageTerm.message_id, score.label("score")).filter(MessageTerm.term.in_(terms))
+        if room_id is not None:
+            query = query.filter(MessageTerm.room_id == room_id)
+        # One row per (term, message), so matching every term means len(terms) rows
+        query = query.group_by(MessageTerm.message_id).having(func.count() == len(terms))
+        if cursor is not None:
+            last_score, last_id = cursor
+            query = query.having(db.or_(score < last_score, db.and_(score == last_score, MessageTerm.message_id < last_id)))
+        rows = query.order_by(score.desc(), MessageTerm.message_id.desc()).limit(limit + 1).all()
+        return [(row.message_id, int(row.score)) for row in rows[:limit]], len(rows) > limit
+
+    def drop_room(self, room_id: int) -> None:
+        """Delete a room's postings; the caller commits."""
+        db.session.query(MessageTerm).filter(MessageTerm.room_id == room_id).delete(synchronize_session=False)
+
+    def rebuild(self, room_id: int = None, chunk_size: int = REINDEX_CHUNK_SIZE) -> int:
+        """Re-tokenize stored messages chunk by chunk; returns how many were indexed."""
+        from ..models.room import Room
+
+        if room_id is None:
+            # Postings of rooms that no longer exist
+            db.session.query(MessageTerm).filter(~MessageTerm.room_id.in_(db.select(Room.id))).delete(synchronize_session=False)
+            db.session.commit()
+        indexed, last_id = 0, 0
+        while True:
+            query = db.session.query(Message.id, Message.room_id, Message.content).filter(Message.id > last_id)
+            if room_id is not None:
+                query = query.filter(Message.room_id == room_id)
+            rows = query.order_by(Message.id).limit(chunk_size).all()
+            if not rows:
+                return indexed
+            ids = [row.id for row in rows]
+            # Delete and insert per chunk, so messages indexed concurrently by the writer don't collide
+            db.session.query(MessageTerm).filter(MessageTerm.message_id.in_(ids)).delete(synchronize_session=False)
+            terms = self.term_rows(rows)
+            if terms:
+                db.session.execute(MessageTerm.__table__.insert(), terms)
+            db.session.commit()
+            indexed += len(rows)
+            last_id = ids[-1]
+
+
+def encode_cursor(score: int, message_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{score}|{message_id}".encode("ascii")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("ascii")
+        score, message_id = raw.split("|", 1)
+        return int(score), int(message_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+@click.command("search-reindex")
+@click.option("--room", "room_id", type=int, default=None, help="Only rebuild this room.")
+@with_appcontext
+def reindex_command(room_id):
+    """Rebuild the message search index from the messages table."""
+    indexed = search_index.rebuild(room_id)
+    click.echo(f"Indexed {indexed} messages")
+
+
+search_index = SearchIndex()
@@ -0,0 +1,81 @@
+"""JSON encoding shared by Socket.IO packets, the broker and HTTP responses.
+
+Uses ``orjson`` when it is installed and the standard library otherwise. A
+message payload is wrapped in :class:`Encoded` once: the room broadcast, the
+broker and the history ring buffer all reuse the same bytes instead of
+encoding the dict again.
+"""
+
+import json
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class Encoded:
+    """A JSON value encoded once; ``value`` keeps the original object."""
+
+    __slots__ = ("value", "data")
+
+    def __init__(self, value, data: bytes = None):
+        self.value = value
+        self.data = data if data is not None else dumps(value)
+
+
+def _dumps_plain(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def dumps(obj) -> bytes:
+    """Compact UTF-8 JSON; :class:`Encoded` values are spliced in as-is."""
+    if isinstance(obj, Encoded):
+        return obj.data
+    try:
+        return _dumps_plain(obj)
+    except TypeError:
+        # Only containers holding Encoded values get here
+        if isinstance(obj, (list, tuple)):
+            return b"[" + b",".join(dumps(item) for item in obj) + b"]"
+        if isinstance(obj, dict):
+            return b"{" + b",".join(_dumps_plain(str(k)) + b":" + dumps(v) for k, v in obj.items()) + b"}"
+        raise
+
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps_array(fragments) -> bytes:
+    """JSON array from already-encoded elements."""
+    return b"[" + b",".join(fragments) + b"]"
+
+
+class SocketJSON:
+    """``json`` module replacement for python-socketio packets."""
+
+    @staticmethod
+    def dumps(obj, **kwargs) -> str:
+        return dumps(obj).decode("utf-8")
+
+    @staticmethod
+    def loads(data, **kwargs):
+        return loads(data)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that uses orjson for compact responses when available."""
+
+    def dumps(self, obj, **kwargs) -> str:
+        if orjson is None or kwargs.get("indent") is not None:
+            return super().dumps(obj, **kwargs)
+        # Leave datetimes to Flask's default so responses don't change format
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        return orjson.dumps(obj, default=self.default, option=option).decode("utf-8")
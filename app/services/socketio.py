@@ -1,14 +1,21 @@
 from flask import request
 from flask_login import current_user
-from flask_socketio import Namespace, emit, join_room as sio_join_room, leave_room as sio_leave_room, disconnect
+from flask_socketio import Namespace, emit, join_room as sio_join_room, leave_room as sio_leave_room, disconnect, rooms as sio_rooms
 
-from ..extensions import socketio, db
-from ..models.message import Message
+from ..extensions import socketio
+from .avatar_pipeline import avatar_pipeline
+from .history_sync import missed_messages, parse_positions
+from .message_cache import message_cache
+from .message_writer import message_writer
+from .outbox import room_outbox
+from .presence import presence
+from .replicas import replica_router
+from .serialization import Encoded
+from .typing import typing_aggregator
+from .user_cache import user_cache
 
 
 ROOM_KEY_PREFIX = "room:"
-# Track online users: {user_id: {name, email, ...}}
-online_users = {}
 
 
 def _room_key(room_id: int) -> str:
@@ -26,69 +33,85 @@ class ChatNamespace(Namespace):
             import logging
             logging.getLogger(__name__).error(f"Socket.IO connect error: {e}", exc_info=True)
             return False
-        # Add to online users
-        online_users[current_user.id] = {
+        # Register this connection; room-scoped presence is announced on join_room
+        presence.connect(request.sid, current_user.id, {
             "id": current_user.id,
             "name": current_user.name,
             "email": current_user.email,
             "role": current_user.role,
-        }
-        # Send current online users list to the newly connected user (includes self)
-        emit("online_users", {"users": list(online_users.values())})
-        # Broadcast user online status to other users (exclude self)
-        emit("user_online", {"user_id": current_user.id, "name": current_user.name}, broadcast=True, include_self=False)
+        })
         # Send ready event to confirm connection
         emit("ready", {"user_id": current_user.id, "role": current_user.role})
         return True
 
-    def on_disconnect(self):
-        # Remove from online users
-        if current_user.is_authenticated:
-            user_id = current_user.id
-            if user_id in online_users:
-                del online_users[user_id]
-            # Broadcast user offline status
-            emit("user_offline", {"user_id": user_id}, broadcast=True)
+    def on_disconnect(self, reason=None):
+        # Drops the connection from every room it joined; members of those rooms
+        # get a coalesced presence_delta once the user's last tab is gone
+        presence.disconnect(request.sid)
         return
 
     def on_join_room(self, data):
         room_id = int(data.get("room_id"))
         sio_join_room(_room_key(room_id))
-        emit("user_joined", {"room_id": room_id, "user_id": current_user.id}, room=_room_key(room_id))
+        presence.join(request.sid, room_id)
+        emit("presence_snapshot", presence.room_snapshot(room_id))
+        room_outbox.emit(room_id, "user_joined", {"room_id": room_id, "user_id": current_user.id})
 
     def on_leave_room(self, data):
         room_id = int(data.get("room_id"))
         sio_leave_room(_room_key(room_id))
-        emit("user_left", {"room_id": room_id, "user_id": current_user.id}, room=_room_key(room_id))
+        presence.leave(request.sid, room_id)
+        typing_aggregator.clear_user(room_id, current_user.id)
+        room_outbox.emit(room_id, "user_left", {"room_id": room_id, "user_id": current_user.id})
+
+    def on_presence_sync(self, data):
+        # Clients that detect a gap in presence_delta versions ask for a fresh snapshot
+        room_id = int(data.get("room_id"))
+        if _room_key(room_id) not in sio_rooms():
+            return
+        emit("presence_snapshot", presence.room_snapshot(room_id))
 
     def on_send_message(self, data):
+        # Read before the author profile, so the cached encoding is never newer than its tag
+        generation = user_cache.generation
         room_id = int(data.get("room_id"))
         content = (data.get("content") or "").strip()
         if not content:
             return
-        msg = Message(room_id=room_id, user_id=current_user.id, content=content)
-        db.session.add(msg)
-        db.session.commit()
+        # Commits inline in sync mode; in write_behind mode the row is queued and
+        # flushed in batches, so the broadcast doesn't wait on the database
+        row = message_writer.submit(room_id, current_user.id, content)
+        # The sender's history reads stay on the primary until replicas have the row
+        # (write_behind commits later, outside this request)
+        replica_router.note_write(current_user.id)
         payload = {
-            "id": msg.id,
+            "id": row["id"],
             "room_id": room_id,
             "user_id": current_user.id,
             "author_name": getattr(current_user, "name", None),
-            "author_image": getattr(current_user, "image", None),
-            "content": msg.content,
-            "created_at": msg.created_at.isoformat(),
+            "author_image": avatar_pipeline.variant(getattr(current_user, "image", None)),
+            "content": row["content"],
+            "created_at": row["created_at"].isoformat(),
         }
-        emit("new_message", payload, room=_room_key(room_id))
+        # Encoded once: the room broadcast, the broker and history pages reuse the bytes
+        encoded = Encoded(payload)
+        message_cache.add(encoded, generation)
+        room_outbox.emit(room_id, "new_message", encoded)
+        typing_aggregator.clear_user(room_id, current_user.id)
+
+    def on_sync(self, data):
+        # Reconnect catch-up for every room the client had open; see services/history_sync.py
+        try:
+            positions = parse_positions((data or {}).get("rooms"))
+        except ValueError:
+            return
+        emit("sync_result", {"rooms": missed_messages(positions)})
 
     def on_typing(self, data):
+        # Aggregated per room and sent as a periodic typing_summary (see services/typing.py)
         room_id = int(data.get("room_id"))
         is_typing = bool(data.get("is_typing"))
-        emit(
-            "user_typing",
-            {"room_id": room_id, "user_id": current_user.id, "is_typing": is_typing},
-            room=_room_key(room_id),
-            include_self=False,
-        )
+        typing_aggregator.update(room_id, current_user.id, getattr(current_user, "name", None), is_typing)
 
     def on_admin_broadcast(self, data):
         if current_user.role != "admin":
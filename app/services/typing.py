@@ -0,0 +1,152 @@
+"""Per-room typing indicator aggregation.
+
+``typing`` events only update in-memory state: repeated ``is_typing=True``
+from the same user just extends its expiry, and entries nobody refreshes
+expire after ``TYPING_TTL_SECONDS``. Every ``TYPING_INTERVAL_MS`` each room whose
+set of typists changed gets one ``typing_summary`` with everyone currently
+typing, instead of one ``user_typing`` packet per keystroke per typist.
+
+With a broker, typing state is replicated so each process sees every typist;
+only the process that observed a change emits the room's summary. Starts and
+stops are published at once; a user who keeps typing is re-published at most
+every ``TYPING_TTL_SECONDS / 2``, so peers don't expire them early.
+"""
+
+import logging
+import os
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class TypingAggregator:
+    def __init__(self):
+        self.broker = None
+        self.channel = "chat-typing"
+        self.interval = 0.5
+        self.ttl = 5.0
+        self._node_id = None
+        # room_id -> {user_id: {"name": str, "expires": monotonic, "local": bool, "published": monotonic}}
+        self._rooms = {}
+        self._dirty = set()
+        self._last_sent = {}  # room_id -> tuple of user ids in the last summary
+        self._lock = threading.Lock()
+        self._started_pid = None
+
+    def init_app(self, app, broker=None) -> None:
+        self.broker = broker
+        self.channel = app.config.get("TYPING_CHANNEL", self.channel)
+        self.interval = max(0.05, app.config.get("TYPING_INTERVAL_MS", 500) / 1000.0)
+        self.ttl = max(self.interval, float(app.config.get("TYPING_TTL_SECONDS", 5)))
+
+    def _ensure_started(self) -> None:
+        # Started lazily in the serving process: threads don't survive uWSGI's fork
+        if self._started_pid == os.getpid():
+            return
+        with self._lock:
+            if self._started_pid == os.getpid():
+                return
+            self._started_pid = os.getpid()
+            self._node_id = f"{os.getpid()}-{id(self)}-{time.time_ns()}"
+            self._rooms.clear()
+            self._dirty.clear()
+            self._last_sent.clear()
+        from ..extensions import socketio
+
+        socketio.start_background_task(self._tick)
+        if self.broker is not None:
+            socketio.start_background_task(self._listen)
+
+    def update(self, room_id: int, user_id: int, name, is_typing: bool) -> None:
+        self._ensure_started()
+        changed, refresh_due = self._apply(room_id, user_id, name, is_typing, local=True)
+        if (changed or refresh_due) and self.broker is not None:
+            try:
+                self.broker.publish(self.channel, {
+                    "node": self._node_id,
+                    "room_id": room_id,
+                    "user_id": user_id,
+                    "name": name,
+                    "is_typing": is_typing,
+                })
+            except Exception as e:
+                logger.error(f"Typing publish failed: {e}")
+
+    def clear_user(self, room_id: int, user_id: int) -> None:
+        """Stop showing a user as typing (they left the room or sent their message)."""
+        self.update(room_id, user_id, None, False)
+
+    def _apply(self, room_id: int, user_id: int, name, is_typing: bool, local: bool) -> tuple:
+        """Record the event. Returns (typists changed, a refresh is due for peers)."""
+        with self._lock:
+            room = self._rooms.setdefault(room_id, {})
+            entry = room.get(user_id)
+            refresh_due = False
+            if is_typing:
+                now = time.monotonic()
+                changed = entry is None
+                published = now if changed else entry.get("published", 0.0)
+                if not changed and now - published >= self.ttl / 2:
+                    refresh_due, published = True, now
+                room[user_id] = {"name": name, "expires": now + self.ttl, "local": local, "published": published}
+            else:
+                changed = room.pop(user_id, None) is not None
+                if not room:
+                    self._rooms.pop(room_id, None)
+            if changed and local:
+                self._dirty.add(room_id)
+            return changed, refresh_due
+
+    def _collect(self) -> list:
+        now = time.monotonic()
+        summaries = []
+        with self._lock:
+            for room_id, room in list(self._rooms.items()):
+                for user_id, entry in list(room.items()):
+                    if entry["expires"] <= now:
+                        del room[user_id]
+                        if entry["local"]:
+                            self._dirty.add(room_id)
+                if not room:
+                    del self._rooms[room_id]
+            dirty, self._dirty = self._dirty, set()
+            for room_id in dirty:
+                room = self._rooms.get(room_id, {})
+                user_ids = tuple(sorted(room))
+                if self._last_sent.get(room_id, ()) == user_ids:
+                    continue
+                if user_ids:
+                    self._last_sent[room_id] = user_ids
+                else:
+                    self._last_sent.pop(room_id, None)
+                summaries.append({
+                    "room_id": room_id,
+                    "users": [{"id": uid, "name": room[uid]["name"]} for uid in user_ids],
+                })
+        return summaries
+
+    def _tick(self) -> None:
+        from ..extensions import socketio
+        from .outbox import room_outbox
+
+        while True:
+            socketio.sleep(self.interval)
+            try:
+                for summary in self._collect():
+                    room_outbox.emit(summary["room_id"], "typing_summary", summary)
+            except Exception as e:
+                logger.error(f"Typing summary flush failed: {e}", exc_info=True)
+
+    def _listen(self) -> None:
+        for message in self.broker.listen(self.channel):
+            if message.get("node") == self._node_id:
+                continue
+            try:
+                self._apply(message["room_id"], message["user_id"], message.get("name"), bool(message.get("is_typing")), local=False)
+            except (KeyError, TypeError):
+                continue
+
+
+typing_aggregator = TypingAggregator()
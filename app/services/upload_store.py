@@ -0,0 +1,93 @@
+"""Serving files from ``UPLOAD_FOLDER`` without touching the disk per hit.
+
+Uploaded files are write-once: avatars are named after a hash of their
+content (see :mod:`.avatar_pipeline`), older ones after a UUID, and a name is
+never reused for other bytes. So the result of resolving and ``stat``-ing a
+name can be kept for as long as the process lives (up to
+``UPLOAD_STAT_CACHE_MAX`` names, least recently used first out), and responses
+may be cached by browsers for good (``Cache-Control: immutable``).
+
+Names that don't exist are remembered for ``MISSING_TTL_SECONDS`` only, since
+the pipeline may be about to write them. With ``UPLOAD_ACCEL_REDIRECT`` set,
+the body is left to the fronting nginx (``X-Accel-Redirect``); otherwise it is
+sent through ``wsgi.file_wrapper`` (sendfile under uWSGI).
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+MISSING_TTL_SECONDS = 2.0
+
+
+class UploadFile:
+    __slots__ = ("name", "path", "size", "mtime", "etag")
+
+    def __init__(self, name: str, path: str, st: os.stat_result):
+        self.name = name
+        self.path = path
+        self.size = st.st_size
+        self.mtime = st.st_mtime
+        self.etag = f"{st.st_size:x}-{st.st_mtime_ns:x}"
+
+
+class UploadStore:
+    def __init__(self):
+        self.folder = None
+        self.max_entries = 10000
+        self.accel_prefix = ""
+        self.max_age = 365 * 24 * 3600
+        self._entries = OrderedDict()  # name -> UploadFile, or monotonic expiry of a miss
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app) -> None:
+        self.folder = os.path.abspath(app.config["UPLOAD_FOLDER"])
+        self.max_entries = max(1, app.config.get("UPLOAD_STAT_CACHE_MAX", self.max_entries))
+        self.accel_prefix = app.config.get("UPLOAD_ACCEL_REDIRECT", "")
+        if self.accel_prefix and not self.accel_prefix.endswith("/"):
+            self.accel_prefix += "/"
+        self.max_age = max(0, app.config.get("UPLOAD_MAX_AGE_SECONDS", self.max_age))
+
+    def lookup(self, name: str):
+        """The file stored under ``name``, or None."""
+        with self._lock:
+            entry = self._entries.get(name)
+            if isinstance(entry, UploadFile):
+                self._entries.move_to_end(name)
+                self.hits += 1
+                return entry
+            if entry is not None and entry > time.monotonic():
+                self.hits += 1
+                return None
+            self.misses += 1
+        path = os.path.join(self.folder, name)
+        # Only plain names directly inside the folder (no traversal, no subdirectories)
+        if os.path.dirname(os.path.abspath(path)) != self.folder:
+            return None
+        try:
+            st = os.stat(path)
+            entry = UploadFile(name, path, st) if os.path.isfile(path) else None
+        except OSError:
+            entry = None
+        with self._lock:
+            self._entries[name] = entry if entry is not None else time.monotonic() + MISSING_TTL_SECONDS
+            self._entries.move_to_end(name)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def forget(self, name: str) -> None:
+        """Drop a cached lookup after the file was written or deleted."""
+        with self._lock:
+            self._entries.pop(name, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+upload_store = UploadStore()
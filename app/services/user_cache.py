@@ -0,0 +1,147 @@
+"""Process-level cache of user profile columns.
+
+Serves the Flask-Login user loader (called on every HTTP request and socket
+event) and the ``author_name`` / ``author_image`` of message payloads without
+touching the database. Entries live for ``USER_CACHE_TTL_SECONDS`` and are
+invalidated explicitly when a profile changes; with a broker the invalidation
+reaches every process.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy.orm import make_transient_to_detached
+
+from ..extensions import db
+from ..models.user import User
+from .replicas import primary_reads
+
+
+logger = logging.getLogger(__name__)
+
+PROFILE_FIELDS = ("id", "name", "email", "image", "role", "created_at")
+
+
+class UserProfileCache:
+    def __init__(self):
+        self.ttl = 300.0
+        self.max_entries = 50000
+        self.broker = None
+        self.channel = "chat-user-cache"
+        self._entries = OrderedDict()  # user_id -> (expires, profile), oldest first
+        self._lock = threading.Lock()
+        self._generation = 0  # bumped by every invalidation
+        self._versions = {}  # user_id -> bumped when that profile is invalidated
+        self._started_pid = None
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app, broker=None) -> None:
+        self.ttl = float(app.config.get("USER_CACHE_TTL_SECONDS", self.ttl))
+        self.max_entries = max(1, app.config.get("USER_CACHE_MAX_ENTRIES", self.max_entries))
+        self.broker = broker
+        self.channel = app.config.get("USER_CACHE_CHANNEL", self.channel)
+
+    def _ensure_started(self) -> None:
+        # Started lazily in the serving process: threads don't survive uWSGI's fork
+        if self.broker is None or self._started_pid == os.getpid():
+            return
+        with self._lock:
+            if self._started_pid == os.getpid():
+                return
+            self._started_pid = os.getpid()
+            self._entries.clear()
+            self._versions.clear()
+        from ..extensions import socketio
+
+        socketio.start_background_task(self._listen)
+
+    @property
+    def generation(self) -> int:
+        """Changes whenever any profile is invalidated; lets callers cache derived data."""
+        return self._generation
+
+    def version(self, user_id: int) -> int:
+        """Changes whenever this user's profile is invalidated (for ETags)."""
+        self._ensure_started()
+        return self._versions.get(user_id, 0)
+
+    def get(self, user_id: int):
+        """Profile dict for one user, or None if the user doesn't exist."""
+        return self.get_many([user_id]).get(user_id)
+
+    def get_many(self, user_ids) -> dict:
+        """Profiles by user id; all misses are loaded in a single query."""
+        self._ensure_started()
+        now = time.monotonic()
+        found, missing = {}, []
+        with self._lock:
+            generation = self._generation
+            for user_id in set(user_ids):
+                entry = self._entries.get(user_id)
+                if entry is not None and entry[0] > now:
+                    found[user_id] = entry[1]
+                    self.hits += 1
+                else:
+                    missing.append(user_id)
+                    self.misses += 1
+        if missing:
+            with primary_reads():
+                rows = db.session.query(*(getattr(User, f) for f in PROFILE_FIELDS)).filter(User.id.in_(missing)).all()
+            expires = now + self.ttl
+            with self._lock:
+                # Don't cache rows read before an invalidation that raced with the query
+                store = generation == self._generation
+                for row in rows:
+                    profile = dict(zip(PROFILE_FIELDS, row))
+                    found[profile["id"]] = profile
+                    if store:
+                        self._entries[profile["id"]] = (expires, profile)
+                        self._entries.move_to_end(profile["id"])
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return found
+
+    def load_user(self, user_id: int):
+        """Flask-Login user loader: a session-attached User built from the cache.
+
+        Attached without a SELECT, so handlers can still modify and commit it;
+        columns that aren't cached (password_hash) load on first access.
+        """
+        profile = self.get(user_id)
+        if profile is None:
+            return None
+        user = User(**profile)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+    def invalidate(self, user_id: int) -> None:
+        self._invalidate_local(user_id)
+        if self.broker is not None:
+            try:
+                self.broker.publish(self.channel, {"user_id": user_id, "pid": os.getpid()})
+            except Exception as e:
+                logger.error(f"User cache invalidation publish failed: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+    def _invalidate_local(self, user_id: int) -> None:
+        with self._lock:
+            self._generation += 1
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+            self._entries.pop(user_id, None)
+
+    def _listen(self) -> None:
+        for message in self.broker.listen(self.channel):
+            try:
+                self._invalidate_local(message["user_id"])
+            except (KeyError, TypeError):
+                continue
+
+
+user_cache = UserProfileCache()
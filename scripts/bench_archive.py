@@ -0,0 +1,86 @@
+"""Measure message archiving: compression, archive run time and paging into segments.
+
+Run: python -m scripts.bench_archive [messages]
+
+Fills one room of a throwaway SQLite database with ``messages`` spread over two
+years, archives everything older than 30 days and prints the size of the
+segments against the archived text, then times history pages read from the
+table and from deep inside the archive (cold and with the block cache warm).
+"""
+
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+
+WORDS = "hello world chat room message reply ok thanks see you tomorrow 你好 謝謝 明天 見".split()
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    workdir = tempfile.mkdtemp()
+    os.environ.update(
+        DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        ARCHIVE_FOLDER=os.path.join(workdir, "archive"),
+        AUTO_INIT_DB="true",
+        STARTUP_REPORT="false",
+    )
+    from app import create_app
+    from app.extensions import db
+    from app.models.message import Message
+    from app.services.message_archive import message_archive
+
+    app = create_app()
+    random.seed(7)
+    with app.app_context():
+        now = datetime.utcnow()
+        step = timedelta(days=730) / total
+        rows = [
+            {
+                "room_id": 1,
+                "user_id": 1,
+                "content": " ".join(random.choices(WORDS, k=random.randint(2, 20))),
+                "created_at": now - timedelta(days=730) + step * i,
+            }
+            for i in range(total)
+        ]
+        db.session.execute(db.insert(Message), rows)
+        db.session.commit()
+        text_bytes = sum(len(r["content"].encode("utf-8")) for r in rows)
+
+        started = time.perf_counter()
+        archived = sum(message_archive.archive(now - timedelta(days=30)).values())
+        elapsed = time.perf_counter() - started
+        segment_bytes = sum(os.path.getsize(s.path) for s in message_archive.segments(1))
+        print(f"archived {archived:,} of {total:,} messages in {elapsed:.1f}s ({archived / elapsed:,.0f}/s)")
+        print(f"  {len(message_archive.segments(1))} segments, {segment_bytes / 1024:,.0f} KiB for {text_bytes / 1024:,.0f} KiB of text")
+        print(f"  messages table: {db.session.query(Message).count():,} rows left")
+
+        oldest_hot = db.session.query(Message).order_by(Message.created_at.asc()).first()
+        middle = now - timedelta(days=365)
+
+        def timed(fn, runs=50):
+            samples = []
+            for _ in range(runs):
+                started = time.perf_counter()
+                fn()
+                samples.append((time.perf_counter() - started) * 1000)
+            return statistics.median(samples)
+
+        hot = timed(lambda: (
+            db.session.query(Message.id, Message.room_id, Message.user_id, Message.content, Message.created_at)
+            .filter(Message.room_id == 1, Message.created_at < oldest_hot.created_at + timedelta(days=10))
+            .order_by(Message.created_at.desc(), Message.id.desc()).limit(51).all()
+        ))
+        message_archive._blocks.clear()
+        cold = timed(lambda: (message_archive._blocks.clear(), message_archive.older_than(1, (middle, 0), 51)))
+        warm = timed(lambda: message_archive.older_than(1, (middle, 0), 51))
+        print(f"50-message page, median ms: table {hot:.2f}, archive cold {cold:.2f}, archive warm {warm:.2f}")
+
+
+if __name__ == "__main__":
+    main()
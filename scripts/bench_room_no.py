@@ -0,0 +1,85 @@
+"""Measure room_no allocation throughput and check uniqueness under concurrency.
+
+Run: python -m scripts.bench_room_no [allocations]
+
+Allocates room_nos one at a time from 1, 4 and 16 threads, in bulk, and from
+4 processes at once, verifying that no value repeats. For comparison it also
+times the previous generator (random prefix + UUID7 suffix, followed by one
+``SELECT`` per attempt) against an in-memory SQLite rooms table.
+"""
+
+import multiprocessing
+import random
+import string
+import sys
+import threading
+import time
+import uuid
+
+from sqlalchemy import create_engine, text
+
+from app.services.room_numbers import room_numbers
+
+
+def _threads(total: int, threads: int) -> tuple:
+    results = [[] for _ in range(threads)]
+
+    def work(out):
+        for _ in range(total // threads):
+            out.append(room_numbers.next())
+
+    workers = [threading.Thread(target=work, args=(out,)) for out in results]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+    values = [value for out in results for value in out]
+    return len(values) / elapsed, len(set(values)) == len(values)
+
+
+def _process_batch(count: int) -> list:
+    return [room_numbers.next() for _ in range(count)]
+
+
+def _legacy(total: int) -> float:
+    engine = create_engine("sqlite://")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE rooms (id INTEGER PRIMARY KEY, room_no VARCHAR(50) UNIQUE)"))
+    chars = string.ascii_letters + string.digits
+    started = time.perf_counter()
+    with engine.connect() as conn:
+        for _ in range(total):
+            prefix = "".join(random.sample(chars, random.randint(6, 8)))
+            room_no = prefix + uuid.uuid4().hex[-6:]
+            conn.execute(text("SELECT id FROM rooms WHERE room_no = :n LIMIT 1"), {"n": room_no}).first()
+    return total / (time.perf_counter() - started)
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    print(f"{total} allocations each")
+    for threads in (1, 4, 16):
+        rate, unique = _threads(total, threads)
+        print(f"  {threads:>2} threads       {rate:>12,.0f}/s  unique={unique}")
+
+    started = time.perf_counter()
+    values = room_numbers.allocate(total)
+    rate = total / (time.perf_counter() - started)
+    print(f"  bulk allocate    {rate:>12,.0f}/s  unique={len(set(values)) == total}  sorted={values == sorted(values)}")
+
+    with multiprocessing.get_context("fork").Pool(4) as pool:
+        started = time.perf_counter()
+        batches = pool.map(_process_batch, [total // 4] * 4)
+        rate = total / (time.perf_counter() - started)
+    values = [value for batch in batches for value in batch]
+    print(f"   4 processes     {rate:>12,.0f}/s  unique={len(set(values)) == len(values)}")
+
+    legacy_total = min(total, 20000)
+    print(f"  previous (1 SELECT/attempt, in-memory SQLite) {_legacy(legacy_total):,.0f}/s")
+    print(f"  example: {room_numbers.next()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""Measure the cost of serializing one 200-message history page.
+
+Run: python -m scripts.bench_serialization [rounds]
+
+Compares Flask's default provider (stdlib json), the orjson fast path (if
+installed), joining per-message bytes cached in the ring buffer, and returning
+a cached page body as-is.
+"""
+
+import json
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+from app.services import serialization
+from app.services.serialization import dumps, dumps_array
+
+
+PAGE_SIZE = 200
+
+
+def make_page() -> list:
+    start = datetime(2025, 1, 1, 12, 0, 0)
+    return [
+        {
+            "id": 100000 + i,
+            "room_id": 7,
+            "user_id": 1 + i % 12,
+            "content": f"message {i}: " + "lorem ipsum dolor sit amet, 中文內容 " * (1 + i % 4),
+            "created_at": (start + timedelta(seconds=i * 7)).isoformat(),
+            "author_name": f"User {1 + i % 12}",
+            "author_image": f"/uploads/avatars/{1 + i % 12}.png" if i % 3 else None,
+        }
+        for i in range(PAGE_SIZE)
+    ]
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    page = make_page()
+    fragments = [dumps(p) for p in page]
+    body = dumps_array(fragments)
+    cases = [
+        ("stdlib json (Flask default)", lambda: json.dumps(page, ensure_ascii=True, sort_keys=True).encode("utf-8")),
+    ]
+    if serialization.orjson is not None:
+        cases.append(("orjson", lambda: serialization.orjson.dumps(page)))
+    cases += [
+        ("join cached message bytes", lambda: dumps_array(fragments)),
+        ("cached page body", lambda: body),
+    ]
+    print(f"{PAGE_SIZE} messages, {len(body)} bytes per page, {rounds} rounds")
+    for name, fn in cases:
+        seconds = min(timeit.repeat(fn, number=rounds, repeat=3)) / rounds
+        print(f"  {name:<30} {seconds * 1e6:9.1f} us/page")
+
+
+if __name__ == "__main__":
+    main()
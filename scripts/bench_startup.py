@@ -0,0 +1,53 @@
+"""Measure worker boot: a fresh interpreter importing the app and running create_app.
+
+Run: python -m scripts.bench_startup [runs]
+
+Each run is a new process, like a uWSGI worker after fork (lazy-apps) or after
+``touch-reload``. Prints the per-phase timings recorded by ``create_app`` and
+the number of database connections and statements it made, which should be
+zero unless ``AUTO_INIT_DB`` is on.
+"""
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+PROBE = """
+import json, time
+started = time.perf_counter()
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool
+counts = {"connections": 0, "statements": 0}
+event.listen(Pool, "connect", lambda *args: counts.__setitem__("connections", counts["connections"] + 1))
+event.listen(Engine, "before_cursor_execute", lambda *args: counts.__setitem__("statements", counts["statements"] + 1))
+from app import create_app
+app = create_app()
+print(json.dumps(dict(app.extensions["startup_timing"], process=round((time.perf_counter() - started) * 1000, 1), **counts)))
+"""
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    env = dict(os.environ, STARTUP_REPORT="false")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    results = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        out = subprocess.run([sys.executable, "-c", PROBE], cwd=root, env=env, capture_output=True, text=True, check=True)
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        result["wall"] = round((time.perf_counter() - started) * 1000, 1)
+        results.append(result)
+    print(f"{runs} runs, median ms (wall = interpreter start to exit)")
+    for key in results[0]:
+        if key not in ("connections", "statements"):
+            print(f"  {key:<12} {statistics.median(r[key] for r in results):>8.1f}")
+    print(f"  db connections {max(r['connections'] for r in results)}, statements {max(r['statements'] for r in results)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""Hold thousands of idle Socket.IO websocket connections and measure server memory.
+
+Run: python -m scripts.load_idle_connections [connections] [--hold SECONDS]
+     python -m scripts.load_idle_connections 10000 --url http://host:5000 --pid <server pid>
+
+Without ``--url`` it starts ``python wsgi.py`` itself in eventlet mode
+(``SOCKETIO_ASYNC_MODE=eventlet``) on a throwaway SQLite database. It logs in
+once, then opens the connections as plain websockets (``/socket.io/?EIO=4``),
+joins the ``/chat`` namespace on each and answers the server's pings while
+holding them; ``--hold`` should exceed ``ping_interval`` (25s) so the ping
+traffic is part of the run. Prints the connections established and still open,
+the server's resident memory before and after, and memory per connection.
+
+Both the server and this client need one file descriptor per connection; the
+soft ``RLIMIT_NOFILE`` is raised to the hard limit for both.
+"""
+
+import argparse
+import base64
+import http.client
+import json
+import os
+import resource
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urlsplit
+
+import eventlet
+
+
+RAMP_CONCURRENCY = 200  # handshakes in flight at once
+
+
+class Counters:
+    def __init__(self):
+        self.connected = 0
+        self.failed = 0
+        self.closed = 0
+        self.pings = 0
+        self.errors = {}
+
+    def error(self, exc) -> None:
+        self.failed += 1
+        key = str(exc) or type(exc).__name__
+        self.errors[key] = self.errors.get(key, 0) + 1
+
+
+def _raise_nofile() -> int:
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+
+def _rss_kb(pid: int) -> int:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _start_server(port: int) -> subprocess.Popen:
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(
+        os.environ,
+        SOCKETIO_ASYNC_MODE="eventlet",
+        DATABASE_URL=f"sqlite:///{tempfile.mktemp(suffix='.db')}",
+        AUTO_INIT_DB="true",
+        STARTUP_REPORT="false",
+        MAIL_OUTBOX_SENDER="false",
+        HOST="127.0.0.1",
+        PORT=str(port),
+    )
+    log = open(os.path.join(tempfile.gettempdir(), "load_idle_connections.log"), "wb")
+    print(f"server log: {log.name}")
+    server = subprocess.Popen([sys.executable, "wsgi.py"], cwd=root, env=env, stdout=log, stderr=log)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return server
+        except OSError:
+            if server.poll() is not None:
+                raise SystemExit("server exited during startup")
+            time.sleep(0.2)
+    server.kill()
+    raise SystemExit("server did not start listening within 60s")
+
+
+def _login(host: str, port: int, email: str, password: str) -> str:
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    conn.request("POST", "/auth/login", json.dumps({"email": email, "password": password}), {"Content-Type": "application/json"})
+    response = conn.getresponse()
+    response.read()
+    if response.status != 200:
+        raise SystemExit(f"login failed: HTTP {response.status}")
+    cookies = [header.split(";", 1)[0] for name, header in response.getheaders() if name.lower() == "set-cookie"]
+    return "; ".join(cookies)
+
+
+def _send_text(sock, text: str) -> None:
+    payload = text.encode("utf-8")
+    mask = os.urandom(4)
+    masked = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+    if len(payload) < 126:
+        header = struct.pack("!BB", 0x81, 0x80 | len(payload))
+    else:
+        header = struct.pack("!BBH", 0x81, 0x80 | 126, len(payload))
+    sock.sendall(header + mask + masked)
+
+
+def _recv_exact(sock, size: int) -> bytes:
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("closed by server")
+        data += chunk
+    return data
+
+
+def _recv_frame(sock) -> tuple:
+    first, second = _recv_exact(sock, 2)
+    length = second & 0x7F
+    if length == 126:
+        (length,) = struct.unpack("!H", _recv_exact(sock, 2))
+    elif length == 127:
+        (length,) = struct.unpack("!Q", _recv_exact(sock, 8))
+    return first & 0x0F, _recv_exact(sock, length)
+
+
+def _open(host: str, port: int, cookie: str):
+    sock = eventlet.connect((host, port))
+    key = base64.b64encode(os.urandom(16)).decode("ascii")
+    sock.sendall((
+        "GET /socket.io/?EIO=4&transport=websocket HTTP/1.1\r\n"
+        f"Host: {host}:{port}\r\n"
+        "Upgrade: websocket\r\nConnection: Upgrade\r\n"
+        f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n"
+        f"Cookie: {cookie}\r\n\r\n"
+    ).encode("ascii"))
+    head = b""
+    while not head.endswith(b"\r\n\r\n"):
+        # Byte by byte so the first frame stays in the socket
+        chunk = sock.recv(1)
+        if not chunk:
+            raise ConnectionError("closed during handshake")
+        head += chunk
+    if not head.startswith(b"HTTP/1.1 101"):
+        raise ConnectionError(head.split(b"\r\n", 1)[0].decode("latin-1"))
+    _, packet = _recv_frame(sock)  # Engine.IO open: 0{"sid": ...}
+    if not packet.startswith(b"0"):
+        raise ConnectionError(f"unexpected open packet {packet[:40]!r}")
+    _send_text(sock, "40/chat,")
+    while True:
+        _, packet = _recv_frame(sock)
+        if packet.startswith(b"40/chat,"):
+            return sock
+        if packet.startswith(b"44/chat,"):
+            raise ConnectionError("namespace connect rejected")
+
+
+def _hold(sock, counters: Counters) -> None:
+    try:
+        while True:
+            opcode, packet = _recv_frame(sock)
+            if opcode == 0x8:
+                break
+            if packet == b"2":
+                _send_text(sock, "3")
+                counters.pings += 1
+    except (OSError, ConnectionError):
+        pass
+    counters.closed += 1
+    sock.close()
+
+
+def _client(host: str, port: int, cookie: str, counters: Counters, holders) -> None:
+    try:
+        sock = _open(host, port, cookie)
+    except Exception as exc:
+        counters.error(exc)
+        return
+    counters.connected += 1
+    holders.spawn(_hold, sock, counters)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("connections", nargs="?", type=int, default=10000)
+    parser.add_argument("--hold", type=float, default=40.0, help="seconds to keep the connections open")
+    parser.add_argument("--url", help="existing server (default: start one in eventlet mode)")
+    parser.add_argument("--pid", type=int, help="pid of the --url server, for memory figures")
+    parser.add_argument("--email", default="admin@example.com")
+    parser.add_argument("--password", default="admin123")
+    args = parser.parse_args()
+
+    limit = _raise_nofile()
+    if limit < args.connections + 100:
+        print(f"warning: RLIMIT_NOFILE hard limit is {limit}; expect failures above that")
+    server = None
+    if args.url:
+        parts = urlsplit(args.url)
+        host, port, pid = parts.hostname, parts.port or 80, args.pid
+    else:
+        host, port = "127.0.0.1", _free_port()
+        server = _start_server(port)
+        pid = server.pid
+    try:
+        cookie = _login(host, port, args.email, args.password)
+        counters = Counters()
+        holders = eventlet.GreenPool(args.connections + 1)
+        # One connection first so the baseline includes the lazily created state
+        _client(host, port, cookie, counters, holders)
+        eventlet.sleep(1)
+        rss_before = _rss_kb(pid) if pid else 0
+
+        started = time.perf_counter()
+        ramp = eventlet.GreenPool(RAMP_CONCURRENCY)
+        for _ in range(args.connections - 1):
+            ramp.spawn_n(_client, host, port, cookie, counters, holders)
+        ramp.waitall()
+        ramp_seconds = time.perf_counter() - started
+        print(f"opened {counters.connected}/{args.connections} in {ramp_seconds:.1f}s ({counters.connected / ramp_seconds:,.0f}/s), failed {counters.failed} {counters.errors or ''}")
+
+        rss_peak = _rss_kb(pid) if pid else 0
+        deadline = time.time() + args.hold
+        while time.time() < deadline:
+            eventlet.sleep(min(5.0, max(0.0, deadline - time.time())))
+            if pid:
+                rss_peak = max(rss_peak, _rss_kb(pid))
+            print(f"  t+{args.hold - max(0.0, deadline - time.time()):>5.0f}s open {counters.connected - counters.closed}, pings answered {counters.pings}")
+        open_now = counters.connected - counters.closed
+        print(f"held {open_now} connections for {args.hold:.0f}s, {counters.pings} pings answered")
+        if pid:
+            per_connection = (rss_peak - rss_before) / max(1, counters.connected - 1)
+            print(f"server RSS {rss_before / 1024:.1f} MiB -> {rss_peak / 1024:.1f} MiB peak, {per_connection:.1f} KiB per connection")
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=10)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""Lagging read replicas for a SQLite development database.
+
+Run: python -m scripts.replica_standin instance/primary.db /tmp/replica1.db /tmp/replica2.db --lag 3
+
+Copies the primary file onto every replica file every ``--lag`` seconds with
+SQLite's online backup API, so each replica trails the primary by up to that
+long, heartbeat row included, like a real asynchronous replica. Point the app
+at them with
+
+    DATABASE_URL=sqlite:////abs/path/instance/primary.db
+    DATABASE_REPLICA_URLS=sqlite:////tmp/replica1.db,sqlite:////tmp/replica2.db
+
+``--lag`` above ``REPLICA_MAX_LAG_SECONDS`` takes the replicas out of rotation
+(reads fall back to the primary); stopping the script and deleting a replica
+file makes its health check fail.
+"""
+
+import argparse
+import sqlite3
+import time
+
+
+def copy(primary: str, replica: str) -> None:
+    source = sqlite3.connect(primary)
+    target = sqlite3.connect(replica)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("primary")
+    parser.add_argument("replicas", nargs="+")
+    parser.add_argument("--lag", type=float, default=1.0, help="seconds between copies")
+    args = parser.parse_args()
+    while True:
+        started = time.perf_counter()
+        for replica in args.replicas:
+            copy(args.primary, replica)
+        print(f"replicated to {len(args.replicas)} replica(s) in {(time.perf_counter() - started) * 1000:.1f} ms", flush=True)
+        time.sleep(args.lag)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,10 +5,10 @@ Run: python scripts/seed_demo.py
 
 from datetime import datetime
 
-from app import create_app
+from app import bootstrap, create_app
 from app.extensions import db
 from app.models.user import User
-from app.models.room import Room
+from app.models.room import Room, generate_room_no
 from app.models.membership import RoomMembership
 from app.models.message import Message
 
@@ -16,9 +16,10 @@ from app.models.message import Message
 def main():
     app = create_app()
     with app.app_context():
-        db.create_all()
+        # Same as "flask init-db" + "flask seed"; both are no-ops when already applied
+        bootstrap.init_db()
+        bootstrap.seed()
 
-        # Admin seeded via app factory, ensure exists now
         admin = User.query.filter_by(email="admin@example.com").first()
 
         demo_users = [
@@ -41,7 +42,7 @@ def main():
         if rooms:
             target_room = rooms[0]
         else:
-            target_room = Room(name="Demo Room", created_by=admin.id if admin else created_users[0].id)
+            target_room = Room(name="Demo Room", room_no=generate_room_no(), created_by=admin.id if admin else created_users[0].id)
             db.session.add(target_room)
             db.session.commit()
             print("Created Demo Room")
@@ -0,0 +1,104 @@
+"""Local SMTP stand-in that accepts mail and prints it instead of delivering it.
+
+Run: python -m scripts.smtp_sink [--port 1025] [--fail-rate 0.3] [--reject-rate 0.1]
+
+Point the app at it with MAIL_SERVER=localhost, MAIL_PORT=1025,
+MAIL_USE_TLS=false and an empty MAIL_USERNAME. ``--fail-rate`` answers that
+share of messages with a temporary error (451, retried by the outbox) and
+``--reject-rate`` with a permanent one (550, the mail goes dead), to exercise
+the outbox's retry and dead-letter handling.
+"""
+
+import argparse
+import random
+import socketserver
+from email import message_from_bytes
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line: str) -> None:
+        self.wfile.write(f"{line}\r\n".encode("ascii"))
+
+    def handle(self) -> None:
+        self.server.connections += 1
+        self.reply("220 smtp-sink ready")
+        sender, recipients = None, []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode("utf-8", "replace").strip()
+            verb = command[:4].upper()
+            if verb == "EHLO":
+                self.reply("250-smtp-sink")
+                self.reply("250 8BITMIME")
+            elif verb == "HELO":
+                self.reply("250 smtp-sink")
+            elif verb == "MAIL":
+                sender, recipients = command[10:].strip(), []
+                self.reply("250 OK")
+            elif verb == "RCPT":
+                recipients.append(command[8:].strip())
+                self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                data = self.read_data()
+                self.server.received += 1
+                roll = random.random()
+                if roll < self.server.reject_rate:
+                    self.reply("550 5.7.1 Rejected by smtp-sink")
+                elif roll < self.server.reject_rate + self.server.fail_rate:
+                    self.reply("451 4.3.0 Try again later")
+                else:
+                    message = message_from_bytes(data)
+                    self.server.delivered.append(message)
+                    print(f"#{self.server.received} {sender} -> {', '.join(recipients)}: {message['Subject']}", flush=True)
+                    self.reply(f"250 OK queued as {self.server.received}")
+            elif verb == "RSET":
+                sender, recipients = None, []
+                self.reply("250 OK")
+            elif verb == "NOOP":
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+    def read_data(self) -> bytes:
+        lines = []
+        while True:
+            line = self.rfile.readline()
+            if not line or line in (b".\r\n", b".\n"):
+                return b"".join(lines)
+            # Undo dot-stuffing
+            lines.append(line[1:] if line.startswith(b"..") else line)
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, fail_rate: float = 0.0, reject_rate: float = 0.0):
+        super().__init__(address, SMTPHandler)
+        self.fail_rate = fail_rate
+        self.reject_rate = reject_rate
+        self.received = 0
+        self.connections = 0
+        self.delivered = []  # accepted messages (email.message.Message)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1025)
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of messages answered with 451")
+    parser.add_argument("--reject-rate", type=float, default=0.0, help="share of messages answered with 550")
+    args = parser.parse_args()
+    with SMTPSink((args.host, args.port), args.fail_rate, args.reject_rate) as server:
+        print(f"smtp-sink listening on {args.host}:{args.port}", flush=True)
+        server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
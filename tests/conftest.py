@@ -0,0 +1,91 @@
+"""Fixtures: an app per test module on its own throwaway SQLite database.
+
+A module can set ``APP_CONFIG = {...}`` to override Config attributes for its
+app (read when the app is created, like the environment variables behind them).
+"""
+
+import os
+import sys
+import tempfile
+import threading
+from contextlib import contextmanager
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp(prefix="chat-tests-")
+
+# The app package and scripts/ (the SMTP stand-in), also when pytest runs from elsewhere
+sys.path.insert(0, ROOT)
+
+# Before the app package is imported: Config reads the environment at import time
+os.environ.update(
+    DATABASE_URL=f"sqlite:///{os.path.join(WORKDIR, 'default.db')}",
+    ARCHIVE_FOLDER=os.path.join(WORKDIR, "archive"),
+    AUTO_INIT_DB="true",
+    STARTUP_REPORT="false",
+    MAIL_OUTBOX_SENDER="false",
+    PASSWORD_HASH_ROUNDS="4",
+)
+
+ADMIN_EMAIL = "admin@example.com"
+ADMIN_PASSWORD = "admin123"
+_MISSING = object()
+
+
+def make_app(**config):
+    """create_app() with some Config attributes overridden."""
+    from app import create_app
+    from app.config import Config
+
+    config.setdefault("SQLALCHEMY_DATABASE_URI", f"sqlite:///{tempfile.mktemp(suffix='.db', dir=WORKDIR)}")
+    saved = {name: Config.__dict__.get(name, _MISSING) for name in config}
+    for name, value in config.items():
+        setattr(Config, name, value)
+    try:
+        return create_app()
+    finally:
+        for name, value in saved.items():
+            if value is _MISSING:
+                delattr(Config, name)
+            else:
+                setattr(Config, name, value)
+
+
+@pytest.fixture(scope="module")
+def app(request):
+    return make_app(**getattr(request.module, "APP_CONFIG", {}))
+
+
+@pytest.fixture
+def client(app):
+    """Test client logged in as the seeded admin."""
+    client = app.test_client()
+    response = client.post("/auth/login", json={"email": ADMIN_EMAIL, "password": ADMIN_PASSWORD})
+    assert response.status_code == 200, response.get_json()
+    return client
+
+
+@pytest.fixture
+def count_queries():
+    """``with count_queries() as statements:`` collects the SQL this thread sends, on any engine."""
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    @contextmanager
+    def counting():
+        statements = []
+        thread = threading.get_ident()
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            # Background tasks (replica health checks, outbox sender) run on other threads
+            if threading.get_ident() == thread:
+                statements.append(statement)
+
+        event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(Engine, "before_cursor_execute", before_cursor_execute)
+
+    return counting
@@ -0,0 +1,87 @@
+"""Avatar uploads are processed in the background; the client polls for the result."""
+
+import io
+import os
+import shutil
+import threading
+import time
+
+from PIL import Image
+
+from app.extensions import db
+from app.models.user import User
+from app.services.avatar_pipeline import avatar_pipeline
+from conftest import WORKDIR
+
+
+UPLOAD_FOLDER = os.path.join(WORKDIR, "uploads")
+APP_CONFIG = {"UPLOAD_FOLDER": UPLOAD_FOLDER}
+
+
+def _png() -> bytes:
+    data = io.BytesIO()
+    Image.new("RGBA", (300, 200), (255, 0, 0, 128)).save(data, "PNG")
+    return data.getvalue()
+
+
+def _upload(client, data: bytes) -> dict:
+    response = client.post("/auth/profile/upload", data={"file": (io.BytesIO(data), "avatar.png")}, content_type="multipart/form-data")
+    assert response.status_code == 202, response.get_json()
+    job_id = response.get_json()["job_id"]
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        status = client.get(f"/auth/profile/upload/{job_id}").get_json()
+        if status["status"] in ("done", "failed"):
+            return status
+        time.sleep(0.02)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def test_upload_into_missing_folder(client):
+    # A fresh deploy, or the folder removed while running
+    shutil.rmtree(UPLOAD_FOLDER, ignore_errors=True)
+    status = _upload(client, _png())
+    assert status["status"] == "done", status
+    assert os.path.exists(os.path.join(UPLOAD_FOLDER, status["image"]))
+    for variant in status["variants"].values():
+        assert os.path.exists(os.path.join(UPLOAD_FOLDER, variant))
+
+
+def test_failure_does_not_leak_details(client):
+    # A valid PNG header with the image data cut off: accepted, fails in the pipeline
+    status = _upload(client, _png()[:80])
+    assert status["status"] == "failed"
+    assert status["error"] == "上傳失敗"
+
+
+def test_release_waits_for_an_identical_upload(app, client):
+    image = _upload(client, _png())["image"]
+    stem = os.path.splitext(image)[0]
+    with app.app_context():
+        other = User(email="same-avatar@example.com", name="same avatar", password_hash="x")
+        db.session.add(other)
+        db.session.commit()
+        other_id = other.id
+
+    # Another user's job for the same bytes: it found the files in place and is
+    # about to commit User.image when the first user's old avatar is released
+    holding = threading.Event()
+
+    def identical_job():
+        with app.app_context(), avatar_pipeline._stem_lock(stem):
+            holding.set()
+            time.sleep(0.2)
+            db.session.get(User, other_id).image = image
+            db.session.commit()
+
+    job = threading.Thread(target=identical_job)
+    job.start()
+    holding.wait()
+    with app.app_context():
+        User.query.filter_by(email="admin@example.com").one().image = None
+        db.session.commit()
+        avatar_pipeline.release(image, UPLOAD_FOLDER)
+    job.join()
+
+    assert os.path.exists(os.path.join(UPLOAD_FOLDER, image))
+    assert os.path.exists(os.path.join(UPLOAD_FOLDER, avatar_pipeline.variant(image)))
@@ -0,0 +1,55 @@
+"""POST /messages/sync: missed messages per room, or reload when there is no position."""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.extensions import db
+from app.models.message import Message
+from app.models.room import Room
+
+
+# Answered from the database, not the newest-messages buffer
+APP_CONFIG = {"MESSAGE_CACHE_ENABLED": False, "SYNC_MAX_MESSAGES": 5}
+
+
+@pytest.fixture(scope="module")
+def room(app):
+    with app.app_context():
+        room = Room(name="sync room", created_by=1)
+        db.session.add(room)
+        db.session.flush()
+        started = datetime.utcnow() - timedelta(hours=1)
+        db.session.execute(db.insert(Message), [
+            {"room_id": room.id, "user_id": 1, "content": f"m{i}", "created_at": started + timedelta(seconds=i)}
+            for i in range(10)
+        ])
+        db.session.commit()
+        ids = [m.id for m in Message.query.filter_by(room_id=room.id).order_by(Message.id)]
+        return {"id": room.id, "message_ids": ids}
+
+
+def _sync(client, room_id, last_id):
+    response = client.post("/messages/sync", json={"rooms": {str(room_id): last_id}})
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()["rooms"][str(room_id)]
+
+
+def test_missed_messages_after_last_seen(client, room):
+    ids = room["message_ids"]
+    result = _sync(client, room["id"], ids[6])
+    assert result["reload"] is False
+    assert [m["id"] for m in result["messages"]] == ids[7:]
+
+
+def test_nothing_missed(client, room):
+    assert _sync(client, room["id"], room["message_ids"][-1]) == {"messages": [], "reload": False}
+
+
+def test_too_many_missed(client, room):
+    assert _sync(client, room["id"], room["message_ids"][0]) == {"messages": [], "reload": True}
+
+
+def test_unknown_last_seen_message_reloads(client, room):
+    # Archived, not flushed yet by write-behind, or never existed: no position to continue from
+    assert _sync(client, room["id"], room["message_ids"][-1] + 1000) == {"messages": [], "reload": True}
@@ -0,0 +1,131 @@
+"""Feedback mail goes through the outbox, sent to a local SMTP stand-in (scripts/smtp_sink.py)."""
+
+import threading
+from datetime import datetime
+
+import pytest
+
+from app.extensions import db
+from app.models.feedback import Feedback
+from app.models.mail_job import MailJob
+from app.services.mail_outbox import mail_outbox
+from scripts.smtp_sink import SMTPSink
+
+
+SINK = SMTPSink(("127.0.0.1", 0))
+APP_CONFIG = {
+    "MAIL_SERVER": "127.0.0.1",
+    "MAIL_PORT": SINK.server_address[1],
+    "MAIL_USE_TLS": False,
+    "MAIL_USE_SSL": False,
+    "MAIL_USERNAME": "",
+    "MAIL_PASSWORD": "",
+    "MAIL_OUTBOX_BATCH_SIZE": 10,
+    "MAIL_MAX_ATTEMPTS": 3,
+    # Sent by the tests with send_due(), not the background sender
+    "MAIL_OUTBOX_SENDER": False,
+}
+
+
+@pytest.fixture(scope="module", autouse=True)
+def sink():
+    thread = threading.Thread(target=SINK.serve_forever, daemon=True)
+    thread.start()
+    yield SINK
+    SINK.shutdown()
+    SINK.server_close()
+
+
+@pytest.fixture(autouse=True)
+def clean(app, sink):
+    with app.app_context():
+        MailJob.query.delete()
+        db.session.commit()
+    sink.fail_rate = sink.reject_rate = 0.0
+    sink.delivered.clear()
+    sink.connections = 0
+    yield
+
+
+def _feedback(client, subject="Hello"):
+    response = client.post("/feedback", json={"name": "n", "email": "n@example.com", "subject": subject, "message": "m"})
+    assert response.status_code == 200, response.get_json()
+
+
+def _jobs(app):
+    with app.app_context():
+        return [(job.subject, job.status, job.attempts) for job in MailJob.query.order_by(MailJob.id)]
+
+
+def _make_due(app):
+    with app.app_context():
+        MailJob.query.update({"next_attempt_at": datetime.utcnow()})
+        db.session.commit()
+
+
+def test_feedback_is_queued_then_sent_in_one_connection(app, sink):
+    client = app.test_client()
+    for i in range(5):
+        _feedback(client, f"s{i}")
+    assert [status for _, status, _ in _jobs(app)] == ["pending"] * 5
+    assert sink.delivered == []
+
+    with app.app_context():
+        assert mail_outbox.send_due() == (5, 0)
+    assert sorted(m["Subject"] for m in sink.delivered) == [f"Feedback: s{i}" for i in range(5)]
+    assert sink.connections == 1
+    assert [status for _, status, _ in _jobs(app)] == ["sent"] * 5
+
+
+def test_long_subject_fits_the_outbox(app):
+    # Feedback.subject takes 255 characters; the mail subject adds "Feedback: "
+    _feedback(app.test_client(), "x" * 255)
+    with app.app_context():
+        assert Feedback.query.filter_by(subject="x" * 255).count() == 1
+    [(subject, status, _)] = _jobs(app)
+    assert status == "pending"
+    assert len(subject) <= MailJob.subject.type.length
+    assert subject.startswith("Feedback: xxx")
+
+
+def test_temporary_failure_is_retried_with_backoff(app, sink):
+    _feedback(app.test_client())
+    sink.fail_rate = 1.0
+    with app.app_context():
+        assert mail_outbox.send_due() == (0, 1)
+        job = MailJob.query.one()
+        assert (job.status, job.attempts) == ("pending", 1)
+        assert job.next_attempt_at > datetime.utcnow()
+        assert "451" in job.last_error
+        # Not due yet
+        assert mail_outbox.send_due() == (0, 0)
+
+    sink.fail_rate = 0.0
+    _make_due(app)
+    with app.app_context():
+        assert mail_outbox.send_due() == (1, 0)
+    assert _jobs(app) == [("Feedback: Hello", "sent", 2)]
+
+
+def test_dead_after_max_attempts_and_retry_dead(app, sink):
+    _feedback(app.test_client())
+    sink.fail_rate = 1.0
+    for _ in range(APP_CONFIG["MAIL_MAX_ATTEMPTS"]):
+        _make_due(app)
+        with app.app_context():
+            mail_outbox.send_due()
+    assert _jobs(app) == [("Feedback: Hello", "dead", 3)]
+
+    sink.fail_rate = 0.0
+    result = app.test_cli_runner().invoke(args=["mail-outbox", "--retry-dead"])
+    assert "Requeued 1 dead mails" in result.output
+    assert "Sent 1 mails" in result.output
+    assert _jobs(app) == [("Feedback: Hello", "sent", 1)]
+
+
+def test_permanent_rejection_is_dead_at_once(app, sink):
+    _feedback(app.test_client())
+    sink.reject_rate = 1.0
+    with app.app_context():
+        assert mail_outbox.send_due() == (0, 1)
+    assert _jobs(app) == [("Feedback: Hello", "dead", 1)]
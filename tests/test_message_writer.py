@@ -0,0 +1,72 @@
+"""Write-behind flushing: ids another writer already took, settings that would share ids."""
+
+import logging
+
+import pytest
+
+from app.extensions import db
+from app.models.message import Message
+from app.models.room import Room
+from app.services.message_writer import _check_id_ranges, message_writer
+
+
+APP_CONFIG = {"MESSAGE_WRITE_MODE": "write_behind"}
+
+
+@pytest.fixture(scope="module")
+def room_id(app):
+    with app.app_context():
+        room = Room(name="writer room", created_by=1)
+        db.session.add(room)
+        db.session.commit()
+        return room.id
+
+
+def _stored(app, room_id):
+    with app.app_context():
+        return {m.id: m.content for m in Message.query.filter_by(room_id=room_id)}
+
+
+def test_taken_id_is_reassigned_not_dropped(app, room_id):
+    with app.app_context():
+        # Another node's worker with the same offset wrote this id first
+        other = Message(room_id=room_id, user_id=1, content="from the other node")
+        db.session.add(other)
+        db.session.commit()
+        taken = other.id
+    message_writer._next_id = taken
+    dead_lettered = message_writer.dead_lettered
+
+    row = message_writer.submit(room_id, 1, "from this node")
+    assert row["id"] == taken
+    assert message_writer.flush()
+
+    stored = _stored(app, room_id)
+    assert stored[taken] == "from the other node"
+    assert row["id"] > taken and stored[row["id"]] == "from this node"
+    assert message_writer.dead_lettered == dead_lettered
+
+
+def test_row_written_by_an_earlier_attempt_is_not_duplicated(app, room_id):
+    message_writer._next_id = None
+    dead_lettered = message_writer.dead_lettered
+    row = message_writer.submit(room_id, 1, "written once")
+    assert message_writer.flush()
+
+    # A commit that succeeded but reported a failure puts the batch back
+    with message_writer._cond:
+        message_writer._pending.append(row)
+    assert message_writer.flush()
+
+    assert list(_stored(app, room_id).values()).count("written once") == 1
+    assert message_writer.dead_lettered == dead_lettered
+
+
+def test_settings_that_share_ids_are_logged(caplog):
+    with caplog.at_level(logging.ERROR, logger="app.services.message_writer"):
+        _check_id_ranges(1, "")
+        _check_id_ranges(4, "2")
+        assert not caplog.records
+        _check_id_ranges(4, "")
+        _check_id_ranges(4, "4")
+    assert len(caplog.records) == 2
@@ -0,0 +1,91 @@
+"""History, /rooms and /members send the same number of queries whatever the page size."""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.extensions import db
+from app.models.membership import RoomMembership
+from app.models.message import Message
+from app.models.room import Room
+from app.models.user import User
+
+
+# No process caches, so every request takes the database path
+APP_CONFIG = {
+    "MESSAGE_CACHE_ENABLED": False,
+    "USER_CACHE_TTL_SECONDS": 0,
+    "ROOM_DIRECTORY_TTL_SECONDS": 0,
+}
+
+AUTHORS = 30
+
+
+@pytest.fixture(scope="module")
+def data(app):
+    """Two rooms, one with 3 messages and one with 300 from 30 different authors."""
+    with app.app_context():
+        admin = User.query.filter_by(role="admin").first()
+        authors = [User(name=f"author {i:02d}", email=f"author{i}@example.com", password_hash="x") for i in range(AUTHORS)]
+        db.session.add_all(authors)
+        small = Room(name="small room", created_by=admin.id)
+        large = Room(name="large room", created_by=admin.id)
+        db.session.add_all([small, large])
+        db.session.flush()
+        started = datetime.utcnow() - timedelta(days=1)
+        rows = [
+            {"room_id": small.id, "user_id": authors[i].id, "content": f"small {i}", "created_at": started + timedelta(seconds=i)}
+            for i in range(3)
+        ] + [
+            {"room_id": large.id, "user_id": authors[i % AUTHORS].id, "content": f"large {i}", "created_at": started + timedelta(seconds=i)}
+            for i in range(300)
+        ]
+        db.session.execute(db.insert(Message), rows)
+        db.session.commit()
+        return {"small": small.id, "large": large.id, "admin": admin.id}
+
+
+def _queries(client, count_queries, url):
+    with count_queries() as statements:
+        response = client.get(url)
+    assert response.status_code == 200, response.get_json()
+    return len(statements), response
+
+
+def test_newest_history_page(client, count_queries, data):
+    small, small_page = _queries(client, count_queries, f"/rooms/{data['small']}/messages?limit=5")
+    large, large_page = _queries(client, count_queries, f"/rooms/{data['large']}/messages?limit=200")
+    assert len(small_page.get_json()) == 3
+    assert len(large_page.get_json()) == 200
+    assert small == large
+
+
+def test_older_history_page(client, count_queries, data):
+    first = client.get(f"/rooms/{data['large']}/messages?limit=10")
+    cursor = first.headers["X-Before-Cursor"]
+    small, small_page = _queries(client, count_queries, f"/rooms/{data['large']}/messages?limit=2&before={cursor}")
+    large, large_page = _queries(client, count_queries, f"/rooms/{data['large']}/messages?limit=200&before={cursor}")
+    assert len(small_page.get_json()) == 2
+    assert len(large_page.get_json()) == 200
+    assert small == large
+
+
+def test_rooms(app, client, count_queries, data):
+    few, few_rooms = _queries(client, count_queries, "/rooms")
+    with app.app_context():
+        rooms = [Room(name=f"extra room {i}", created_by=data["admin"]) for i in range(40)]
+        db.session.add_all(rooms)
+        db.session.flush()
+        db.session.add_all(RoomMembership(user_id=data["admin"], room_id=room.id) for room in rooms)
+        db.session.commit()
+    many, many_rooms = _queries(client, count_queries, "/rooms")
+    assert len(many_rooms.get_json()) == len(few_rooms.get_json()) + 40
+    assert few == many
+
+
+def test_members(client, count_queries, data):
+    small, small_page = _queries(client, count_queries, "/members?limit=2")
+    large, large_page = _queries(client, count_queries, f"/members?limit={AUTHORS}")
+    assert len(small_page.get_json()) == 2
+    assert len(large_page.get_json()) == AUTHORS
+    assert small == large
@@ -0,0 +1,162 @@
+"""Read replicas: two SQLite stand-ins copied from the primary by scripts/replica_standin.py."""
+
+import os
+import sqlite3
+import time
+from datetime import datetime
+
+import pytest
+
+from app.extensions import db
+from app.models.message import Message
+from app.models.room import Room
+from app.models.user import User
+from app.services.replicas import replica_router
+from conftest import WORKDIR
+from scripts.replica_standin import copy
+
+
+PRIMARY = os.path.join(WORKDIR, "primary.db")
+REPLICAS = [os.path.join(WORKDIR, "replica1.db"), os.path.join(WORKDIR, "replica2.db")]
+APP_CONFIG = {
+    "SQLALCHEMY_DATABASE_URI": f"sqlite:///{PRIMARY}",
+    "DATABASE_REPLICA_URLS": ",".join(f"sqlite:///{path}" for path in REPLICAS),
+    "REPLICA_MAX_LAG_SECONDS": 5,
+    # The tests run the health checks themselves
+    "REPLICA_HEALTH_INTERVAL_SECONDS": 3600,
+    # History pages from the database, not the newest-messages buffer
+    "MESSAGE_CACHE_ENABLED": False,
+}
+
+
+def replicate() -> None:
+    for path in REPLICAS:
+        copy(PRIMARY, path)
+
+
+def set_replica_beat(path: str, beat_ms: int) -> None:
+    with sqlite3.connect(path) as conn:
+        conn.execute("UPDATE replica_heartbeat SET beat_ms = ?", (beat_ms,))
+
+
+@pytest.fixture(scope="module")
+def room(app):
+    with app.app_context():
+        reader = User(email="reader@example.com", name="reader", role="member")
+        reader.set_password("secret")
+        db.session.add(reader)
+        room = Room(name="replicated room", created_by=1)
+        db.session.add(room)
+        db.session.commit()
+        db.session.add(Message(room_id=room.id, user_id=1, content="replicated"))
+        db.session.commit()
+        room_id = room.id
+    replica_router.choose()  # starts the background monitor, which the tests then leave alone
+    replica_router.check()
+    replicate()
+    return room_id
+
+
+@pytest.fixture(autouse=True)
+def healthy(room):
+    """Every test starts with both replicas caught up and in rotation."""
+    replica_router.check()
+    replicate()
+    replica_router.check()
+    assert [replica.healthy for replica in replica_router.replicas] == [True, True]
+
+
+@pytest.fixture
+def reader(app):
+    client = app.test_client()
+    response = client.post("/auth/login", json={"email": "reader@example.com", "password": "secret"})
+    assert response.status_code == 200
+    return client
+
+
+def _history(client, room_id):
+    response = client.get(f"/rooms/{room_id}/messages")
+    assert response.status_code == 200, response.get_json()
+    return [m["content"] for m in response.get_json()], response
+
+
+def _reads():
+    return [replica.reads for replica in replica_router.replicas]
+
+
+def _write_on_primary(app, room_id, content):
+    # Outside any request: nobody is marked as having written
+    with app.app_context():
+        db.session.add(Message(room_id=room_id, user_id=1, content=content, created_at=datetime.utcnow()))
+        db.session.commit()
+
+
+def test_reads_round_robin_over_healthy_replicas(app, reader, room):
+    with app.app_context():
+        room_no = Room.query.filter(Room.room_no.isnot(None)).first().room_no
+    before = _reads()
+    for _ in range(4):
+        _history(reader, room)
+        assert reader.get("/members").status_code == 200
+        assert reader.get(f"/rooms/info/{room_no}").status_code == 200
+    assert [after - start for after, start in zip(_reads(), before)] == [6, 6]
+
+
+def test_replica_data_is_served_and_untagged(app, reader, room):
+    _write_on_primary(app, room, "not replicated yet")
+    contents, response = _history(reader, room)
+    assert "not replicated yet" not in contents
+    # A tag for a possibly stale body could be reused once the replica caught up
+    assert "ETag" not in response.headers
+    replicate()
+    assert "not replicated yet" in _history(reader, room)[0]
+
+
+def test_writer_reads_own_writes_from_primary(app, client, reader, room):
+    with app.app_context():
+        other = Room(name="room to join", created_by=1)
+        db.session.add(other)
+        db.session.commit()
+        other_id = other.id
+    _write_on_primary(app, room, "written just now")
+    # Joining commits as the admin: their reads go to the primary for a while
+    assert client.post(f"/rooms/{other_id}/join").status_code == 200
+    before = _reads()
+    assert "written just now" in _history(client, room)[0]
+    assert _reads() == before
+    # Other users still read the replicas
+    assert "written just now" not in _history(reader, room)[0]
+    assert replica_router.stats()["users_on_primary"] >= 1
+
+
+def test_lagging_replica_leaves_rotation(app, reader, room):
+    set_replica_beat(REPLICAS[0], int((time.time() - 60) * 1000))
+    replica_router.check()
+    lagging, current = replica_router.replicas
+    assert not lagging.healthy and lagging.lag > APP_CONFIG["REPLICA_MAX_LAG_SECONDS"]
+    assert current.healthy
+    before = _reads()
+    for _ in range(3):
+        _history(reader, room)
+    assert [after - start for after, start in zip(_reads(), before)] == [0, 3]
+
+
+def test_broken_replica_leaves_rotation(reader, room):
+    with sqlite3.connect(REPLICAS[1]) as conn:
+        conn.execute("DROP TABLE replica_heartbeat")
+    replica_router.check()
+    working, broken = replica_router.replicas
+    assert working.healthy
+    assert not broken.healthy and broken.error
+
+
+def test_no_healthy_replica_reads_primary(app, reader, room):
+    stale = int((time.time() - 60) * 1000)
+    for path in REPLICAS:
+        set_replica_beat(path, stale)
+    replica_router.check()
+    _write_on_primary(app, room, "only on the primary")
+    before, fallbacks = _reads(), replica_router.no_replica
+    assert "only on the primary" in _history(reader, room)[0]
+    assert _reads() == before
+    assert replica_router.no_replica == fallbacks + 1
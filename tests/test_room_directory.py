@@ -0,0 +1,61 @@
+"""GET /rooms ETags follow changes the directory only picks up when its entries expire."""
+
+import pytest
+
+from app.extensions import db
+from app.models.membership import RoomMembership
+from app.models.room import Room
+from app.services.room_directory import room_directory
+
+
+@pytest.fixture(scope="module")
+def room_id(app):
+    with app.app_context():
+        room = Room(name="directory room", created_by=1)
+        db.session.add(room)
+        db.session.commit()
+        return room.id
+
+
+def _expire():
+    with room_directory._lock:
+        room_directory._directory.expires = 0
+        for user_id, (_, room_ids) in list(room_directory._members.items()):
+            room_directory._members[user_id] = (0, room_ids)
+
+
+def _room(response, room_id):
+    return next(r for r in response.get_json() if r["id"] == room_id)
+
+
+def test_room_change_outside_the_app(app, client, room_id):
+    first = client.get("/rooms")
+    etag = first.headers["ETag"]
+    with app.app_context():
+        # No invalidation: only the TTL notices
+        db.session.get(Room, room_id).name = "renamed room"
+        db.session.commit()
+    assert client.get("/rooms", headers={"If-None-Match": etag}).status_code == 304
+
+    _expire()
+    response = client.get("/rooms", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert _room(response, room_id)["name"] == "renamed room"
+
+
+def test_membership_change_outside_the_app(app, client, room_id):
+    etag = client.get("/rooms").headers["ETag"]
+    with app.app_context():
+        db.session.add(RoomMembership(user_id=1, room_id=room_id))
+        db.session.commit()
+
+    _expire()
+    response = client.get("/rooms", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert _room(response, room_id)["is_member"]
+
+
+def test_unchanged_reload_keeps_the_tag(client):
+    etag = client.get("/rooms").headers["ETag"]
+    _expire()
+    assert client.get("/rooms", headers={"If-None-Match": etag}).status_code == 304
@@ -0,0 +1,29 @@
+"""room_no node ids: ROOM_NO_NODE_ID is used as given, or rejected, never wrapped."""
+
+import logging
+
+from app.services.room_numbers import RoomNumberAllocator, _host_node_id
+
+
+class _App:
+    def __init__(self, **config):
+        self.config = config
+
+
+def _node_id(value) -> int:
+    allocator = RoomNumberAllocator()
+    allocator.init_app(_App(ROOM_NO_NODE_ID=value))
+    return allocator.node_id
+
+
+def test_node_id_from_config():
+    assert _node_id("0") == 0
+    assert _node_id("65535") == 65535
+    assert _node_id("") == _host_node_id()
+
+
+def test_invalid_node_id_falls_back_to_host_hash(caplog):
+    with caplog.at_level(logging.WARNING, logger="app.services.room_numbers"):
+        for value in ("node-a", "65536", "-1"):
+            assert _node_id(value) == _host_node_id()
+    assert len(caplog.records) == 3
@@ -0,0 +1,66 @@
+"""Message search: who may search a room, and CJK matching."""
+
+import pytest
+
+from app.extensions import db
+from app.models.membership import RoomMembership
+from app.models.room import Room
+from app.services.message_writer import message_writer
+
+
+@pytest.fixture(scope="module")
+def rooms(app):
+    with app.app_context():
+        public = Room(name="public search", created_by=1, room_type="public")
+        private = Room(name="private search", created_by=1, room_type="private")
+        db.session.add_all([public, private])
+        db.session.commit()
+        for room in (public, private):
+            for content in ("今天天氣很好", "好久不見", "天氣預報", "hello world"):
+                message_writer.submit(room.id, 1, content)
+        return {"public": public.id, "private": private.id}
+
+
+@pytest.fixture
+def member(app):
+    """A logged-in member with no room memberships."""
+    client = app.test_client()
+    response = client.post("/auth/register", json={"email": "searcher@example.com", "password": "secret", "name": "searcher"})
+    if response.status_code == 409:
+        response = client.post("/auth/login", json={"email": "searcher@example.com", "password": "secret"})
+    assert response.status_code in (200, 201), response.get_json()
+    return client
+
+
+def _contents(client, room_id, q):
+    response = client.get(f"/rooms/{room_id}/messages/search", query_string={"q": q})
+    assert response.status_code == 200, response.get_json()
+    return sorted(m["content"] for m in response.get_json())
+
+
+def test_private_room_needs_membership(app, member, rooms):
+    response = member.get(f"/rooms/{rooms['private']}/messages/search", query_string={"q": "hello"})
+    assert response.status_code == 403
+    assert _contents(member, rooms["public"], "hello") == ["hello world"]
+
+    with app.app_context():
+        user_id = db.session.execute(db.text("SELECT id FROM users WHERE email = 'searcher@example.com'")).scalar()
+        db.session.add(RoomMembership(user_id=user_id, room_id=rooms["private"]))
+        db.session.commit()
+    assert _contents(member, rooms["private"], "hello") == ["hello world"]
+
+
+def test_admin_and_unknown_room(client, rooms):
+    assert _contents(client, rooms["private"], "hello") == ["hello world"]
+    assert client.get("/rooms/999999/messages/search?q=hello").status_code == 404
+
+
+def test_cjk_single_character(client, rooms):
+    assert _contents(client, rooms["public"], "好") == ["今天天氣很好", "好久不見"]
+    assert _contents(client, rooms["public"], "預") == ["天氣預報"]
+
+
+def test_cjk_words(client, rooms):
+    assert _contents(client, rooms["public"], "天氣") == ["今天天氣很好", "天氣預報"]
+    assert _contents(client, rooms["public"], "天氣很好") == ["今天天氣很好"]
+    assert _contents(client, rooms["public"], "氣很") == ["今天天氣很好"]
@@ -1,5 +1,18 @@
-from app import create_app
-from app.extensions import socketio
+import os
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# Cooperative mode: patch the standard library before anything imports sockets or threads
+if os.getenv("SOCKETIO_ASYNC_MODE", "threading").strip().lower() == "eventlet":
+    import eventlet
+
+    eventlet.monkey_patch()
+
+from app import create_app  # noqa: E402
+from app.extensions import socketio  # noqa: E402
 
 
 app = create_app()
@@ -9,7 +22,14 @@ application = app
 
 
 if __name__ == "__main__":
-    # eventlet is the default async_mode configured in extensions
-    socketio.run(app, host="0.0.0.0", port=5000, debug=True)
-
+    if app.config["SOCKETIO_ASYNC_MODE"] == "eventlet":
+        # One process, one green thread per connection; not for uWSGI (see README)
+        from eventlet import wsgi as eventlet_wsgi
 
+        listener = eventlet.listen(
+            (os.getenv("HOST", "0.0.0.0"), int(os.getenv("PORT", "5000"))),
+            backlog=app.config["SOCKETIO_LISTEN_BACKLOG"],
+        )
+        eventlet_wsgi.server(listener, app, max_size=app.config["SOCKETIO_MAX_CONNECTIONS"], log_output=False)
+    else:
+        socketio.run(app, host="0.0.0.0", port=5000, debug=True)